@@ -0,0 +1,367 @@
+#!/usr/bin/python
+
+"""
+Runs the agents' requests() and uploads() in worker processes
+(sim.py --agent-workers N).
+
+Within a round every requests() call only depends on the round-start
+snapshot, and every uploads() call only on that snapshot and the collected
+requests, so the peers can be split across processes.  Each worker owns a
+contiguous slice of the peers -- the agent objects are built there, from
+the same specs the sim would build them from, and never come back to the
+sim -- and keeps its own copy of everything they read:
+
+  - The snapshot of available pieces is one peers x pieces byte array in
+    shared memory.  The sim writes the rows of peers that finished a piece,
+    and each worker rebuilds the PeerInfos for just those rows.
+  - Each round's downloads and uploads are pickled once and sent to every
+    worker, which replays them into its own History and its own peers'
+    blocks per piece, the same way the sim does.
+
+Agents get the same peer.rng streams as in the sim's own process, so a run
+gives the same results for any number of agent workers, including none.
+For agents that use the random module instead, --seed reseeds it before
+each call (see sim.call_seed), whichever process the call runs in.
+
+With --profile phases, each worker times its agents' calls with its own
+PhaseTimer and sends the per-class totals back with every reply, to be
+added to the sim's.  Those are summed over the workers, so they can add
+up to more than the wall time of the phase they ran in.
+"""
+
+import cPickle
+import multiprocessing
+import random
+import traceback
+from multiprocessing.sharedctypes import RawArray
+
+from batch import AgentBatch, group_calls
+from history import History
+from messages import PeerInfo, OtherPeers, NeighborPeers
+from state import PieceMatrix, ReplicaCounts, NeighborhoodCounts
+
+
+class AgentWorkerError(Exception):
+    pass
+
+
+class RemotePeer(object):
+    """Stands in for an agent that lives in a worker process."""
+    __slots__ = ('class_name', 'id')
+
+    def __init__(self, class_name, id):
+        self.class_name = class_name
+        self.id = id
+
+    def __repr__(self):
+        return "RemotePeer(%s)" % self.id
+
+
+class AgentWorker:
+    """The state one worker process keeps for its slice of the peers."""
+    def __init__(self, config, specs, first, peer_ids, upload_rates,
+                 available, snapshot_set, peer_rng, seed_base, timer_class):
+        """
+        specs: (class name, id, pieces, up_bw) for this worker's peers,
+               which are at positions first, first+1, ... in peer_ids
+        snapshot_set: function list of piece ids -> the read-only set
+                      agents see as PeerInfo.available_pieces
+        peer_rng: function peer id -> the agent's random stream
+        timer_class: the class of the sim's timer (see profiling.py)
+
+        The agents themselves only get built by start(), in the worker's
+        own process.
+        """
+        self.config = config
+        self.specs = specs
+        self.first = first
+        self.peer_ids = peer_ids
+        self.upload_rates = upload_rates
+        self.available = available
+        self.snapshot_set = snapshot_set
+        self.peer_rng = peer_rng
+        self.seed_base = seed_base
+        self.timer_class = timer_class
+        self.agents = None
+
+    def start(self):
+        """Build the agents and everything they read"""
+        config = self.config
+        specs = self.specs
+        self.timer = self.timer_class()
+        self.agents = [config.agent_classes[class_name](config, id, pieces, bw)
+                       for (class_name, id, pieces, bw) in specs]
+        for p in self.agents:
+            p.rng = self.peer_rng(p.id)
+        my_ids = [p.id for p in self.agents]
+        if config.piece_state == "matrix":
+            initial = dict((s[1], s[2]) for s in specs)
+            self.pieces = PieceMatrix(my_ids, config.num_pieces,
+                                      initial.__getitem__)
+        else:
+            self.pieces = dict((s[1], s[2][:]) for s in specs)
+        # Kept in step with the snapshot rows, as they come in
+        self.replicas = ReplicaCounts(config.num_pieces, [])
+        self.history = History(self.peer_ids, self.upload_rates,
+                               spill_dir=config.history_dir,
+                               tail_rounds=config.history_tail,
+                               piece_counts=self.replicas.view())
+        self.peer_info = [None] * len(self.peer_ids)
+        self.snapshot = ()
+        self.agent_histories = []
+        self.neighbors = None  # with a topology, per agent
+        self.round = 0
+
+    def seed_call(self, key, method):
+        """key: the peer id, or for a batch call, the class name"""
+        if self.seed_base is not None:
+            # Imported here: sim imports this module
+            from sim import call_seed
+            random.seed(call_seed(self.seed_base, self.round, key, method))
+
+    def view(self, k):
+        """agents[k]'s peers, as the sim would show them"""
+        if self.neighbors is not None:
+            return NeighborPeers(self.snapshot, self.neighbors[k])
+        return OtherPeers(self.snapshot, self.first + k)
+
+    def neighborhood_counts(self, k):
+        """agents[k]'s piece counts, as Sim.neighborhood_counts"""
+        if self.neighbors is None:
+            return None
+        return NeighborhoodCounts(
+            self.snapshot, (self.first + k,) + tuple(self.neighbors[k]),
+            self.config.num_pieces)
+
+    def set_neighbors(self, neighbors):
+        self.neighbors = neighbors
+        return []
+
+    def call_phase(self, method, call_one, requests=None):
+        """
+        Get every agent's answer for one phase: call_one(k, agent) for
+        agents on their own, and one batch call per class that has one
+        (see batch.py).  Returns the answers in agent order.
+        """
+        ans = [None] * len(self.agents)
+        for (batch_method, ks) in group_calls(self.agents, method):
+            if batch_method is None:
+                with self.timer.agent_call(self.agents[ks[0]], method):
+                    ans[ks[0]] = call_one(ks[0], self.agents[ks[0]])
+                continue
+            agents = [self.agents[k] for k in ks]
+            neighbors = None
+            if self.neighbors is not None:
+                neighbors = [self.neighbors[k] for k in ks]
+            batch = AgentBatch(
+                self.config, agents, [self.first + k for k in ks],
+                self.snapshot, [self.agent_histories[k] for k in ks],
+                requests and [requests[k] for k in ks], neighbors)
+            self.seed_call(agents[0].__class__.__name__, method + "_batch")
+            with self.timer.agent_call(agents[0], method + "_batch"):
+                answers = batch_method(batch)
+            for (k, answer) in zip(ks, answers):
+                ans[k] = answer
+        return ans
+
+    def requests(self, round, changed, up_bws):
+        """changed: positions of the peers whose snapshot row changed
+        up_bws: this worker's peers' new upload bandwidths, or None"""
+        if up_bws is not None:
+            for (p, bw) in zip(self.agents, up_bws):
+                p.up_bw = bw
+        n = self.config.num_pieces
+        for i in changed:
+            row = self.available[i * n:(i + 1) * n]
+            if self.peer_info[i] is not None:
+                for piece_id in self.peer_info[i].available_pieces:
+                    self.replicas.remove(piece_id)
+            self.peer_info[i] = PeerInfo(self.peer_ids[i], self.snapshot_set(
+                [piece_id for (piece_id, a) in enumerate(row) if a]))
+            for piece_id in self.peer_info[i].available_pieces:
+                self.replicas.add(piece_id)
+        self.snapshot = tuple(self.peer_info)
+        self.round = round
+        self.agent_histories = [
+            self.history.peer_history(p.id, self.neighborhood_counts(k))
+            for (k, p) in enumerate(self.agents)]
+        for p in self.agents:
+            p.update_pieces(list(self.pieces[p.id]))
+
+        def call_one(k, p):
+            self.seed_call(p.id, "requests")
+            return p.requests(self.view(k), self.agent_histories[k])
+        return self.call_phase("requests", call_one)
+
+    def uploads(self, requests_to):
+        """requests_to: [requests for each of this worker's peers]"""
+        def call_one(k, p):
+            self.seed_call(p.id, "uploads")
+            return p.uploads(requests_to[k], self.view(k),
+                             self.agent_histories[k])
+        return self.call_phase("uploads", call_one, requests_to)
+
+    def update(self, downloads, uploads):
+        """Replay the round's transfers, a DownloadBatch and an UploadBatch,
+        as Sim.run_sim_once applied them."""
+        self.history.update(downloads, uploads)
+        piece = downloads.column("piece")
+        blocks = downloads.column("blocks")
+        if (isinstance(self.pieces, PieceMatrix) and isinstance(blocks, list)
+                and any(isinstance(b, float) for b in blocks)):
+            # The sim's matrix goes to floats for anyone's fractional
+            # blocks; keep ours the same type.
+            self.pieces.widen()
+        for (k, p) in enumerate(self.agents):
+            pieces = self.pieces[p.id]
+            for row in xrange(*downloads.span(self.first + k)):
+                pieces[piece[row]] += blocks[row]
+
+    def serve(self, conn):
+        """Build the agents, then answer calls from the AgentPool until
+        told to stop.  Each reply carries the agent timings since the last
+        one, if the timer keeps any.  If the agents couldn't be built,
+        every call gets that error back."""
+        failed = None
+        try:
+            self.start()
+        except Exception:
+            failed = traceback.format_exc()
+        while True:
+            try:
+                (method, args) = cPickle.loads(conn.recv_bytes())
+            except EOFError:
+                break
+            if method == "stop":
+                break
+            if failed is not None:
+                reply = ("error", failed, None)
+            else:
+                try:
+                    reply = ("ok", getattr(self, method)(*args),
+                             self.timer.take_agent_totals())
+                except Exception:
+                    reply = ("error", traceback.format_exc(), None)
+            conn.send_bytes(cPickle.dumps(reply, cPickle.HIGHEST_PROTOCOL))
+        conn.close()
+
+
+class AgentPool:
+    """
+    The sim's side of the workers.  Calls go out to every worker at once,
+    and the answers come back in peer order.
+    """
+    def __init__(self, config, specs, upload_rates, snapshot_set, peer_rng,
+                 seed_base, num_workers, timer):
+        """timer: the sim's timer, which gets the workers' agent timings"""
+        n = len(specs)
+        self.timer = timer
+        self.num_pieces = config.num_pieces
+        self.peers = [RemotePeer(s[0], s[1]) for s in specs]
+        self.position = dict((p.id, i) for (i, p) in enumerate(self.peers))
+        # peers x pieces, 1 where the piece is available
+        self.available = RawArray('b', n * self.num_pieces)
+        self.changed = []
+        peer_ids = [p.id for p in self.peers]
+        num_workers = max(1, min(num_workers, n))
+        self.slices = []
+        self.conns = []
+        self.procs = []
+        self.pending = 0  # replies not collected yet, per worker
+        for k in range(num_workers):
+            (lo, hi) = (k * n // num_workers, (k + 1) * n // num_workers)
+            worker = AgentWorker(config, specs[lo:hi], lo, peer_ids,
+                                 upload_rates, self.available, snapshot_set,
+                                 peer_rng, seed_base, timer.__class__)
+            (conn, child_conn) = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=worker.serve,
+                                           args=(child_conn,))
+            proc.daemon = True
+            proc.start()
+            child_conn.close()
+            self.slices.append((lo, hi))
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def publish(self, peer_id, pieces):
+        """Set peer_id's row of the shared snapshot to the set pieces."""
+        i = self.position[peer_id]
+        n = self.num_pieces
+        row = [0] * n
+        for piece_id in pieces:
+            row[piece_id] = 1
+        self.available[i * n:(i + 1) * n] = row
+        self.changed.append(i)
+
+    def _send(self, conn, method, args):
+        conn.send_bytes(cPickle.dumps((method, args),
+                                      cPickle.HIGHEST_PROTOCOL))
+
+    def _receive(self, conn):
+        (status, value, agent_totals) = cPickle.loads(conn.recv_bytes())
+        if status == "error":
+            raise AgentWorkerError("Agent worker failed:\n%s" % value)
+        self.timer.add_agent_totals(agent_totals)
+        return value
+
+    def _collect(self):
+        """Wait for the replies nobody has asked for yet"""
+        while self.pending:
+            for conn in self.conns:
+                self._receive(conn)
+            self.pending -= 1
+
+    def _call_each(self, method, args_for):
+        """Call method on every worker, with args_for(lo, hi) for the
+        worker holding peers lo..hi-1.  Returns the replies, in peer
+        order."""
+        self._collect()
+        for (conn, (lo, hi)) in zip(self.conns, self.slices):
+            self._send(conn, method, args_for(lo, hi))
+        ans = []
+        for conn in self.conns:
+            ans.extend(self._receive(conn))
+        return ans
+
+    def requests(self, round, up_bws=None):
+        """Each peer's requests for this round, in peer order.  up_bws:
+        everyone's upload bandwidths, if they changed this round."""
+        changed = self.changed
+        self.changed = []
+        return self._call_each(
+            "requests",
+            lambda lo, hi: (round, changed,
+                            None if up_bws is None else up_bws[lo:hi]))
+
+    def uploads(self, requests_to):
+        """Each peer's uploads, given dict : peer_id -> requests to it"""
+        return self._call_each(
+            "uploads",
+            lambda lo, hi: ([requests_to[p.id] for p in self.peers[lo:hi]],))
+
+    def set_neighbors(self, neighbors):
+        """neighbors: per peer, the positions of its neighbors"""
+        self._call_each("set_neighbors", lambda lo, hi: (neighbors[lo:hi],))
+
+    def update(self, downloads, uploads):
+        """Send the round's transfers to every worker.  Doesn't wait for
+        them to be applied."""
+        self._collect()
+        data = cPickle.dumps(("update", (downloads, uploads)),
+                             cPickle.HIGHEST_PROTOCOL)
+        for conn in self.conns:
+            conn.send_bytes(data)
+        self.pending += 1
+
+    def close(self):
+        try:
+            self._collect()
+        finally:
+            for conn in self.conns:
+                try:
+                    self._send(conn, "stop", ())
+                except IOError:
+                    pass
+                conn.close()
+            for proc in self.procs:
+                proc.join()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+Upload bandwidths (sim.py --bw-dist, --bw-trace).
+
+Every peer's upload bandwidth, in blocks per round, is worked out once at
+the start of a run, into a list indexed by the peer's position in the
+sim's list of peers.  Seeds get --max-bw; everyone else gets a draw from
+the distribution named by --bw-dist.  A distribution is a function
+(rng, conf) -> bandwidth, called once per peer in peer order, that keeps
+to [conf.min_up_bw, conf.max_up_bw].  To add one, put it in DISTRIBUTIONS.
+
+With --bw-trace FILE, bandwidths change from round to round instead,
+following a binary trace:
+
+  header: "BWTRACE1", number of peers, number of rounds (uint32 each)
+  then, for each round, every peer's bandwidth (int32), in peer order
+
+all little-endian.  Column i is the peer at position i, seeds included;
+the distribution isn't used.  Only the header gets checked when the trace
+is opened; a negative bandwidth is caught when its round is read.  After
+its last round the trace starts over.  The file is memory-mapped, so a
+round's row is read straight out of the page cache, without loading the
+whole trace.  Agents see their bandwidth for the round in self.up_bw, and
+the sim holds uploads to it.
+
+To turn a text file with one line per round, holding everyone's
+bandwidths separated by spaces, into a trace:
+
+  ./bandwidth.py rounds.txt trace.bwt
+"""
+
+import mmap
+import struct
+import sys
+
+TRACE_MAGIC = "BWTRACE1"
+HEADER = struct.Struct("<8sII")
+
+# Shape of the pareto distribution's tail: smaller is heavier
+PARETO_ALPHA = 1.5
+
+
+class TraceError(Exception):
+    pass
+
+
+def uniform_dist(rng, conf):
+    """Any whole number from --min-bw to --max-bw, equally likely"""
+    return rng.randint(conf.min_up_bw, conf.max_up_bw)
+
+
+def pareto_dist(rng, conf):
+    """Mostly close to --min-bw, with a few peers up to --max-bw.  Needs
+    --min-bw above 0, since it scales the draws."""
+    bw = int(conf.min_up_bw * rng.paretovariate(PARETO_ALPHA))
+    return min(bw, conf.max_up_bw)
+
+
+def bimodal_dist(rng, conf):
+    """Either --min-bw or --max-bw, like slow links mixed with fast ones"""
+    return rng.choice([conf.min_up_bw, conf.max_up_bw])
+
+
+DISTRIBUTIONS = {
+    "uniform": uniform_dist,
+    "pareto": pareto_dist,
+    "bimodal": bimodal_dist,
+}
+
+
+class Trace(object):
+    """A bandwidth trace file, mapped into memory"""
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        try:
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError, mmap.error), e:
+            raise TraceError("Can't read trace %s: %s" % (self.path, e))
+        if len(self.map) < HEADER.size:
+            raise TraceError("%s is too short to be a trace" % self.path)
+        (magic, self.num_peers, self.num_rounds) = HEADER.unpack_from(
+            self.map)
+        if magic != TRACE_MAGIC:
+            raise TraceError("%s isn't a bandwidth trace" % self.path)
+        self.row_format = struct.Struct("<%di" % self.num_peers)
+        size = HEADER.size + self.num_rounds * self.row_format.size
+        if self.num_rounds == 0 or len(self.map) != size:
+            raise TraceError("%s should be %d bytes for %d peers and %d "
+                             "rounds, but is %d" % (
+                                 self.path, size, self.num_peers,
+                                 self.num_rounds, len(self.map)))
+
+    def offset(self, round):
+        return HEADER.size + (round % self.num_rounds) * self.row_format.size
+
+    def negative(self, round):
+        return TraceError("%s has a negative bandwidth in round %d" % (
+            self.path, round % self.num_rounds))
+
+    def row(self, round):
+        """Everyone's bandwidth in round, in peer order"""
+        row = list(self.row_format.unpack_from(self.map, self.offset(round)))
+        if row and min(row) < 0:
+            raise self.negative(round)
+        return row
+
+    def value(self, round, i):
+        """The bandwidth of the peer at position i in round"""
+        bw = struct.unpack_from("<i", self.map, self.offset(round) + 4 * i)[0]
+        if bw < 0:
+            raise self.negative(round)
+        return bw
+
+    def close(self):
+        self.map.close()
+
+    # The map can't be pickled (for a checkpoint); open the file again
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.path = path
+        self.open()
+
+
+def write_trace(path, rows):
+    """Write a trace file with one row of bandwidths per round, each with
+    one entry per peer"""
+    rows = [list(row) for row in rows]
+    if not rows:
+        raise ValueError("A trace needs at least one round")
+    n = len(rows[0])
+    row_format = struct.Struct("<%di" % n)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(TRACE_MAGIC, n, len(rows)))
+        for (round, row) in enumerate(rows):
+            if len(row) != n:
+                raise ValueError("Round %d has %d peers, not %d" % (
+                    round, len(row), n))
+            if min(row) < 0:
+                raise ValueError("Round %d has a negative bandwidth" % round)
+            f.write(row_format.pack(*row))
+
+
+class Bandwidths:
+    """Every peer's upload bandwidth, as of the current round"""
+    def __init__(self, config, peer_ids, rng):
+        self.position = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.trace = None
+        if config.bw_trace is not None:
+            self.trace = Trace(config.bw_trace)
+            if self.trace.num_peers < len(peer_ids):
+                raise TraceError("%s has %d peers, and the sim has %d" % (
+                    config.bw_trace, self.trace.num_peers, len(peer_ids)))
+            self.capacity = self.trace.row(0)[:len(peer_ids)]
+        else:
+            draw = DISTRIBUTIONS[config.bw_dist]
+            self.capacity = [config.max_up_bw if pid.startswith("Seed")
+                             else draw(rng, config) for pid in peer_ids]
+
+    def of(self, peer_id):
+        return self.capacity[self.position[peer_id]]
+
+    def rates(self):
+        """dict : peer id -> bandwidth"""
+        return dict((pid, self.capacity[i])
+                    for (pid, i) in self.position.items())
+
+    def at_round(self, round):
+        """Move on to round's bandwidths.  Returns whether any changed."""
+        if self.trace is None:
+            return False
+        row = self.trace.row(round)[:len(self.capacity)]
+        if row == self.capacity:
+            return False
+        self.capacity = row
+        return True
+
+
+def main(args):
+    if len(args) != 3:
+        print "Usage: %s ROUNDS.txt TRACE" % args[0]
+        return 1
+    with open(args[1]) as f:
+        rows = [map(int, line.split()) for line in f if line.strip()]
+    try:
+        write_trace(args[2], rows)
+    except ValueError, e:
+        print "%s: %s" % (args[1], e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
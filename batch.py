@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+"""
+Optional class-level agent API.  An agent class can define
+
+    @classmethod
+    def requests_batch(cls, batch): ...
+    @classmethod
+    def uploads_batch(cls, batch): ...
+
+which get an AgentBatch holding all of that class's peers, and return a
+list with one list of Requests (or Uploads) per peer, in batch order.  The
+sim then makes one call per class per phase instead of one per peer, and
+work every peer would repeat -- counting how many peers have each piece,
+say -- can be done once.  Classes without them get the usual per-peer
+Peer.requests() / Peer.uploads() calls.
+
+Batch methods should draw random numbers from each agent's own agent.rng.
+The random module only gets reseeded (with --seed) once per batch call,
+and each agent worker makes its own call for its share of the class's
+peers, so draws from it depend on --agent-workers.
+"""
+
+from bitset import mask_of
+from messages import OtherPeers, NeighborPeers
+from state import NeighborhoodCounts
+
+
+def group_calls(agents, method):
+    """
+    Split agents up for one phase: yields (batch method, indices) in order,
+    where batch method is the class's method + "_batch", called with all
+    the agents of the class at once, at the first of them; or (None, [i])
+    for an agent to call on its own.
+    """
+    seen = set()
+    for (i, p) in enumerate(agents):
+        cls = p.__class__
+        batch_method = getattr(cls, method + "_batch", None)
+        if batch_method is None:
+            yield (None, [i])
+        elif cls not in seen:
+            seen.add(cls)
+            yield (batch_method, [k for (k, q) in enumerate(agents)
+                                  if q.__class__ is cls])
+
+
+class AgentBatch(object):
+    """
+    All the peers of one agent class, for one phase of a round.
+
+    agents: the agent objects, with their pieces already updated
+    positions: where each agent is in snapshot
+    snapshot: tuple of everyone's PeerInfo at the start of the round
+    histories: each agent's AgentHistory
+    requests: in the uploads phase, the requests to each agent
+    neighbors: with a topology, the positions of each agent's neighbors
+
+    The array views below are built the first time they're asked for.
+    """
+    def __init__(self, conf, agents, positions, snapshot, histories,
+                 requests=None, neighbors=None):
+        self.conf = conf
+        self.agents = agents
+        self.positions = positions
+        self.snapshot = snapshot
+        self.histories = histories
+        self.requests = requests
+        self.neighbors = neighbors
+        self._cache = dict()
+
+    def __len__(self):
+        return len(self.agents)
+
+    def peers(self, k):
+        """What agents[k] would get as peers in a per-peer call"""
+        if self.neighbors is not None:
+            return NeighborPeers(self.snapshot, self.neighbors[k])
+        return OtherPeers(self.snapshot, self.positions[k])
+
+    def _cached(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def need_masks(self):
+        """Per agent, an int with bit i set if it still needs piece i"""
+        bpp = self.conf.blocks_per_piece
+        def build():
+            masks = []
+            for p in self.agents:
+                mask = 0
+                for (i, blocks) in enumerate(p.pieces):
+                    if blocks < bpp:
+                        mask |= 1 << i
+                masks.append(mask)
+            return masks
+        return self._cached("need_masks", build)
+
+    def available_masks(self):
+        """Per snapshot peer, an int with bit i set if it has piece i"""
+        return self._cached("available_masks", lambda: [
+            mask_of(info.available_pieces) for info in self.snapshot])
+
+    def available_sets(self):
+        """dict : peer id -> set of the pieces it has, as in the snapshot"""
+        return self._cached("available_sets", lambda: dict(
+            (info.id, set(info.available_pieces)) for info in self.snapshot))
+
+    def piece_counts(self, k):
+        """Per piece, how many of the peers agents[k] can see, itself
+        included, have it: the same as its history.piece_counts"""
+        if self.histories[k].piece_counts is not None:
+            # The sim keeps count already
+            return self.histories[k].piece_counts
+        if self.neighbors is not None:
+            return NeighborhoodCounts(
+                self.snapshot,
+                (self.positions[k],) + tuple(self.neighbors[k]),
+                self.conf.num_pieces)
+        def build():
+            counts = [0] * self.conf.num_pieces
+            for info in self.snapshot:
+                for piece_id in info.available_pieces:
+                    counts[piece_id] += 1
+            return counts
+        return self._cached("piece_counts", build)
+
+    def recent_downloads(self, rounds=1):
+        """Per agent, dict : peer id -> blocks downloaded from that peer in
+        the last rounds rounds, latest first (empty in round 0)"""
+        def build():
+            ans = []
+            for h in self.histories:
+                blocks = dict()
+                for downloads in reversed(h.downloads[-rounds:]):
+                    for d in downloads:
+                        blocks[d.from_id] = blocks.get(d.from_id, 0) + d.blocks
+                ans.append(blocks)
+            return ans
+        return self._cached(("recent_downloads", rounds), build)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for the simulation engine.
+
+Runs Sim.run_sim_once over a fixed matrix of scenarios -- swarm size x file
+shape x agent mix -- each in its own process, and records wall time per
+round, time per phase (see profiling.PhaseTimer) and peak memory.  Results
+are written as JSON, and can be checked against a saved baseline:
+
+  ./bench.py --out bench.json                      # record
+  ./bench.py --baseline bench.json --tolerance 0.2 # check for regressions
+
+The exit status is 1 if any scenario got more than --tolerance slower (or
+bigger) than the baseline, or failed when it hadn't in the baseline.  The
+whole matrix takes a while; --max-peers and --only cut it down:
+
+  ./bench.py --max-peers 1000 --only skt
+
+--engine, --min-bw and --max-bw are passed on to the sim; to time the
+event engine with lots of blocks in flight:
+
+  ./bench.py --engine event --min-bw 50 --max-bw 200
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import time
+from optparse import OptionParser
+
+from profiling import PhaseTimer
+from sim import config_for, make_sim
+
+
+PEER_COUNTS = [10, 100, 1000, 5000]
+
+# name -> (num_pieces, blocks_per_piece)
+FILE_SHAPES = [
+    ("small", 16, 4),
+    ("large", 256, 16),
+    ("huge", 2048, 32),
+]
+
+# name -> agent classes the non-seed peers are split evenly across
+AGENT_MIXES = [
+    ("dummy", ["Dummy"]),
+    ("skt", ["SKT_T1Std", "SKT_T1PropShare", "SKT_T1Tyrant", "SKT_T1Tourney"]),
+]
+
+# Fraction of each swarm that are seeds (at least one)
+SEED_FRACTION = 0.1
+
+
+def agents_for(num_peers, classes):
+    """List of agent class names for a swarm of num_peers"""
+    num_seeds = max(1, int(num_peers * SEED_FRACTION))
+    n = num_peers - num_seeds
+    ans = [classes[i % len(classes)] for i in range(n)]
+    ans.sort()
+    return ans + ["Seed"] * num_seeds
+
+
+def scenarios():
+    """The full matrix, as a list of dicts"""
+    ans = []
+    for num_peers in PEER_COUNTS:
+        for (shape, num_pieces, blocks_per_piece) in FILE_SHAPES:
+            for (mix, classes) in AGENT_MIXES:
+                ans.append(dict(
+                    name="peers%d-%s-%s" % (num_peers, shape, mix),
+                    num_peers=num_peers,
+                    num_pieces=num_pieces,
+                    blocks_per_piece=blocks_per_piece,
+                    agents=agents_for(num_peers, classes)))
+    return ans
+
+
+def run_scenario(scenario, rounds, seed, settings, conn):
+    """Runs in a child process, and sends the measurements back over conn."""
+    # Agents like to print in post_init()
+    sys.stdout = open(os.devnull, "w")
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        config = config_for(scenario["agents"],
+                            num_pieces=scenario["num_pieces"],
+                            blocks_per_piece=scenario["blocks_per_piece"],
+                            max_round=rounds - 1,
+                            **settings)
+        sim = make_sim(config)
+        sim.timer = PhaseTimer()
+        random.seed(seed)
+        start = time.time()
+        history = sim.run_sim_once()
+        wall = time.time() - start
+        n = history.last_round() + 1
+        conn.send(dict(
+            rounds=n,
+            wall=wall,
+            wall_per_round=wall / n,
+            phases_per_round=dict((name, t / n) for (name, t) in
+                                  sim.timer.totals.items()),
+            peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    except Exception, e:
+        conn.send(dict(error="%s: %s" % (e.__class__.__name__, e)))
+    conn.close()
+
+
+def measure(scenario, rounds, seed, settings):
+    (parent_conn, child_conn) = multiprocessing.Pipe(False)
+    p = multiprocessing.Process(target=run_scenario,
+                                args=(scenario, rounds, seed, settings,
+                                      child_conn))
+    p.start()
+    # Only the child writes; with our copy closed, its death ends the pipe
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        # Killed without sending anything -- out of memory, say
+        p.join()
+        return dict(error="Scenario process died with exit code %s"
+                    % p.exitcode)
+    p.join()
+    return result
+
+
+# Metrics compared against the baseline
+METRICS = ["wall_per_round", "peak_rss_kb"]
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of (scenario, metric, baseline value, new value) for
+    everything more than tolerance worse than the baseline.  A scenario that
+    failed counts too, as metric "error", unless it failed in the baseline
+    as well."""
+    regressions = []
+    for (name, r) in sorted(results.items()):
+        b = baseline.get(name)
+        if "error" in r:
+            if b is None or "error" not in b:
+                regressions.append((name, "error", None, r["error"]))
+            continue
+        if b is None or "error" in b:
+            continue
+        for metric in METRICS:
+            if r[metric] > b[metric] * (1 + tolerance):
+                regressions.append((name, metric, b[metric], r[metric]))
+    return regressions
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("--out", dest="out", default="bench.json",
+                      help="Where to write the JSON results")
+    parser.add_option("--baseline", dest="baseline", default=None,
+                      help="JSON results to compare against")
+    parser.add_option("--tolerance", dest="tolerance", default=0.2,
+                      type="float",
+                      help="Allowed slowdown (or growth) relative to the "
+                      "baseline, as a fraction")
+    parser.add_option("--rounds", dest="rounds", default=5, type="int",
+                      help="Rounds to simulate per scenario")
+    parser.add_option("--max-peers", dest="max_peers", default=None,
+                      type="int",
+                      help="Skip scenarios with more peers than this "
+                      "(default: run them all)")
+    parser.add_option("--only", dest="only", default=None,
+                      help="Only run scenarios whose name matches this regex")
+    parser.add_option("--seed", dest="seed", default=0, type="int",
+                      help="Random seed for every scenario")
+    parser.add_option("--engine", dest="engine", default="round",
+                      choices=["round", "event"],
+                      help="Simulation engine to measure (see sim.py)")
+    parser.add_option("--min-bw", dest="min_up_bw", default=None, type="int",
+                      help="Lowest upload bandwidth (sim.py's default if "
+                      "not given)")
+    parser.add_option("--max-bw", dest="max_up_bw", default=None, type="int",
+                      help="Highest upload bandwidth (sim.py's default if "
+                      "not given)")
+    parser.add_option("--list", dest="list", default=False,
+                      action="store_true",
+                      help="List the scenarios and exit")
+    (options, args) = parser.parse_args(args[1:])
+
+    todo = scenarios()
+    if options.max_peers is not None:
+        todo = [s for s in todo if s["num_peers"] <= options.max_peers]
+    if options.only:
+        todo = [s for s in todo if re.search(options.only, s["name"])]
+    if options.list:
+        for s in todo:
+            print s["name"]
+        return 0
+
+    settings = dict(engine=options.engine)
+    for name in ["min_up_bw", "max_up_bw"]:
+        if getattr(options, name) is not None:
+            settings[name] = getattr(options, name)
+    results = dict()
+    for s in todo:
+        r = measure(s, options.rounds, options.seed, settings)
+        results[s["name"]] = r
+        if "error" in r:
+            print "%-30s ERROR %s" % (s["name"], r["error"])
+        else:
+            print "%-30s %10.4fs/round %10d KB" % (
+                s["name"], r["wall_per_round"], r["peak_rss_kb"])
+        sys.stdout.flush()
+
+    with open(options.out, "w") as f:
+        json.dump(dict(rounds=options.rounds, seed=options.seed,
+                       settings=settings, scenarios=results),
+                  f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+        regressions = compare(results, baseline, options.tolerance)
+        for (name, metric, old, new) in regressions:
+            if metric == "error":
+                print "REGRESSION %s failed: %s" % (name, new)
+            else:
+                print "REGRESSION %s %s: %s -> %s" % (name, metric, old, new)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
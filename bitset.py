@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+"""
+Sets of piece ids stored as bits of a Python int: bit i is set iff piece i is
+in the set.  Intersection, union and difference are single big-int
+operations, and a frozen copy shares the int instead of copying elements.
+
+FrozenPieceSet and PieceSet mirror frozenset and set: both can be iterated
+(in increasing piece order), tested with `in` and measured with len(), so
+agents that treat PeerInfo.available_pieces as a container keep working.
+"""
+
+import collections
+
+
+def mask_of(pieces):
+    """Return the int with a bit set for each piece id in pieces."""
+    if isinstance(pieces, FrozenPieceSet):
+        return pieces.mask
+    mask = 0
+    for i in pieces:
+        mask |= 1 << i
+    return mask
+
+
+class FrozenPieceSet(object):
+    __slots__ = ('mask',)
+
+    def __init__(self, pieces=()):
+        self.mask = mask_of(pieces)
+
+    @classmethod
+    def from_mask(cls, mask):
+        s = cls.__new__(cls)
+        s.mask = mask
+        return s
+
+    def __contains__(self, piece_id):
+        return piece_id >= 0 and (self.mask >> piece_id) & 1 == 1
+
+    def __iter__(self):
+        mask = self.mask
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def __len__(self):
+        return bin(self.mask).count("1")
+
+    def __nonzero__(self):
+        return self.mask != 0
+
+    def __and__(self, other):
+        return self.from_mask(self.mask & mask_of(other))
+
+    def __or__(self, other):
+        return self.from_mask(self.mask | mask_of(other))
+
+    def __sub__(self, other):
+        return self.from_mask(self.mask & ~mask_of(other))
+
+    def __rsub__(self, other):
+        return self.from_mask(mask_of(other) & ~self.mask)
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+    def intersection(self, *others):
+        mask = self.mask
+        for other in others:
+            mask &= mask_of(other)
+        return self.from_mask(mask)
+
+    def union(self, *others):
+        mask = self.mask
+        for other in others:
+            mask |= mask_of(other)
+        return self.from_mask(mask)
+
+    def difference(self, *others):
+        mask = self.mask
+        for other in others:
+            mask &= ~mask_of(other)
+        return self.from_mask(mask)
+
+    def issubset(self, other):
+        return self.mask & ~mask_of(other) == 0
+
+    def isdisjoint(self, other):
+        return self.mask & mask_of(other) == 0
+
+    def __eq__(self, other):
+        if isinstance(other, FrozenPieceSet):
+            return self.mask == other.mask
+        if isinstance(other, (set, frozenset)):
+            return self.mask == mask_of(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        if eq is NotImplemented:
+            return eq
+        return not eq
+
+    def __hash__(self):
+        # Equal sets need equal hashes, and these compare equal to
+        # frozensets; this is the hash frozenset uses
+        return collections.Set._hash(self)
+
+    def frozen(self):
+        return FrozenPieceSet.from_mask(self.mask)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, list(self))
+
+
+class PieceSet(FrozenPieceSet):
+    """Mutable version, for the sim's own bookkeeping."""
+    __slots__ = ()
+    __hash__ = None
+
+    def add(self, piece_id):
+        self.mask |= 1 << piece_id
+
+    def discard(self, piece_id):
+        self.mask &= ~(1 << piece_id)
+
+
+# So random.sample() and friends treat these like sets
+collections.Set.register(FrozenPieceSet)
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+"""
+On-disk cache of simulation results (sim.py --cache-dir DIR).
+
+An iteration's result only depends on the settings, the code, and the
+iteration's seed, so it's stored under a hash of exactly those:
+
+  - every setting in the Params except the ones that only change how the
+    run is carried out (NOT_HASHED),
+  - the source of each agent class's module, and of the sim's own modules
+    (SIM_MODULES),
+  - with --bw-trace, the trace file's contents,
+  - the seed.
+
+Editing an agent's file changes the key of every entry that ran it, and
+no other.  Only seeded iterations get cached, since an unseeded one can't
+be repeated.
+
+Entries are pickled into DIR/xx/<key>, holding the iteration's stats and,
+with --cache-history, its pretty-printed history, zlib-compressed
+(zlib.decompress(entry["history"]) gets it back).  Reading an entry
+touches it, and when the cache grows past its size limit, the entries
+used least recently get deleted, down to LOW_WATER of the limit.
+"""
+
+import cPickle
+import hashlib
+import inspect
+import os
+import tempfile
+import zlib
+
+# Settings that don't change the result
+NOT_HASHED = set([
+    "agent_classes",   # the sources stand in for these
+    "iters",
+    "workers",
+    "agent_workers",
+    "piece_state",     # same game with either state or set type
+    "piece_sets",
+    "history_tail",
+    "history_dir",
+    "cache_dir",
+    "cache_max_mb",
+    "cache_history",
+    "checkpoint",
+    "checkpoint_every",
+    "checkpoint_secs",
+    "resume",
+])
+
+# Eviction goes down to this fraction of the size limit, so a full cache
+# isn't rescanned on every put
+LOW_WATER = 0.9
+
+# cache root -> bytes in it, as far as this process knows: scanned once,
+# then kept up to date by put().  Other processes' puts only show up at the
+# next eviction's rescan.
+known_sizes = dict()
+
+# The sim's own modules, which the result also depends on
+SIM_MODULES = ["sim", "eventsim", "peer", "messages", "history", "columns",
+               "state", "bitset", "batch", "topology", "bandwidth", "util"]
+
+
+# Files get hashed this many bytes at a time, so a big --bw-trace never has
+# to fit in memory
+DIGEST_CHUNK = 1 << 20
+
+
+def file_digest(path, memo={}):
+    """sha1 of the file at path, remembered until the file changes"""
+    stamp = os.stat(path).st_mtime
+    if path not in memo or memo[path][0] != stamp:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK), ""):
+                h.update(chunk)
+        memo[path] = (stamp, h.hexdigest())
+    return memo[path][1]
+
+
+def params_items(config):
+    """The Params' settings that go in the key, as sorted (name, value)"""
+    return sorted((k, v) for (k, v) in config.__dict__.items()
+                  if not k.startswith("_") and k not in NOT_HASHED)
+
+
+class ResultCache:
+    def __init__(self, root, max_mb=None):
+        self.root = root
+        self.max_bytes = None if max_mb is None else max_mb * 1024 * 1024
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.sim_sources = [os.path.join(here, m + ".py") for m in SIM_MODULES]
+
+    def key(self, config, seed):
+        h = hashlib.sha1()
+        h.update(repr(params_items(config)))
+        for name in sorted(config.agent_classes):
+            source = inspect.getsourcefile(config.agent_classes[name])
+            h.update("%s:%s" % (name, file_digest(source)))
+        for path in self.sim_sources:
+            if os.path.exists(path):
+                h.update(file_digest(path))
+        if config.bw_trace is not None:
+            h.update("trace:%s" % file_digest(config.bw_trace))
+        h.update("seed:%r" % seed)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        """The entry stored under key -- a dict with "stats" and "history"
+        -- or None."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path, None)  # just used
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, stats, history_lines=None):
+        """Store an iteration's stats, and optionally its history, given as
+        the lines of History.pretty()"""
+        entry = dict(stats=stats, history=None)
+        if history_lines is not None:
+            z = zlib.compressobj()
+            chunks = [z.compress(line) for line in history_lines]
+            chunks.append(z.flush())
+            entry["history"] = "".join(chunks)
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass  # another process got there first
+        # Write then rename, so readers never see half an entry
+        (fd, tmp) = tempfile.mkstemp(dir=directory, prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+        if self.max_bytes is None:
+            os.rename(tmp, path)
+            return
+        total = self.size() + os.path.getsize(tmp)
+        if os.path.exists(path):
+            total -= os.path.getsize(path)  # replacing it
+        os.rename(tmp, path)
+        known_sizes[self.root] = total
+        if total > self.max_bytes:
+            self.evict()
+
+    def size(self):
+        """Bytes in the cache, without walking it every time"""
+        if self.root not in known_sizes:
+            known_sizes[self.root] = sum(
+                size for (used, size, path) in self.entries())
+        return known_sizes[self.root]
+
+    def entries(self):
+        """[(last used, size, path)] for everything in the cache"""
+        ans = []
+        for (dirpath, dirnames, filenames) in os.walk(self.root):
+            for name in filenames:
+                if name.startswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                ans.append((st.st_mtime, st.st_size, path))
+        return ans
+
+    def evict(self):
+        """Delete least recently used entries until well under the size
+        limit.  Rescans the cache, so only gets called once the running
+        total says it's over."""
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for (used, size, path) in entries)
+        for (used, size, path) in sorted(entries):
+            if total <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        known_sizes[self.root] = total
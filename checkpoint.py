@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+"""
+Checkpoints of a running simulation (sim.py --checkpoint PATH).
+
+Every --checkpoint-every rounds (or --checkpoint-secs seconds), the sim
+pickles everything the rest of the run depends on into PATH: the engine's
+state, the agent objects with their random streams, the history, the
+random module's state, and the results of the iterations already done.
+With --resume, it picks up from there, and finishes with the same results
+an uninterrupted run would have had.
+
+The history's spill files (--history-tail) aren't copied into the
+checkpoint: they are kept in PATH.spill, and the checkpoint records how
+much of each one it covers.
+
+Only the round-by-round engine, running the agents in its own process,
+can checkpoint.  The file goes away once the run is over.
+"""
+
+import cPickle
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from cache import params_items
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def settings_of(config):
+    """What a checkpoint has to agree with the sim on to be resumed"""
+    return repr(params_items(config))
+
+
+class Checkpoints:
+    def __init__(self, config):
+        self.path = config.checkpoint
+        self.every = config.checkpoint_every
+        self.secs = config.checkpoint_secs
+        self.settings = settings_of(config)
+        self.spill_path = self.path + ".spill"
+        self.results = []    # (uploaded, completion) per finished iteration
+        self.resumed = None  # the run state to continue, after resume()
+        self.random_state = None
+        self.last_round = 0
+        self.last_time = time.time()
+
+    def resume(self):
+        """Load the checkpoint.  Returns the finished iterations' results;
+        the unfinished one's state is left for take_run()."""
+        try:
+            with open(self.path, "rb") as f:
+                saved = cPickle.load(f)
+        except IOError, e:
+            raise CheckpointError("Can't resume from %s: %s" % (self.path, e))
+        if saved["settings"] != self.settings:
+            raise CheckpointError("%s is from a run with different settings"
+                                  % self.path)
+        self.results = saved["results"]
+        self.resumed = saved["run"]
+        self.random_state = saved["random_state"]
+        random.setstate(self.random_state)
+        return self.results
+
+    def take_run(self):
+        """
+        The state of the run to continue, or None to start a fresh one.
+        Call once the run has been set up; the random module goes back to
+        where it was when the checkpoint was saved.
+        """
+        state = self.resumed
+        self.resumed = None
+        if state is not None:
+            random.setstate(self.random_state)
+        return state
+
+    def start_run(self, round):
+        self.last_round = round
+        self.last_time = time.time()
+
+    def due(self, round):
+        """Whether to save before starting round"""
+        if self.every > 0 and round - self.last_round >= self.every:
+            return True
+        return self.secs > 0 and time.time() - self.last_time >= self.secs
+
+    def save_run(self, round, state):
+        """Save the state of the run about to start round"""
+        self.write(state)
+        self.start_run(round)
+
+    def iteration_done(self, results):
+        """Save after an iteration, with the results of all so far"""
+        self.results = results
+        self.write(None)
+        # Nothing saved refers to the iteration's spill files any more
+        self.clear_spills()
+
+    def spill_dir(self):
+        """Directory for the history's spill files, next to the checkpoint"""
+        if not os.path.isdir(self.spill_path):
+            os.makedirs(self.spill_path)
+        return self.spill_path
+
+    def clear_spills(self):
+        if os.path.isdir(self.spill_path):
+            shutil.rmtree(self.spill_path)
+
+    def write(self, run):
+        saved = dict(settings=self.settings, results=self.results, run=run,
+                     random_state=random.getstate())
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # Write then rename, so a crash mid-write leaves the last one
+        (fd, tmp) = tempfile.mkstemp(dir=directory, prefix=".checkpoint")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                cPickle.dump(saved, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+        except:
+            os.remove(tmp)
+            raise
+
+    def finish(self):
+        """The run is over: nothing left to resume"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.clear_spills()
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+"""
+Append-only tables stored as one typed array per column, instead of one
+Python object per row.
+"""
+
+import mmap
+import os
+import tempfile
+from array import array
+from itertools import izip
+
+
+class Columns:
+    """
+    A table of numbers with named columns.  Each column starts out as an
+    array of machine ints, and is widened to doubles the first time a
+    non-integer value is appended to it.
+    """
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.arrays = [array('l') for n in self.names]
+
+    def __len__(self):
+        return len(self.arrays[0])
+
+    def append(self, row):
+        for (i, value) in enumerate(row):
+            try:
+                self.arrays[i].append(value)
+            except TypeError:
+                self.arrays[i] = array('d', self.arrays[i])
+                self.arrays[i].append(value)
+
+    def extend(self, columns):
+        """Append many rows at once, given as one array or list of values
+        per column"""
+        for (i, values) in enumerate(columns):
+            a = self.arrays[i]
+            if isinstance(values, array):
+                if values.typecode == a.typecode:
+                    a.extend(values)
+                    continue
+                values = values.tolist()
+            try:
+                a.fromlist(values)  # all or nothing
+            except TypeError:
+                self.arrays[i] = array('d', a)
+                self.arrays[i].fromlist(values)
+
+    def column(self, name):
+        """The array holding all of column name.  Don't modify it."""
+        return self.arrays[self.names.index(name)]
+
+    def row(self, i):
+        return tuple(a[i] for a in self.arrays)
+
+    def rows(self, start, stop):
+        """List of the rows in [start, stop), as tuples"""
+        return zip(*[a[start:stop] for a in self.arrays])
+
+    def iter_columns(self, *names):
+        """Iterate over tuples of just the named columns, for aggregation"""
+        return izip(*[self.column(n) for n in names])
+
+
+class SpillingColumns(Columns):
+    """
+    Columns whose oldest rows can be moved out of memory into append-only
+    files (one per column), which are memory-mapped to read them back.
+    Reads don't care which side of the line a row is on.
+
+    The files are anonymous temporary files in spill_dir, so they go away
+    when the table does -- unless keep is set, for a table that gets
+    checkpointed: then they are named files, left for whoever owns
+    spill_dir to remove, and a pickle of the table refers to them by path
+    instead of holding their contents.
+    """
+    def __init__(self, names, spill_dir=None, keep=False):
+        Columns.__init__(self, names)
+        self.spill_dir = spill_dir
+        self.paths = None
+        if keep:
+            self.paths = []
+            self.files = []
+            for n in self.names:
+                (fd, path) = tempfile.mkstemp(dir=spill_dir, prefix="spill")
+                self.paths.append(path)
+                self.files.append(os.fdopen(fd, "w+b"))
+        else:
+            self.files = [tempfile.TemporaryFile(dir=spill_dir)
+                          for n in self.names]
+        # Per column: list of (first row, typecode, byte offset) -- a new
+        # segment starts whenever the column's type gets widened.
+        self.segments = [[] for n in self.names]
+        self.file_sizes = [0 for n in self.names]
+        self.maps = [None for n in self.names]
+        self.spilled = 0  # rows on disk
+
+    def __len__(self):
+        return self.spilled + len(self.arrays[0])
+
+    def spill(self, num_rows):
+        """Move the oldest num_rows in-memory rows to disk."""
+        if num_rows <= 0:
+            return
+        for (i, a) in enumerate(self.arrays):
+            segs = self.segments[i]
+            if not segs or segs[-1][1] != a.typecode:
+                segs.append((self.spilled, a.typecode, self.file_sizes[i]))
+            f = self.files[i]
+            f.seek(0, os.SEEK_END)
+            a[:num_rows].tofile(f)
+            f.flush()
+            self.file_sizes[i] += num_rows * a.itemsize
+            del a[:num_rows]
+            # The old map doesn't cover the new rows
+            self.maps[i] = None
+        self.spilled += num_rows
+
+    def __getstate__(self):
+        # Named files are pickled as their paths (and file_sizes, how much
+        # of them is this table's); anonymous ones have to be pickled as the
+        # spilled rows' bytes.
+        state = self.__dict__.copy()
+        if self.paths is None:
+            contents = []
+            for f in self.files:
+                f.seek(0)
+                contents.append(f.read())
+            state["files"] = contents
+        else:
+            state["files"] = None
+        state["maps"] = [None for n in self.names]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.paths is None:
+            contents = self.files
+            self.files = [tempfile.TemporaryFile(dir=self.spill_dir)
+                          for n in self.names]
+            for (f, data) in zip(self.files, contents):
+                f.write(data)
+                f.flush()
+        else:
+            # Rows spilled after the pickle was taken are cut off; the
+            # files get mapped again as they're read.
+            self.files = []
+            for (path, size) in zip(self.paths, self.file_sizes):
+                f = open(path, "r+b")
+                f.truncate(size)
+                self.files.append(f)
+
+    def _map(self, i):
+        if self.maps[i] is None:
+            self.maps[i] = mmap.mmap(self.files[i].fileno(), self.file_sizes[i],
+                                     access=mmap.ACCESS_READ)
+        return self.maps[i]
+
+    def _disk_values(self, i, start, stop):
+        """List of column i's values for spilled rows [start, stop)"""
+        values = []
+        segs = self.segments[i]
+        for (k, (first, typecode, offset)) in enumerate(segs):
+            if k + 1 < len(segs):
+                end = segs[k + 1][0]
+            else:
+                end = self.spilled
+            lo = max(start, first)
+            hi = min(stop, end)
+            if lo >= hi:
+                continue
+            a = array(typecode)
+            size = a.itemsize
+            m = self._map(i)
+            a.fromstring(m[offset + (lo - first) * size:
+                           offset + (hi - first) * size])
+            values.extend(a)
+        return values
+
+    def _values(self, i, start, stop):
+        values = []
+        if start < self.spilled:
+            values = self._disk_values(i, start, min(stop, self.spilled))
+        if stop > self.spilled:
+            a = self.arrays[i]
+            values.extend(a[max(start, self.spilled) - self.spilled:
+                            stop - self.spilled])
+        return values
+
+    def column(self, name):
+        i = self.names.index(name)
+        if self.spilled == 0:
+            return self.arrays[i]
+        return self._values(i, 0, len(self))
+
+    def row(self, i):
+        return tuple(self._values(c, i, i + 1)[0]
+                     for c in range(len(self.names)))
+
+    def rows(self, start, stop):
+        if start >= self.spilled:
+            return Columns.rows(self, start - self.spilled, stop - self.spilled)
+        return zip(*[self._values(c, start, stop)
+                     for c in range(len(self.names))])
@@ -0,0 +1,431 @@
+#!/usr/bin/python
+
+"""
+Discrete-event version of the simulation (sim.py --engine event).
+
+Instead of moving every peer once per round, the engine keeps a priority
+queue of events and jumps straight from one to the next:
+
+  - piece completion: an uploader that unchokes a requester with
+    bandwidth bw sends it one block every 1/bw time units, for the next
+    piece it asked that uploader for, until the next re-choke.  Blocks
+    aren't events of their own: the streams working on the same piece of
+    the same requester get one event, for when their blocks finish it.
+    Then the piece becomes available to others immediately, and the
+    requester gets a decision point.
+  - decision point: the requester's requests() is called again, so it can
+    ask for more without waiting for the next round.
+  - re-choke timer: every 1 time unit (one "round"), the round's downloads
+    go into the History, and every peer decides again through the usual
+    Peer.requests() / Peer.uploads() calls.
+
+Blocks that land between events are added up when something needs them:
+at a decision point for their requester, when another stream joins their
+piece, and at the end of the round.  They land in the order they would
+have landed one at a time, so the results are the same as sending every
+block as its own event, except sometimes when blocks land at the very same
+moment, which can be taken in a different order.
+
+Rounds keep their meaning for agents and for the History: round r is the
+time interval (r, r+1].  Peers that are done can't make a valid request, so
+their requests() isn't called, and at a re-choke neither is that of a peer
+none of whose missing pieces anyone it can see has; peers nobody asked for
+anything aren't asked for uploads().  In sparse swarms that's most of them.
+
+Transfers move whole blocks, so a stream of bw blocks per round delivers
+floor(bw) blocks in a round; fractional bandwidth is lost at each re-choke.
+"""
+
+import heapq
+import itertools
+import logging
+
+from history import History
+from messages import Download, PeerInfo
+from sim import Sim
+from state import CompletionTracker, ReplicaCounts
+
+# Kinds of events.  At the same time, pieces complete before decisions are
+# made, and decisions before the round ends.
+PIECE = 0
+DECIDE = 1
+RECHOKE = 2
+
+# Slack for comparing event times against the end of a round
+EPSILON = 1e-9
+
+
+class Stream(object):
+    """An upload from one peer to another, for the rest of a round"""
+    __slots__ = ("uploader", "requester", "step", "next_block", "sent",
+                 "piece", "order")
+
+    def __init__(self, uploader, requester, bw, t, order):
+        self.uploader = uploader
+        self.requester = requester
+        self.step = 1.0 / bw
+        self.next_block = t + self.step  # when the next block lands
+        self.sent = t                    # when it was sent
+        self.piece = None                # what it's sending, if anything
+        self.order = order               # breaks ties between streams
+
+
+def land(streams, limit, need):
+    """
+    The next blocks streams send, in the order they land, up to need of
+    them and none after time limit.  Returns (blocks from each stream, each
+    stream's (next_block, sent) after them, time the last one landed or
+    None).  Block times are added up one step at a time, as sending each
+    block on its own would, and of blocks landing together, the one sent
+    first goes first.
+    """
+    if len(streams) == 1:
+        s = streams[0]
+        (t, sent) = (s.next_block, s.sent)
+        n = 0
+        while n < need and t <= limit:
+            sent = t
+            t += s.step
+            n += 1
+        return ([n], [(t, sent)], sent if n else None)
+    queue = [(s.next_block, s.sent, s.order, k)
+             for (k, s) in enumerate(streams)]
+    heapq.heapify(queue)
+    counts = [0] * len(streams)
+    last = None
+    for n in xrange(need):
+        (t, _, order, k) = queue[0]
+        if t > limit:
+            break
+        last = t
+        heapq.heapreplace(queue, (t + streams[k].step, t, order, k))
+        counts[k] += 1
+    nexts = [None] * len(streams)
+    for (t, sent, _, k) in queue:
+        nexts[k] = (t, sent)
+    return (counts, nexts, last)
+
+
+class EventSim(Sim):
+    def run_sim_once(self):
+        """Return a history"""
+        conf = self.config
+        timer = self.timer
+        timer.start_run()
+        self.start_streams()
+        bpp = conf.blocks_per_piece
+        if conf.agent_workers > 0:
+            raise ValueError("--agent-workers needs --engine round")
+        log_debug = logging.root.isEnabledFor(logging.DEBUG)
+
+        peers, peer_pieces = self.create_peers()
+        completion = CompletionTracker(peer_pieces, bpp)
+        self.peer_ids = [p.id for p in peers]
+        self.peers_by_id = dict((p.id, p) for p in peers)
+        position = dict((p.id, i) for (i, p) in enumerate(peers))
+        self.position = position
+
+        upload_rates = self.bandwidths.rates()
+        self.upload_limits = upload_rates
+
+        (piece_set, frozen) = self.piece_set_types()
+        available = dict(
+            (pid, piece_set(i for i in range(conf.num_pieces)
+                            if peer_pieces[pid][i] == bpp))
+            for pid in self.peer_ids)
+        # Counts as of the latest snapshot: pieces finished mid-round count
+        # as soon as they're available to others.
+        replicas = ReplicaCounts(conf.num_pieces, available.values())
+        history = History(self.peer_ids, upload_rates,
+                          spill_dir=conf.history_dir,
+                          tail_rounds=conf.history_tail,
+                          piece_counts=replicas.view())
+        peer_info_by_id = dict()
+        stale_info = set(self.peer_ids)
+
+        self.topology = self.make_topology()
+
+        # peer_id -> time it got its last piece
+        self.completion_times = dict((pid, 0.0) for pid in completion.done)
+
+        events = []
+        seq = itertools.count()
+        def schedule(t, kind, data):
+            heapq.heappush(events, (t, kind, next(seq), data))
+
+        # State for the round in progress
+        state = dict(round=0, validating=True)
+        requests = dict((pid, []) for pid in self.peer_ids)
+        # (uploader, requester) -> [requests from requester to uploader]
+        requests_by_pair = dict()
+        # requester -> [streams to it], in the order they started
+        streams_to = dict()
+        # (requester, piece) -> [streams sending it that piece]
+        senders = dict()
+        # (requester, piece) -> number of its latest piece event; older
+        # ones are stale
+        tokens = dict()
+        round_uploads = dict((pid, []) for pid in self.peer_ids)
+        round_downloads = dict()  # (to, from, piece) -> blocks
+
+        def peer_info():
+            for pid in stale_info:
+                peer_info_by_id[pid] = PeerInfo(pid, frozen(available[pid]))
+            stale_info.clear()
+            return tuple(peer_info_by_id[p.id] for p in peers)
+
+        def set_requests(peer_id, rs):
+            for r in requests[peer_id]:
+                requests_by_pair.pop((r.peer_id, peer_id), None)
+            requests[peer_id] = rs
+            for r in rs:
+                requests_by_pair.setdefault((r.peer_id, peer_id), []).append(r)
+
+        def can_ask(peer_id, num_out):
+            """Whether anyone peer_id sees has a piece it doesn't.  num_out
+            is the number of pieces anyone has."""
+            has = available[peer_id]
+            if self.topology is None:
+                return num_out > len(has)
+            return not all(available[self.peer_ids[j]].issubset(has)
+                           for j in self.topology.neighbors[position[peer_id]])
+
+        def get_requests(p, snapshot):
+            if completion.is_done(p.id):
+                return []
+            p.update_pieces(list(peer_pieces[p.id]))
+            with timer.agent_call(p, "requests"):
+                i = position[p.id]
+                rs = p.requests(self.peers_view(snapshot, i),
+                                history.peer_history(
+                                    p.id, self.neighborhood_counts(snapshot, i)))
+            if state["validating"]:
+                with timer.phase("request_validation"):
+                    self.check_requests(p, rs, peer_pieces, available)
+            return rs
+
+        def next_request(uploader, requester):
+            # Requests for pieces the uploader doesn't have only get this far
+            # in rounds that weren't validated; they get nothing
+            has = available.get(uploader, ())
+            for r in requests_by_pair.get((uploader, requester), ()):
+                if (r.piece_id in has and
+                        peer_pieces[requester][r.piece_id] < bpp):
+                    return r
+            return None
+
+        def take(key, counts, nexts):
+            """Credit the blocks land() found to the streams sending key"""
+            (requester, piece_id) = key
+            pieces = peer_pieces[requester]
+            old = pieces[piece_id]
+            for (s, n, (t, sent)) in zip(senders[key], counts, nexts):
+                (s.next_block, s.sent) = (t, sent)
+                if n:
+                    pieces[piece_id] += n
+                    k = (requester, s.uploader, piece_id)
+                    round_downloads[k] = round_downloads.get(k, 0) + n
+            completion.update(requester, old, pieces[piece_id])
+
+        def catch_up(key, t):
+            """Credit the blocks for key that landed by time t.  Never the
+            last one: the piece event finishes the piece."""
+            need = bpp - peer_pieces[key[0]][key[1]]
+            (counts, nexts, last) = land(senders[key], t, need - 1)
+            take(key, counts, nexts)
+
+        def plan(key):
+            """Schedule the piece event for key, if its streams finish the
+            piece this round"""
+            need = bpp - peer_pieces[key[0]][key[1]]
+            (counts, nexts, last) = land(senders[key], state["round"] + 1,
+                                         need)
+            token = next(seq)
+            tokens[key] = token
+            if sum(counts) == need:
+                schedule(last, PIECE, (key, token, counts, nexts))
+
+        def assign(s, t):
+            """At time t, point s at the next piece its requester wants
+            from its uploader, or leave it idle"""
+            r = next_request(s.uploader, s.requester)
+            if r is None:
+                s.piece = None
+                return
+            key = (s.requester, r.piece_id)
+            if key in senders:
+                catch_up(key, t)
+                senders[key].append(s)
+            else:
+                senders[key] = [s]
+            s.piece = key
+            plan(key)
+
+        def leave(s, t):
+            """At time t, take s off the piece it's sending"""
+            key = s.piece
+            catch_up(key, t)
+            senders[key].remove(s)
+            if senders[key]:
+                plan(key)
+            else:
+                del senders[key]
+                del tokens[key]
+            s.piece = None
+
+        def open_streams(t):
+            """Start every stream the round's uploads ask for"""
+            for p in peers:
+                for u in round_uploads[p.id]:
+                    if (self.topology is not None and
+                            not self.topology.are_neighbors(
+                                position[p.id], position.get(u.to_id))):
+                        # Only neighbors trade, even when this round's
+                        # requests weren't validated
+                        continue
+                    if (u.bw <= 0 or
+                            t + 1.0 / u.bw > state["round"] + 1 + EPSILON):
+                        continue
+                    streams = streams_to.setdefault(u.to_id, [])
+                    if any(s.uploader == u.from_id for s in streams):
+                        continue  # the first upload to them counts
+                    s = Stream(u.from_id, u.to_id, u.bw, t, next(seq))
+                    streams.append(s)
+                    assign(s, t)
+
+        def finish_piece(t, key, token, counts, nexts):
+            if tokens.get(key) != token:
+                return  # its streams changed since
+            take(key, counts, nexts)
+            streams = senders.pop(key)
+            del tokens[key]
+            (requester, piece_id) = key
+            available[requester].add(piece_id)
+            replicas.add(piece_id)
+            stale_info.add(requester)
+            if completion.is_done(requester):
+                self.completion_times[requester] = t
+                if completion.all_done():
+                    schedule(t, RECHOKE, None)
+            else:
+                schedule(t, DECIDE, requester)
+            for s in streams:
+                assign(s, t)
+
+        def decide(t, peer_id):
+            """Decision point for one peer in the middle of a round"""
+            p = self.peers_by_id[peer_id]
+            with timer.phase("requests"):
+                set_requests(peer_id, get_requests(p, peer_info()))
+            # Only streams whose next piece changed need moving
+            for s in streams_to.get(peer_id, ()):
+                r = next_request(s.uploader, peer_id)
+                if r is not None and s.piece == (peer_id, r.piece_id):
+                    continue
+                if s.piece is not None:
+                    leave(s, t)
+                elif (s.next_block <= t and
+                      (s.uploader, peer_id) in requests_by_pair):
+                    # It ran dry at next_block; it can carry on now
+                    (s.next_block, s.sent) = (t + s.step, t)
+                assign(s, t)
+
+        def rechoke(t):
+            """Start of a round: everyone decides again"""
+            state["validating"] = self.validate_round(state["round"])
+            if self.topology is not None:
+                self.topology.refresh(state["round"])
+            self.set_bandwidths(state["round"], peers)
+            streams_to.clear()
+            senders.clear()
+            tokens.clear()
+            snapshot = peer_info()
+            with timer.phase("requests"):
+                num_out = sum(1 for c in replicas.counts if c)
+                for p in peers:
+                    if completion.is_done(p.id) or not can_ask(p.id, num_out):
+                        set_requests(p.id, [])
+                    else:
+                        set_requests(p.id, get_requests(p, snapshot))
+
+            with timer.phase("uploads"):
+                requests_to = dict((pid, []) for pid in self.peer_ids)
+                for p in peers:
+                    for r in requests[p.id]:
+                        if r.peer_id in requests_to:  # unvalidated rounds
+                            requests_to[r.peer_id].append(r)
+                for p in peers:
+                    if not requests_to[p.id]:
+                        us = []
+                    else:
+                        i = position[p.id]
+                        with timer.agent_call(p, "uploads"):
+                            us = p.uploads(requests_to[p.id],
+                                           self.peers_view(snapshot, i),
+                                           history.peer_history(
+                                               p.id,
+                                               self.neighborhood_counts(
+                                                   snapshot, i)))
+                        if state["validating"]:
+                            with timer.phase("upload_validation"):
+                                self.check_uploads(p, us)
+                    round_uploads[p.id] = us
+
+            with timer.phase("transfers"):
+                open_streams(t)
+            schedule(t + 1, RECHOKE, None)
+
+        def end_round(t):
+            """Put the round's transfers, up to time t, in the history.
+            Returns True if the sim should stop."""
+            with timer.phase("transfers"):
+                for key in senders:
+                    catch_up(key, t)
+            r = state["round"]
+            downloads = dict((pid, []) for pid in self.peer_ids)
+            for ((to_id, from_id, piece_id), blocks) in sorted(
+                    round_downloads.items()):
+                downloads[to_id].append(Download(from_id, to_id, piece_id,
+                                                 blocks))
+            round_downloads.clear()
+            with timer.phase("history"):
+                history.update(downloads, dict(round_uploads))
+            if log_debug:
+                logging.debug(history.pretty_for_round(r))
+            timer.end_round(r)
+
+            for peer_id in completion.pop_newly_done():
+                history.peer_is_done(r, peer_id)
+            if completion.all_done():
+                logging.info("All done!")
+                return True
+            state["round"] += 1
+            if state["round"] > conf.max_round:
+                logging.info("Out of time.  Stopping.")
+                return True
+            for pid in self.peer_ids:
+                round_uploads[pid] = []
+            logging.info("======= Round %d ========", state["round"])
+            return False
+
+        logging.info("======= Round %d ========", 0)
+        rechoke(0.0)
+        while events:
+            (t, kind, _, data) = heapq.heappop(events)
+            if kind == PIECE:
+                with timer.phase("transfers"):
+                    finish_piece(t, *data)
+            elif kind == DECIDE:
+                if t < state["round"] + 1 - EPSILON:
+                    decide(t, data)
+            elif kind == RECHOKE:
+                # Either the round is over, or everyone finished early
+                if end_round(t):
+                    break
+                # Streams never run past the end of a round, so nothing
+                # left in the queue is still live.
+                events = []
+                rechoke(float(state["round"]))
+
+        self.log_results(history)
+        return history
@@ -2,6 +2,11 @@
 
 import copy
 import pprint
+from array import array
+
+from columns import Columns, SpillingColumns
+from messages import (Download, Upload, MessageBatch, DownloadBatch,
+                      UploadBatch)
 
 
 class AgentHistory:
@@ -14,14 +19,41 @@ class AgentHistory:
     history.uploads: [[Upload objects for round]]  (one sublist for each round)
          All the downloads _from_ this agent.
 
+    Running totals over all rounds so far are available without walking
+    the lists: see blocks_from(), blocks_to(), total_downloaded() and
+    total_uploaded().
+
+    history.piece_counts[i]: how many peers (this one included) have piece
+         i at the start of the current round.  Read-only.  With a topology
+         (sim.py --neighbors), only this peer and its neighbors count.
     """
-    def __init__(self, peer_id, downloads, uploads):
+    def __init__(self, peer_id, downloads, uploads, totals,
+                 piece_counts=None):
         """
         Pull out just the info for peer_id.
+        totals: lookups of this peer's running totals, as from
+            History.peer_totals()
         """
         self.uploads = uploads
         self.downloads = downloads
         self.peer_id = peer_id
+        (self._blocks_from, self._blocks_to, self._total_downloaded,
+         self._total_uploaded) = totals
+        self.piece_counts = piece_counts
+
+    def blocks_from(self, peer_id):
+        """Total blocks this agent has downloaded from peer_id"""
+        return self._blocks_from(peer_id)
+
+    def blocks_to(self, peer_id):
+        """Total blocks peer_id has downloaded from this agent"""
+        return self._blocks_to(peer_id)
+
+    def total_downloaded(self):
+        return self._total_downloaded()
+
+    def total_uploaded(self):
+        return self._total_uploaded()
 
     def last_round(self):
         return len(self.downloads)-1
@@ -32,13 +64,113 @@ class AgentHistory:
 
     def __repr__(self):
         return "AgentHistory(downloads=%s, uploads=%s)" % (
-            pprint.pformat(self.downloads),
-            pprint.pformat(self.uploads))
+            pprint.pformat(self.downloads[:]),
+            pprint.pformat(self.uploads[:]))
+
+
+class MessageLog:
+    """
+    One kind of message (Downloads or Uploads) for every peer and round,
+    stored column by column.  Each round's messages are appended grouped by
+    peer, so a peer's messages for a round are one contiguous run of rows.
+    """
+    def __init__(self, peer_ids, fields, make, spill_dir=None, tail_rounds=None,
+                 keep_spills=False):
+        """
+        fields: names of the message's columns after round, from and to
+        make: the message class, called as make(from_id, to_id, *fields)
+        tail_rounds: if not None, keep only the last tail_rounds rounds in
+            memory, and spill older ones to files in spill_dir
+        keep_spills: the spill files are named and outlast the log (see
+            SpillingColumns), for a log that gets checkpointed
+        """
+        self.peer_ids = peer_ids
+        # Messages can name ids that aren't peers (e.g. an Upload to None),
+        # so ids gets extended with any new ones seen.
+        self.ids = list(peer_ids)
+        self.index = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.fields = fields
+        self.make = make
+        names = ("round", "from", "to") + fields
+        self.tail_rounds = tail_rounds
+        if tail_rounds is None:
+            self.table = Columns(names)
+        else:
+            self.table = SpillingColumns(names, spill_dir, keep_spills)
+        # offsets[r * num_peers + i] is the first row of peer i's messages in
+        # round r.  The last entry is the total number of rows.
+        self.offsets = array('l', [0])
+        self.rounds = 0
+
+    def append_batch(self, batch):
+        """batch: this round's MessageBatch, grouped by the same peers"""
+        r = self.rounds
+        base = len(self.table)
+        n = len(batch)
+        if len(batch.ids) == len(self.peer_ids):
+            # Only peers in it, so its indexes are ours
+            self.table.extend([array('l', [r]) * n] + batch.arrays)
+        else:
+            remap = [self.id_index(id) for id in batch.ids]
+            for row in batch.rows(0, n):
+                self.table.append((r, remap[row[0]], remap[row[1]]) +
+                                  row[2:])
+        self.offsets.extend([base + k for k in batch.offsets[1:]])
+        self.rounds += 1
+        if self.tail_rounds is not None and self.rounds > self.tail_rounds:
+            keep_from = self.offsets[(self.rounds - self.tail_rounds) *
+                                     len(self.peer_ids)]
+            self.table.spill(keep_from - self.table.spilled)
+
+    def id_index(self, id):
+        if id not in self.index:
+            self.index[id] = len(self.ids)
+            self.ids.append(id)
+        return self.index[id]
+
+    def messages(self, peer_index, r):
+        """List of message objects for one peer in round r"""
+        k = r * len(self.peer_ids) + peer_index
+        ids = self.ids
+        return [self.make(ids[row[1]], ids[row[2]], *row[3:])
+                for row in self.table.rows(self.offsets[k],
+                                           self.offsets[k + 1])]
+
+
+class PeerRounds:
+    """
+    One peer's messages from a MessageLog, as a list with one sublist per
+    round.  The message objects are only built for the rounds that are
+    actually looked at.
+    """
+    def __init__(self, log, peer_id):
+        self.log = log
+        self.peer_index = log.index[peer_id]
+
+    def __len__(self):
+        return self.log.rounds
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self[i] for i in range(*r.indices(len(self)))]
+        if r < 0:
+            r += len(self)
+        if r < 0 or r >= len(self):
+            raise IndexError("round out of range")
+        return self.log.messages(self.peer_index, r)
+
+    def __iter__(self):
+        for r in range(len(self)):
+            yield self[r]
+
+    def __repr__(self):
+        return repr(self[:])
 
 
 class History:
     """History of the whole sim"""
-    def __init__(self, peer_ids, upload_rates):
+    def __init__(self, peer_ids, upload_rates, spill_dir=None,
+                 tail_rounds=None, piece_counts=None, keep_spills=False):
         """
         uploads:
                    dict : peer_id -> [[uploads] -- one list per round]
@@ -47,58 +179,130 @@ class History:
                    
         Keep track of the uploads _from_ and downloads _to_ the
         specified peer id.
+
+        The messages themselves are kept in columns (see MessageLog);
+        downloads and uploads are views that build the objects on demand.
+        If tail_rounds is given, only that many recent rounds stay in
+        memory; older ones go to memory-mapped files in spill_dir, which
+        are left there if keep_spills is set.
+
+        piece_counts: read-only view of the sim's count of peers with each
+        piece, passed on to every AgentHistory
         """
         self.upload_rates = upload_rates  # peer_id -> up_bw
+        self.piece_counts = piece_counts
         self.peer_ids = peer_ids[:]
 
         self.round_done = dict()   # peer_id -> round finished
-        self.downloads = dict((pid, []) for pid in peer_ids)
-        self.uploads = dict((pid, []) for pid in peer_ids)
+        # Running totals, kept up to date by update()
+        self.uploaded = dict((pid, 0) for pid in peer_ids)    # blocks sent
+        self.downloaded = dict((pid, 0) for pid in peer_ids)  # blocks received
+        self.pair_blocks = dict()  # (from_id, to_id) -> blocks
+        self.download_log = MessageLog(
+            self.peer_ids, ("piece", "blocks"), Download,
+            spill_dir, tail_rounds, keep_spills)
+        self.upload_log = MessageLog(
+            self.peer_ids, ("bw",), Upload,
+            spill_dir, tail_rounds, keep_spills)
+        self.downloads = dict((pid, PeerRounds(self.download_log, pid))
+                              for pid in peer_ids)
+        self.uploads = dict((pid, PeerRounds(self.upload_log, pid))
+                            for pid in peer_ids)
 
     def update(self, dls, ups):
         """
-        dls: dict : peer_id -> [downloads] -- downloads for this round
-        ups: dict : peer_id -> [uploads] -- uploads for this round
+        dls: downloads for this round, as a DownloadBatch or
+             dict : peer_id -> [downloads]
+        ups: uploads for this round, as an UploadBatch or
+             dict : peer_id -> [uploads]
 
-        append these downloads to to the history
+        append these downloads to to the history, and add them to the
+        running totals
         """
-        for pid in self.peer_ids:
-            self.downloads[pid].append(dls[pid])
-            self.uploads[pid].append(ups[pid])
+        if not isinstance(dls, MessageBatch):
+            dls = DownloadBatch.from_lists(self.peer_ids, dls)
+        if not isinstance(ups, MessageBatch):
+            ups = UploadBatch.from_lists(self.peer_ids, ups)
+        self.download_log.append_batch(dls)
+        self.upload_log.append_batch(ups)
+        pair_blocks = self.pair_blocks
+        ids = dls.ids
+        for (f, t, blocks) in dls.iter_columns("from", "to", "blocks"):
+            (from_id, to_id) = (ids[f], ids[t])
+            self.uploaded[from_id] += blocks
+            self.downloaded[to_id] += blocks
+            pair = (from_id, to_id)
+            pair_blocks[pair] = pair_blocks.get(pair, 0) + blocks
 
     def peer_is_done(self, round, peer_id):
         # Only save the _first_ round where we hear this
         if peer_id not in self.round_done:
             self.round_done[peer_id] = round
 
-    def peer_history(self, peer_id):
-        return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id])
+    def peer_totals(self, peer_id):
+        """
+        Functions (blocks_from, blocks_to, total_downloaded, total_uploaded)
+        reading peer_id's running totals, for its AgentHistory, which only
+        answer for peer_id.  That keeps agents from reading anyone else's
+        totals by accident, but it's no sandbox: the closures, like
+        AgentHistory.downloads and uploads, hold the sim's live structures,
+        and an agent that goes digging can reach and change them.  Agents
+        are trusted not to.
+        """
+        pair_blocks = self.pair_blocks
+        uploaded = self.uploaded
+        downloaded = self.downloaded
+        return (lambda other: pair_blocks.get((other, peer_id), 0),
+                lambda other: pair_blocks.get((peer_id, other), 0),
+                lambda: downloaded[peer_id],
+                lambda: uploaded[peer_id])
+
+    def peer_history(self, peer_id, piece_counts=None):
+        """piece_counts: the counts the agent sees, if not self.piece_counts
+        (with a topology, those of its neighborhood)"""
+        if piece_counts is None:
+            piece_counts = self.piece_counts
+        return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id],
+                            self.peer_totals(peer_id), piece_counts)
 
     def last_round(self):
         """index of the last completed round"""
-        p = self.peer_ids[0]
-        return len(self.downloads[p])-1
+        return self.download_log.rounds-1
 
     def pretty_for_round(self, r):
-        s = "\nRound %s:\n" % r
+        return "".join(self.iter_pretty_for_round(r))
+
+    def iter_pretty_for_round(self, r):
+        """Generate the lines of pretty_for_round(r) one at a time"""
+        yield "\nRound %s:\n" % r
         for peer_id in self.peer_ids:
-            ds = self.downloads[peer_id][r]
-            stringify = lambda d: "%s downloaded %d blocks of piece %d from %s\n" % (
-                peer_id, d.blocks, d.piece, d.from_id)
-            s += "".join(map(stringify, ds))
-        return s
+            for d in self.downloads[peer_id][r]:
+                yield "%s downloaded %d blocks of piece %d from %s\n" % (
+                    peer_id, d.blocks, d.piece, d.from_id)
 
     def pretty(self):
-        s = "History\n"
+        return "".join(self.iter_pretty())
+
+    def iter_pretty(self):
+        """
+        Generate pretty() a line at a time, so long histories can be
+        written out without building the whole string.
+        """
+        yield "History\n"
         for r in range(self.last_round()+1):
-            s += self.pretty_for_round(r)
-        return s
+            for line in self.iter_pretty_for_round(r):
+                yield line
+
+    def write_pretty(self, out):
+        """Write pretty() to the file-like object out"""
+        for line in self.iter_pretty():
+            out.write(line)
 
     def __repr__(self):
         return """History(
 uploads=%s
 downloads=%s
 )""" % (
-    pprint.pformat(self.uploads),
-    pprint.pformat(self.downloads))
+    pprint.pformat(dict((pid, v[:]) for (pid, v) in self.uploads.items())),
+    pprint.pformat(dict((pid, v[:]) for (pid, v) in self.downloads.items())))
 
@@ -1,6 +1,12 @@
 #!/usr/bin/python
 
-class Upload:
+import itertools
+import operator
+from array import array
+
+class Upload(object):
+    __slots__ = ('from_id', 'to_id', 'bw')
+
     def __init__(self, from_id, to_id, up_bw):
         self.from_id = from_id
         self.to_id = to_id
@@ -10,7 +16,9 @@ class Upload:
         return "Upload(from_id = %s, to_id=%s, bw=%d)" % (
             self.from_id, self.to_id, self.bw)
 
-class Request:
+class Request(object):
+    __slots__ = ('requester_id', 'peer_id', 'piece_id', 'start')
+
     def __init__(self, requester_id, peer_id, piece_id, start):
         self.requester_id = requester_id
         self.peer_id = peer_id   # peer data is requested from
@@ -21,10 +29,12 @@ class Request:
         return "Request(requester_id=%s, peer_id=%s, piece_id=%d, start=%d)" % (
             self.requester_id, self.peer_id, self.piece_id, self.start)
 
-class Download:
+class Download(object):
     """ Not actually a message--just used for accounting and history tracking of
      what is actually downloaded.
     """
+    __slots__ = ('from_id', 'to_id', 'piece', 'blocks')
+
     def __init__(self, from_id, to_id, piece, blocks):
         self.from_id = from_id  # who did the agent download from?
         self.to_id = to_id      # Who downloaded?
@@ -36,17 +46,264 @@ class Download:
             self.from_id, self.to_id, self.piece, self.blocks)
 
 
+class MessageBatch(object):
+    """
+    One round's messages of one kind, for every peer, as parallel arrays
+    of machine ints instead of one object per message.  This is how the sim
+    passes them around internally; message objects only get built for
+    agents, which see lists of them.
+
+    Rows are grouped by the peer they belong to, in peer_ids order, and
+    peer ids are stored as their index in self.ids.  That starts out as
+    peer_ids, and grows if a message names anyone else.
 
-            
-class PeerInfo:
+    A column that gets a value that isn't an int (fractional bandwidth,
+    say) turns into a plain list, so every value reads back exactly as it
+    went in.
+    """
+    message = None  # the message class
+    attrs = ()      # its constructor's arguments, as attribute names
+    fields = ()     # the columns after "from" and "to"
+
+    def __init__(self, peer_ids, index=None):
+        """index: dict : peer id -> index in peer_ids, if there's one to
+        share; it's never modified"""
+        self.peer_ids = peer_ids
+        self.ids = list(peer_ids)
+        if index is None:
+            index = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.index = index
+        self.others = dict()  # ids not in peer_ids -> index in self.ids
+        self.names = ("from", "to") + self.fields
+        self.arrays = [array('l') for n in self.names]
+        # offsets[i] is the first row of peer i's messages; the last entry
+        # is the number of rows
+        self.offsets = array('l', [0])
+
+    @classmethod
+    def from_lists(cls, peer_ids, msgs, index=None):
+        """A batch of msgs: dict : peer_id -> [message objects]"""
+        rows = []
+        offsets = [0]
+        for pid in peer_ids:
+            rows.extend(msgs[pid])
+            offsets.append(len(rows))
+        columns = [map(operator.attrgetter(attr), rows) for attr in cls.attrs]
+        return cls.from_columns(peer_ids, columns, offsets, index)
+
+    @classmethod
+    def from_columns(cls, peer_ids, columns, offsets, index=None):
+        """
+        A batch built a column at a time, which is a lot quicker than a row
+        at a time.  columns: a list of values per column, with the first
+        two holding peer ids; offsets: as self.offsets.
+        """
+        batch = cls(peer_ids, index)
+        batch.offsets = array('l', offsets)
+        for (i, values) in enumerate(columns):
+            if i < 2:
+                try:
+                    values = [batch.index[id] for id in values]
+                except KeyError:
+                    values = map(batch.id_index, values)
+            try:
+                batch.arrays[i] = array('l', values)
+            except TypeError:
+                batch.arrays[i] = list(values)
+        return batch
+
+    def id_index(self, id):
+        if id in self.index:
+            return self.index[id]
+        if id not in self.others:
+            self.others[id] = len(self.ids)
+            self.ids.append(id)
+        return self.others[id]
+
+    def append(self, row):
+        """Add a row, (from index, to index) + fields, to the current peer"""
+        for (i, value) in enumerate(row):
+            try:
+                self.arrays[i].append(value)
+            except TypeError:
+                self.arrays[i] = self.arrays[i].tolist()
+                self.arrays[i].append(value)
+
+    def end_peer(self):
+        """Move on to the next peer's messages"""
+        self.offsets.append(len(self))
+
+    def __len__(self):
+        return len(self.arrays[0])
+
+    def span(self, i):
+        """(first, last + 1) rows of the messages of peer_ids[i]"""
+        return (self.offsets[i], self.offsets[i + 1])
+
+    def column(self, name):
+        """The array (or list) holding column name.  Don't modify it."""
+        return self.arrays[self.names.index(name)]
+
+    def iter_columns(self, *names):
+        return itertools.izip(*[self.column(n) for n in names])
+
+    def rows(self, start, stop):
+        """List of the rows in [start, stop), as tuples"""
+        return zip(*[a[start:stop] for a in self.arrays])
+
+    def messages(self, i):
+        """Message objects for the messages of peer_ids[i]"""
+        ids = self.ids
+        return [self.message(ids[row[0]], ids[row[1]], *row[2:])
+                for row in self.rows(*self.span(i))]
+
+    def by_peer(self):
+        """dict : peer_id -> [message objects], as agents see them"""
+        return dict((pid, self.messages(i))
+                    for (i, pid) in enumerate(self.peer_ids))
+
+    def __getstate__(self):
+        # The shared index gets rebuilt rather than pickled
+        state = self.__dict__.copy()
+        del state["index"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = dict((pid, i) for (i, pid) in enumerate(self.peer_ids))
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.by_peer())
+
+
+class RequestBatch(MessageBatch):
+    """A round's Requests, grouped by requester"""
+    message = Request
+    attrs = ("requester_id", "peer_id", "piece_id", "start")
+    fields = ("piece", "start")
+
+
+class UploadBatch(MessageBatch):
+    """A round's Uploads, grouped by uploader"""
+    message = Upload
+    attrs = ("from_id", "to_id", "bw")
+    fields = ("bw",)
+
+
+class DownloadBatch(MessageBatch):
+    """A round's Downloads, grouped by the peer that downloaded"""
+    message = Download
+    attrs = ("from_id", "to_id", "piece", "blocks")
+    fields = ("piece", "blocks")
+
+
+class PeerInfo(object):
     """
     Only passing peer ids and the pieces they have available to each agent.
     This prevents them from accidentally messing up the state of other agents.
+
+    PeerInfos are shared by all the agents in a round, so they're read-only:
+    available_pieces is a frozenset, and the attributes can't be reassigned.
     """
+    __slots__ = ('id', 'available_pieces')
+
     def __init__(self, id, available):
-        self.id = id
-        self.available_pieces = available
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'available_pieces', available)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PeerInfo is read-only")
+
+    def __reduce__(self):
+        # Unpickling can't set attributes the usual way
+        return (PeerInfo, (self.id, self.available_pieces))
 
     def __repr__(self):
         return "PeerInfo(id=%s)" % self.id
 
+
+class OtherPeers(object):
+    """
+    What an agent sees as its list of peers: the round's shared tuple of
+    PeerInfos with the agent's own entry skipped, without copying the tuple.
+
+    Reading (iteration, len, indexing) goes straight to the shared tuple.
+    Anything that reorders the list (sort, shuffle, item assignment) first
+    copies it into a list private to this view.
+    """
+    def __init__(self, peer_info, skip):
+        """peer_info: tuple of PeerInfo; skip: index of the agent's own entry"""
+        self._shared = peer_info
+        self._skip = skip
+        self._own = None
+
+    def _materialize(self):
+        if self._own is None:
+            self._own = list(iter(self))
+        return self._own
+
+    def __iter__(self):
+        if self._own is not None:
+            return iter(self._own)
+        return itertools.chain(
+            itertools.islice(self._shared, 0, self._skip),
+            itertools.islice(self._shared, self._skip + 1, None))
+
+    def __len__(self):
+        if self._own is not None:
+            return len(self._own)
+        return len(self._shared) - 1
+
+    def __getitem__(self, i):
+        if self._own is not None or isinstance(i, slice):
+            return self._materialize()[i]
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError("peer index out of range")
+        if i >= self._skip:
+            i += 1
+        return self._shared[i]
+
+    def __setitem__(self, i, value):
+        self._materialize()[i] = value
+
+    def __contains__(self, peer):
+        return peer in iter(self)
+
+    def sort(self, *args, **kwargs):
+        self._materialize().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._materialize().reverse()
+
+    def __repr__(self):
+        return repr(list(iter(self)))
+
+
+class NeighborPeers(OtherPeers):
+    """
+    OtherPeers for an agent that can only see its neighbors (see
+    topology.py): the entries of the shared tuple at the given positions.
+    """
+    def __init__(self, peer_info, positions):
+        """positions: indexes of the neighbors' entries in peer_info"""
+        OtherPeers.__init__(self, peer_info, None)
+        self._positions = positions
+
+    def __iter__(self):
+        if self._own is not None:
+            return iter(self._own)
+        shared = self._shared
+        return (shared[j] for j in self._positions)
+
+    def __len__(self):
+        if self._own is not None:
+            return len(self._own)
+        return len(self._positions)
+
+    def __getitem__(self, i):
+        if self._own is not None or isinstance(i, slice):
+            return self._materialize()[i]
+        return self._shared[self._positions[i]]
@@ -17,6 +17,11 @@ class Peer:
         self.max_requests = self.conf.max_up_bw / self.conf.blocks_per_piece + 1
         self.max_requests = min(self.max_requests, self.conf.num_pieces)
 
+        # Where to get random numbers: rng.sample(), rng.choice() etc.  The
+        # sim gives each peer its own random.Random, seeded from --seed, so
+        # runs can be repeated however the peers' calls get ordered.
+        self.rng = random
+
         self.post_init()
 
     def __repr__(self):
@@ -37,6 +42,10 @@ class Peer:
     def uploads(self, requests, peers, history):
         return []
 
+    # Subclasses can also define requests_batch / uploads_batch
+    # classmethods, to make one call for all their peers at once: see
+    # batch.py.
+
     def post_init(self):
         # Here to be overridden by child classes
         pass
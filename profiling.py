@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+"""
+Timing hooks for the sim.  Sim.run_sim_once wraps each phase of a round in
+timer.phase(name), and each agent's requests()/uploads() call in
+timer.agent_call(peer, method).  With the default NullTimer that costs next
+to nothing; sim.py --profile swaps in a PhaseTimer, or runs the whole thing
+under cProfile or the SamplingProfiler below.
+"""
+
+import csv
+import signal
+import time
+
+
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+class NullTimer(object):
+    """Doesn't record anything.  The default."""
+    _phase = NullPhase()
+
+    def start_run(self):
+        pass
+
+    def phase(self, name):
+        return self._phase
+
+    def agent_call(self, peer, method):
+        return self._phase
+
+    def end_round(self, round):
+        pass
+
+    def take_agent_totals(self):
+        return None
+
+    def add_agent_totals(self, agent_totals):
+        pass
+
+
+class Phase(object):
+    """
+    Context manager that charges the wall and CPU time spent inside it to
+    one key.  Phases can nest; time spent in an inner phase isn't also
+    charged to the outer one.
+    """
+    def __init__(self, timer, key):
+        self.timer = timer
+        self.key = key
+
+    def __enter__(self):
+        self.inner_wall = 0.0
+        self.inner_cpu = 0.0
+        self.timer.stack.append(self)
+        self.start_wall = time.time()
+        self.start_cpu = time.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.time() - self.start_wall
+        cpu = time.clock() - self.start_cpu
+        stack = self.timer.stack
+        stack.pop()
+        if stack:
+            stack[-1].inner_wall += wall
+            stack[-1].inner_cpu += cpu
+        self.timer.add(self.key, wall - self.inner_wall, cpu - self.inner_cpu)
+        return False
+
+
+class PhaseTimer(object):
+    """
+    Wall and CPU time spent in each phase of each round, and inside each
+    agent class's requests() and uploads().
+
+    totals: dict : phase name -> wall seconds
+    cpu_totals: dict : phase name -> CPU seconds
+    agent_totals: dict : (class name, method) -> [calls, wall, CPU]
+    rounds: [(iteration, round, dict : phase name -> (wall, CPU))]
+    """
+    def __init__(self):
+        self.totals = dict()
+        self.cpu_totals = dict()
+        self.agent_totals = dict()
+        self.rounds = []
+        self.current = dict()
+        self.stack = []
+        self.iteration = -1
+
+    def start_run(self):
+        self.iteration += 1
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def agent_call(self, peer, method):
+        key = (peer.__class__.__name__, method)
+        entry = self.agent_totals.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        return Phase(self, key)
+
+    def add(self, key, wall, cpu):
+        if isinstance(key, tuple):
+            entry = self.agent_totals[key]
+            entry[1] += wall
+            entry[2] += cpu
+            return
+        self.totals[key] = self.totals.get(key, 0) + wall
+        self.cpu_totals[key] = self.cpu_totals.get(key, 0) + cpu
+        (w, c) = self.current.get(key, (0, 0))
+        self.current[key] = (w + wall, c + cpu)
+
+    def end_round(self, round):
+        self.rounds.append((self.iteration, round, self.current))
+        self.current = dict()
+
+    def take_agent_totals(self):
+        """agent_totals so far, starting over from none: for an agent
+        worker to send back to the sim (see agentpool.py)"""
+        (ans, self.agent_totals) = (self.agent_totals, dict())
+        return ans
+
+    def add_agent_totals(self, agent_totals):
+        """Add agent_totals, as from take_agent_totals(), to ours"""
+        for (key, counts) in agent_totals.items():
+            entry = self.agent_totals.setdefault(key, [0, 0.0, 0.0])
+            for (i, n) in enumerate(counts):
+                entry[i] += n
+
+    def phase_names(self):
+        return sorted(self.totals.keys(), key=self.totals.__getitem__,
+                      reverse=True)
+
+    def summary(self):
+        """Return a printable table of the totals"""
+        lines = []
+        total = sum(self.totals.values()) or 1.0
+        lines.append("%-22s %10s %10s %6s" % ("phase", "wall", "cpu", "%"))
+        for name in self.phase_names():
+            lines.append("%-22s %10.4f %10.4f %6.1f" % (
+                name, self.totals[name], self.cpu_totals[name],
+                100 * self.totals[name] / total))
+        lines.append("")
+        lines.append("%-22s %-9s %8s %10s %10s" % (
+            "agent class", "method", "calls", "wall", "cpu"))
+        for ((cls, method), (calls, wall, cpu)) in sorted(
+                self.agent_totals.items(), key=lambda kv: -kv[1][1]):
+            lines.append("%-22s %-9s %8d %10.4f %10.4f" % (
+                cls, method, calls, wall, cpu))
+        return "\n".join(lines)
+
+    def write_rounds(self, out):
+        """Write the per-round table to the file-like object out, as CSV"""
+        names = self.phase_names()
+        w = csv.writer(out)
+        header = ["iteration", "round"]
+        for name in names:
+            header.extend([name + "_wall", name + "_cpu"])
+        w.writerow(header)
+        for (iteration, round, phases) in self.rounds:
+            row = [iteration, round]
+            for name in names:
+                row.extend(phases.get(name, (0, 0)))
+            w.writerow(row)
+
+
+class SamplingProfiler(object):
+    """
+    Low-overhead statistical profiler: a profiling timer interrupts the
+    process every `interval` seconds of CPU time, and the current Python
+    stack gets counted.  Only sees the main thread of this process.
+
+    Results come out in the "collapsed stacks" format flame graph tools
+    read: one line per distinct stack, frames separated by ';', then the
+    number of samples.
+    """
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.counts = dict()  # stack tuple -> samples
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s:%s" % (code.co_filename, code.co_name))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def write(self, out):
+        for (stack, n) in sorted(self.counts.items(), key=lambda kv: -kv[1]):
+            out.write("%s %d\n" % (";".join(stack), n))
@@ -19,6 +19,6 @@ class Seed(Peer):
             return []
         bws = even_split(self.up_bw, n)
         uploads = [Upload(self.id, p_id, bw)
-                   for (p_id, bw) in zip(random.sample(requester_ids, n), bws)]
+                   for (p_id, bw) in zip(self.rng.sample(requester_ids, n), bws)]
         
         return uploads
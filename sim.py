@@ -8,112 +8,343 @@ Simulates one file being shared amongst a set of peers.  The file is divided int
 The simulation proceeds in rounds.  In each round, peers can request pieces from other peers, and then decide how much to upload to others.  Once every peer has every piece, the simulation ends.
 """
 
-import re
 import random
 import sys
 import logging
 import copy
+import hashlib
 import itertools
+import multiprocessing
 import pprint
 from optparse import OptionParser
 
-from messages import Upload, Request, Download, PeerInfo
+from messages import (Upload, Request, PeerInfo, OtherPeers, NeighborPeers,
+                      RequestBatch, UploadBatch, DownloadBatch)
 from util import *
 from stats import Stats
 from history import History
+from state import (PieceMatrix, CompletionTracker, ReplicaCounts,
+                   NeighborhoodCounts)
+from bitset import PieceSet
+from batch import AgentBatch, group_calls
+from profiling import NullTimer, PhaseTimer, SamplingProfiler
+from topology import Topology, POLICIES
+from cache import ResultCache
+from checkpoint import Checkpoints
+from bandwidth import Bandwidths, DISTRIBUTIONS
     
 
-class Sim:
-    def __init__(self, config):
-        self.config = config
-        self.up_bws_state = dict()
+def peer_ids_for(agent_class_names):
+    """
+    Peer ids are the class name plus a per-class counter:
+    ["Dummy", "Dummy", "Seed"] -> ["Dummy0", "Dummy1", "Seed0"]
+    """
+    counts = dict()
+    def index(name):
+        if name in counts:
+            a = counts[name]
+            counts[name] += 1
+        else:
+            a = 0
+            counts[name] = 1
+        return a
 
-    
-    def up_bw(self, peer_id, reinit=False):
-        """Return a consistent bw for this peer"""
-        c = self.config
-        s = self.up_bws_state
+    return map(lambda n: "%s%d" % (n,index(n)), agent_class_names)
 
-        # Re-initialize up-bws if we are starting a new simulation
-        if reinit and peer_id in s:
-            del s[peer_id]
-        
-        """Sets the upload bandwidth of seeds to max, other agents at random"""
-        if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
-        else: the_up_bw = random.randint(c.min_up_bw, c.max_up_bw)
-        
-        return s.setdefault(peer_id, the_up_bw)
 
-    def run_sim_once(self):
-        """Return a history"""
-        conf = self.config
-        # Keep track of the current round.  Needs to be in scope for helpers.
-        round = 0  
+def iteration_seed(seed, i):
+    """Derive the random seed for iteration i from the master seed, so an
+    iteration's result doesn't depend on which worker ran it, or when."""
+    digest = hashlib.md5("%d:%d" % (seed, i)).hexdigest()
+    return int(digest[:8], 16)
 
-        def check_pred(pred, msg, Exc, lst):
-            """Check if any element of lst matches the predicate.  If it does,
-            raise an exception of type Exc, including the msg and the offending
-            element."""
-            m = map(pred, lst)
-            if True in m:
-                i = m.index(True)
-                raise Exc(msg + " Bad element: %s" % lst[i])
-
-        def check_uploads(peer, uploads):
-            """Raise an IllegalUpload exception if there is a problem."""
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalUpload, uploads)
-
-            not_upload = lambda o: not isinstance(o, Upload)
-            check(not_upload, "List of Uploads contains non-Upload object.")
-
-            self_upload = lambda upload: upload.to_id == peer.id
-            check(self_upload, "Can't upload to yourself.")
-            
-            not_from_self = lambda upload: upload.from_id != peer.id
-            check(not_from_self, "Upload.from != peer id.")
 
-            check(lambda u: u.bw < 0, "Upload bandwidth must be non-negative!")
+def stream_seed(base, name):
+    """Seed for the random stream called name (a peer id, or "sim") in the
+    run whose seed is base"""
+    digest = hashlib.md5("%d:%s" % (base, name)).hexdigest()
+    return int(digest[:8], 16)
 
-            limit = self.up_bw(peer.id)
-            if sum(map(lambda u: u.bw, uploads)) > limit:
-                raise IllegalUpload("Can't upload more than limit of %d. %s" % (
-                    limit, uploads))
 
-            # If we got here, looks ok.
+def call_seed(base, round, peer_id, method):
+    """
+    With --seed, the random module gets reseeded with this before every
+    agent's requests() and uploads() call, so what an agent draws doesn't
+    depend on the order the calls run in, or which process runs them.
+    That's for agents that use the random module directly; peer.rng
+    doesn't need it.  base is drawn once per run from the iteration's seed.
+    """
+    digest = hashlib.md5("%d:%d:%s:%s" % (base, round, peer_id,
+                                          method)).hexdigest()
+    return int(digest[:8], 16)
 
-        def check_requests(peer, requests, peer_pieces, available):
-            """Raise an IllegalRequest exception if there is a problem."""
 
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalRequest, requests)
+def index_requests(peer_ids, all_requests):
+    """
+    Return dict: peer_id -> [Requests asking that peer for data], built in
+    one pass over all_requests (dict: peer_id -> that peer's Requests).
+    Requests to anyone not in peer_ids, which only get through in rounds
+    that aren't validated, are left out.
+    """
+    requests_to = dict((pid, []) for pid in peer_ids)
+    for rs in all_requests.values():
+        for r in rs:
+            asked = requests_to.get(r.peer_id)
+            if asked is not None:
+                asked.append(r)
+    return requests_to
 
-            check(lambda o: not isinstance(o, Request),
-                  "List of Requests contains non-Request object.")
 
-            bad_piece_id = lambda r: (r.piece_id < 0 or
-                                      r.piece_id >= self.config.num_pieces)
-            check(bad_piece_id, "Request asks for non-existent piece!")
-            
-            bad_peer_id = lambda r: r.peer_id not in self.peer_ids
-            check(bad_peer_id, "Request mentions non-existent peer!")
-
-            bad_requester_id = lambda r: r.requester_id != peer.id
-            check(bad_requester_id, "Request has wrong peer id!")
-
-            bad_start_block = lambda r: (
-                r.start < 0 or
-                r.start >= self.config.blocks_per_piece or
-                r.start > peer_pieces[peer.id][r.piece_id])
-            # Must request the _next_ necessary block
-            check(bad_start_block, "Request has bad start block!")
-
-            def piece_peer_does_not_have(r):
-                other_peer = self.peers_by_id[r.peer_id]
-                return r.piece_id not in available[other_peer.id]
-            check(piece_peer_does_not_have, "Asking for piece peer does not have!")
+def index_uploads(uploads):
+    """
+    Return dict: requester_id -> {uploader_id -> upload rate in blocks per
+    time period}, from the round's UploadBatch.  If a peer lists the same
+    requester twice, the first Upload counts.
+    """
+    rates = dict()
+    ids = uploads.ids
+    for (f, t, bw) in uploads.iter_columns("from", "to", "bw"):
+        rates.setdefault(ids[t], dict()).setdefault(ids[f], bw)
+    return rates
+
+
+def run_iteration(args):
+    """Pool worker: run one iteration, and send back only its stats."""
+    (config, seed) = args
+    return make_sim(config).run_iteration(seed)
+
+
+def make_sim(config):
+    """The Sim for config.engine: round by round, or event driven"""
+    if config.engine == "event":
+        from eventsim import EventSim
+        return EventSim(config)
+    return Sim(config)
+
+
+class Sim:
+    def __init__(self, config):
+        self.config = config
+        # This run's upload bandwidths; see bandwidth.py
+        self.bandwidths = None
+        # The iteration's seed, if it has one; see start_streams()
+        self.seed = None
+        self.rng = random
+        # Gets told when each phase of a round starts and ends; see
+        # profiling.py
+        self.timer = NullTimer()
+        # Who can see whom; None for everyone seeing everyone
+        self.topology = None
+        # Results of earlier seeded iterations; see cache.py
+        self.cache = None
+        if config.cache_dir is not None:
+            self.cache = ResultCache(config.cache_dir, config.cache_max_mb)
+        # Saves the state of the run now and then; see checkpoint.py
+        self.checkpoints = None
+        if config.checkpoint is not None:
+            self.checkpoints = Checkpoints(config)
+
+    def set_bandwidths(self, round, peers):
+        """
+        With --bw-trace, move everyone's upload bandwidth on to round's:
+        the sim's limits, and self.up_bw of the agents in peers (None when
+        they live in agent workers).  Returns the new bandwidths in peer
+        order, or None if none changed.
+        """
+        bws = self.bandwidths
+        if not bws.at_round(round):
+            return None
+        self.upload_limits = bws.rates()
+        if peers is not None:
+            for (p, bw) in zip(peers, bws.capacity):
+                p.up_bw = bw
+        return bws.capacity
+
+    def create_peers(self):
+        """Each agent class must be already loaded, and have a
+        constructor that takes the config, id,  pieces, and
+        up and down bandwidth, in that order.
+
+        Returns (peers, peer_pieces)."""
+        conf = self.config
+        (specs, peer_pieces) = self.peer_specs()
+        peers = [conf.agent_classes[class_name](conf, id, pieces, up_bw)
+                 for (class_name, id, pieces, up_bw) in specs]
+        for p in peers:
+            p.rng = self.peer_rng(p.id)
+        #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
+        return peers, peer_pieces
+
+    def peer_specs(self):
+        """
+        Everything needed to construct the peers, without constructing
+        them.  Returns (specs, peer_pieces), where specs is a list of
+        (class name, id, pieces, up_bw).
+        """
+        conf = self.config
+        ids = peer_ids_for(conf.agent_class_names)
+
+        is_seed = lambda id: id.startswith("Seed")
+
+        def get_pieces(id):
+            if id.startswith("Seed"):
+                return [conf.blocks_per_piece]*conf.num_pieces
+            else:
+                return [0]*conf.num_pieces
             
-            # If we got here, looks ok
+        if conf.piece_state == "matrix":
+            # peers x pieces array, updated in place
+            peer_pieces = PieceMatrix(ids, conf.num_pieces, get_pieces)
+        else:
+            peer_pieces = dict()  # id -> list (blocks / piece)
+            peer_pieces = dict((id, get_pieces(id)) for id in ids)
+        pieces = [get_pieces(id) for id in ids]
+        
+        # Each new simulation draws its own upload bandwidths
+        self.bandwidths = Bandwidths(conf, ids, self.rng)
+        specs = zip(conf.agent_class_names, ids, pieces,
+                    self.bandwidths.capacity)
+        return specs, peer_pieces
+
+    def check_uploads(self, peer, uploads):
+        """Raise an IllegalUpload exception if there is a problem.
+        Makes one pass over the list, stopping at the first bad upload."""
+        total = 0
+        for u in uploads:
+            if not isinstance(u, Upload):
+                msg = "List of Uploads contains non-Upload object."
+            elif u.to_id == peer.id:
+                msg = "Can't upload to yourself."
+            elif u.from_id != peer.id:
+                msg = "Upload.from != peer id."
+            elif u.bw < 0:
+                msg = "Upload bandwidth must be non-negative!"
+            else:
+                total += u.bw
+                continue
+            raise IllegalUpload(msg + " Bad element: %s" % u)
+
+        limit = self.upload_limits[peer.id]
+        if total > limit:
+            raise IllegalUpload("Can't upload more than limit of %d. %s" % (
+                limit, uploads))
+
+        # If we got here, looks ok.
+
+    def check_requests(self, peer, requests, peer_pieces, available):
+        """Raise an IllegalRequest exception if there is a problem.
+        Makes one pass over the list, stopping at the first bad request."""
+        num_pieces = self.config.num_pieces
+        blocks_per_piece = self.config.blocks_per_piece
+        pieces = peer_pieces[peer.id]
+        for r in requests:
+            if not isinstance(r, Request):
+                msg = "List of Requests contains non-Request object."
+            elif r.piece_id < 0 or r.piece_id >= num_pieces:
+                msg = "Request asks for non-existent piece!"
+            elif r.peer_id not in self.peers_by_id:
+                msg = "Request mentions non-existent peer!"
+            elif r.requester_id != peer.id:
+                msg = "Request has wrong peer id!"
+            elif (self.topology is not None and
+                  not self.topology.are_neighbors(self.position[peer.id],
+                                                  self.position[r.peer_id])):
+                msg = "Request asks a peer that isn't a neighbor!"
+            elif (r.start < 0 or r.start >= blocks_per_piece or
+                  r.start > pieces[r.piece_id]):
+                # Must request the _next_ necessary block
+                msg = "Request has bad start block!"
+            elif r.piece_id not in available[r.peer_id]:
+                msg = "Asking for piece peer does not have!"
+            else:
+                continue
+            raise IllegalRequest(msg + " Bad element: %s" % r)
+
+        # If we got here, looks ok
+
+    def start_streams(self):
+        """
+        Set up this run's random streams: self.rng for the sim's own draws
+        (bandwidths, neighbors), and one per peer (see peer_rng).  They all
+        derive from the iteration's seed, or from the random module if
+        there isn't one, so no peer's draws depend on anyone else's.
+        """
+        if self.seed is not None:
+            self.run_seed = self.seed
+        else:
+            self.run_seed = random.getrandbits(32)
+        self.rng = random.Random(stream_seed(self.run_seed, "sim"))
+
+    def peer_rng(self, peer_id):
+        """The random.Random agent peer_id gets as peer.rng"""
+        return random.Random(stream_seed(self.run_seed, peer_id))
+
+    def make_topology(self):
+        """A Topology as set up by config.neighbors, or None.  Call after
+        setting self.peer_ids."""
+        conf = self.config
+        if conf.neighbors <= 0:
+            return None
+        rng = random.Random(self.rng.getrandbits(32))
+        return Topology(len(self.peer_ids), conf.neighbors,
+                        POLICIES[conf.topology], conf.refresh_every, rng)
+
+    def peers_view(self, snapshot, i):
+        """What the peer at position i gets as its list of peers: everyone
+        else, or just its neighbors"""
+        if self.topology is not None:
+            return NeighborPeers(snapshot, self.topology.neighbors[i])
+        return OtherPeers(snapshot, i)
+
+    def neighborhood_counts(self, snapshot, i):
+        """With a topology, the piece counts the peer at position i sees in
+        its history: over itself and its neighbors, as of snapshot.  None
+        without one, for the counts over the whole swarm."""
+        if self.topology is None:
+            return None
+        return NeighborhoodCounts(snapshot,
+                                  (i,) + tuple(self.topology.neighbors[i]),
+                                  self.config.num_pieces)
+
+    def neighbors_of(self, positions):
+        """Neighbor positions for each of positions, for an AgentBatch"""
+        if self.topology is None:
+            return None
+        return [self.topology.neighbors[i] for i in positions]
+
+    def piece_set_types(self):
+        """Return (type of the sim's available sets, function making the
+        read-only copy agents see), as picked by config.piece_sets.
+
+        The frozensets are built in piece order, so their iteration order
+        only depends on what's in them -- agent workers rebuilding the same
+        snapshot get the same order."""
+        if self.config.piece_sets == "bitset":
+            return (PieceSet, PieceSet.frozen)
+        else:
+            return (set, lambda pieces: frozenset(sorted(pieces)))
+
+    def validate_round(self, round):
+        """
+        Whether to check this round's requests and uploads.  Always,
+        unless agents are trusted: then only the first validate_first
+        rounds, and every validate_every'th round after that (never, if
+        validate_every is 0).
+        """
+        conf = self.config
+        if not conf.trust_agents or round < conf.validate_first:
+            return True
+        return conf.validate_every > 0 and round % conf.validate_every == 0
+
+    def run_sim_once(self):
+        """Return a history"""
+        conf = self.config
+        timer = self.timer
+        timer.start_run()
+        self.start_streams()
+        # Keep track of the current round.  Needs to be in scope for helpers.
+        round = 0  
+        validating = True
 
         def available_pieces(peer_id, peer_pieces):
             """
@@ -122,107 +353,71 @@ class Sim:
             return filter(lambda i: peer_pieces[peer_id][i] == conf.blocks_per_piece,
                           range(conf.num_pieces))
 
-        def peer_done(peer_pieces, peer_id):
-            # TODO: remove linear pass
-            for blocks_so_far in peer_pieces[peer_id]:
-                if blocks_so_far < conf.blocks_per_piece:
-                    return False
-            return True
-            
-        def all_done(peer_pieces):
-            result = True
-            # Check all peers to update done status
-            for peer_id in peer_pieces:
-                if peer_done(peer_pieces, peer_id):
-                    history.peer_is_done(round, peer_id)
-                else:
-                    result = False
-            return result
-
-        def create_peers():
-            """Each agent class must be already loaded, and have a
-            constructor that takes the config, id,  pieces, and
-            up and down bandwidth, in that order."""
-
-            def load(class_name, params):
-                agent_class = conf.agent_classes[class_name]
-                return agent_class(*params)
-
-            counts = dict()
-            def index(name):
-                if name in counts:
-                    a = counts[name]
-                    counts[name] += 1
-                else:
-                    a = 0
-                    counts[name] = 1
-                return a
-
-            n = len(conf.agent_class_names)
-            ids = map(lambda n: "%s%d" % (n,index(n)), conf.agent_class_names)
-
-            is_seed = lambda id: id.startswith("Seed")
-
-            def get_pieces(id):
-                if id.startswith("Seed"):
-                    return [conf.blocks_per_piece]*conf.num_pieces
-                else:
-                    return [0]*conf.num_pieces
-                
-            peer_pieces = dict()  # id -> list (blocks / piece)
-            peer_pieces = dict((id, get_pieces(id)) for id in ids)
-            pieces = [get_pieces(id) for id in ids]
-            r = itertools.repeat
-            
-            # Re-initialize upload bandwidths at the beginning of each
-            # new simulation
-            up_bws = [self.up_bw(id, reinit=True) for id in ids] 
-            params = zip(r(conf), ids, pieces, up_bws)
-
-            peers = map(load, conf.agent_class_names, params)
-            #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
-            return peers, peer_pieces
-
-        def get_peer_requests(p, peer_info, peer_history, peer_pieces, available):
-            def remove_me(info):
-                # TODO: Do we need this linear pass?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            pieces = copy.copy(peer_pieces[p.id])
-            # Made copy of pieces and the peer info this peer needs to make it's
-            # decision, so that it can't change the simulation's copies.
+        def all_done():
+            # Only peers that finished since the last check need telling
+            for peer_id in completion.pop_newly_done():
+                history.peer_is_done(round, peer_id)
+            return completion.all_done()
+
+        def get_peer_requests(p, peers, peer_history, peer_pieces, available):
+            pieces = list(peer_pieces[p.id])
+            # Made copy of pieces this peer needs to make it's decision, so
+            # that it can't change the simulation's copy.  The peer info is
+            # a read-only view of the round's shared snapshot.
             p.update_pieces(pieces)
-            rs = p.requests(remove_me(peer_info), peer_history)
-            check_requests(p, rs, peer_pieces, available)
+            if seed_base is not None:
+                random.seed(call_seed(seed_base, round, p.id, "requests"))
+            with timer.agent_call(p, "requests"):
+                rs = p.requests(peers, peer_history)
+            if validating:
+                with timer.phase("request_validation"):
+                    self.check_requests(p, rs, peer_pieces, available)
             return rs
 
-        def get_peer_uploads(all_requests, p, peer_info, peer_history):
-            def remove_me(info):
-                # TODO: remove this pass?  Use a set?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            def requests_to(id):
-                f = lambda r: r.peer_id == id
-                ans = []
-                for rs in all_requests.values():
-                    ans.extend(filter(f, rs))
-                return ans
-
-            requests = requests_to(p.id)
-
-            us = p.uploads(requests, remove_me(peer_info), peer_history)
-            check_uploads(p, us)
+        def get_peer_uploads(requests, p, peers, peer_history):
+            if seed_base is not None:
+                random.seed(call_seed(seed_base, round, p.id, "uploads"))
+            with timer.agent_call(p, "uploads"):
+                us = p.uploads(requests, peers, peer_history)
+            if validating:
+                with timer.phase("upload_validation"):
+                    self.check_uploads(p, us)
             return us
 
-        def upload_rate(uploads, uploader_id, requester_id):
-            """
-            return the uploading rate from uploader to requester
-            in blocks per time period, or 0 if not uploading.
-            """
-            for u in uploads[uploader_id]:
-                if u.to_id == requester_id:
-                    return u.bw
-            return 0
+        def batch_seed(agents, method):
+            if seed_base is not None:
+                random.seed(call_seed(seed_base, round,
+                                      agents[0].__class__.__name__, method))
+
+        def get_batch_requests(batch_method, agents, positions, peer_info,
+                               histories, peer_pieces, available):
+            """One requests_batch() call for agents, all of the same class.
+            Returns their lists of requests."""
+            for p in agents:
+                p.update_pieces(list(peer_pieces[p.id]))
+            batch = AgentBatch(conf, agents, positions, peer_info, histories,
+                               neighbors=self.neighbors_of(positions))
+            batch_seed(agents, "requests_batch")
+            with timer.agent_call(agents[0], "requests_batch"):
+                rss = batch_method(batch)
+            if validating:
+                with timer.phase("request_validation"):
+                    for (p, rs) in zip(agents, rss):
+                        self.check_requests(p, rs, peer_pieces, available)
+            return rss
+
+        def get_batch_uploads(batch_method, agents, positions, peer_info,
+                              histories, requests):
+            batch = AgentBatch(conf, agents, positions, peer_info, histories,
+                               requests, self.neighbors_of(positions))
+            batch_seed(agents, "uploads_batch")
+            with timer.agent_call(agents[0], "uploads_batch"):
+                uss = batch_method(batch)
+            if validating:
+                with timer.phase("upload_validation"):
+                    for (p, us) in zip(agents, uss):
+                        self.check_uploads(p, us)
+            return uss
 
         def update_peer_pieces(peer_pieces, requests, uploads, available):
             """
@@ -231,12 +426,34 @@ class Sim:
             Make sure requesting the same thing from lots of peers doesn't
             stack.
             update the sets of available pieces as needed.
+
+            requests and uploads are the round's RequestBatch and
+            UploadBatch.  Returns (peer pieces, DownloadBatch).
+
+            With the matrix piece state, peer_pieces is updated in place;
+            nothing reads it again until this round's downloads are applied.
+
+            Requests for a piece the uploader didn't have at the start of
+            the round get nothing.  Validation rejects those anyway; this
+            is for rounds that aren't validated (--trust-agents).
             """
-            downloads = dict()  # peer_id -> [downloads]
-            new_pp = copy.deepcopy(peer_pieces)
-            for requester_id in requests:
-                downloads[requester_id] = list()
-            for requester_id in requests:
+            # The downloads, as rows (from, to, piece, blocks), and where each
+            # requester's start; see DownloadBatch
+            download_rows = []
+            offsets = [0]
+            rates = index_uploads(uploads)
+            if conf.piece_state == "matrix":
+                new_pp = peer_pieces
+            else:
+                new_pp = copy.deepcopy(peer_pieces)
+            ids = requests.ids
+            asked_id = [ids[k] for k in requests.column("to")].__getitem__
+            asked_piece = requests.column("piece")
+            asked_start = requests.column("start")
+            # (peer, piece) for the pieces finished this round, which their
+            # owners can't upload until next round
+            finished = set()
+            for (i, requester_id) in enumerate(self.peer_ids):
                 # Keep track of how many blocks of each piece this
                 # requester got.  piece -> (blocks, from_who)
                 new_blocks_per_piece = dict()
@@ -248,113 +465,384 @@ class Sim:
                     else:
                         new_blocks_per_piece[piece_id] = (blocks, peer_id)
 
-                # Group the requests by peer that is being asked
-                get_peer_id = lambda r: r.peer_id
-                rs = sorted(requests[requester_id], key=get_peer_id)
-                for peer_id, rs_for_peer in itertools.groupby(rs, get_peer_id):
-                    bw = upload_rate(uploads, peer_id, requester_id)
+                # Group the requests (rows of the batch) by peer that is
+                # being asked.  Requests to peers that aren't uploading to
+                # this requester can't get anything, so they're left out.
+                uploaders = rates.get(requester_id)
+                if uploaders and self.topology is not None:
+                    # Only neighbors trade, whether or not this round's
+                    # requests were validated
+                    linked = self.topology.linked[i]
+                    uploaders = dict(
+                        (pid, bw) for (pid, bw) in uploaders.items()
+                        if self.position.get(pid) in linked)
+                rows = []
+                if uploaders:
+                    rows = sorted([k for k in xrange(*requests.span(i))
+                                   if asked_id(k) in uploaders], key=asked_id)
+                for peer_id, rows_for_peer in itertools.groupby(rows, asked_id):
+                    bw = uploaders[peer_id]
                     if bw == 0:
                         continue
+                    has = available.get(peer_id, ())
                     # This bandwidth gets applied in order to each piece requested
-                    for r in rs_for_peer:
-                        needed_blocks = conf.blocks_per_piece - r.start
+                    for k in rows_for_peer:
+                        piece_id = asked_piece[k]
+                        if (piece_id not in has or
+                                (peer_id, piece_id) in finished):
+                            continue
+                        needed_blocks = conf.blocks_per_piece - asked_start[k]
                         alloced_bw = min(bw, needed_blocks)
-                        update_count(r.piece_id, alloced_bw, peer_id)
+                        update_count(piece_id, alloced_bw, peer_id)
                         bw -= alloced_bw
                         if bw == 0:
                             break
+                requester_pieces = new_pp[requester_id]
                 for piece_id in new_blocks_per_piece:
                     (blocks, peer_id) = new_blocks_per_piece[piece_id]
-                    new_pp[requester_id][piece_id] += blocks
-                    if new_pp[requester_id][piece_id] == conf.blocks_per_piece:
+                    old_blocks = requester_pieces[piece_id]
+                    requester_pieces[piece_id] += blocks
+                    completion.update(requester_id, old_blocks,
+                                      requester_pieces[piece_id])
+                    if requester_pieces[piece_id] == conf.blocks_per_piece:
                         available[requester_id].add(piece_id)
-                    d = Download(peer_id, requester_id, piece_id, blocks)
-                    downloads[requester_id].append(d)
-                
-            return (new_pp, downloads)
+                        finished.add((requester_id, piece_id))
+                        replicas.add(piece_id)
+                        stale_info.add(requester_id)
+                    download_rows.append((peer_id, requester_id, piece_id,
+                                          blocks))
+                offsets.append(len(download_rows))
+
+            columns = zip(*download_rows) or [()] * 4
+            return (new_pp, DownloadBatch.from_columns(
+                self.peer_ids, columns, offsets, self.position))
 
         def completed_pieces(peer_id, available):
             return len(available[peer_id])
         
         def log_peer_info(peer_pieces, available):
-            for p_id in self.peer_ids:
-                pieces = peer_pieces[p_id]
-                logging.debug("pieces for %s: %s" % (str(p_id), str(pieces)))
-            log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
-                            for p_id in self.peer_ids)
-            logging.info("Pieces completed: " + log)
-
-
-        logging.debug("Starting simulation with config: %s" % str(conf))
-
-        peers, peer_pieces = create_peers()
-        self.peer_ids = [p.id for p in peers]
-        self.peers_by_id = dict((p.id, p) for p in peers)
+            if log_debug:
+                for p_id in self.peer_ids:
+                    pieces = peer_pieces[p_id]
+                    logging.debug("pieces for %s: %s", p_id, pieces)
+            if log_info:
+                log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
+                                for p_id in self.peer_ids)
+                logging.info("Pieces completed: %s", log)
+
+
+        # Everything below that's only logged at debug or info level gets
+        # built only if it will actually be printed.
+        log_debug = logging.root.isEnabledFor(logging.DEBUG)
+        log_info = logging.root.isEnabledFor(logging.INFO)
+
+        logging.debug("Starting simulation with config: %s", conf)
+
+        if conf.agent_workers > 0:
+            (specs, peer_pieces) = self.peer_specs()
+            peers = None  # the agents live in the AgentPool's workers
+            self.peer_ids = [id for (class_name, id, ps, bw) in specs]
+        else:
+            peers, peer_pieces = self.create_peers()
+            self.peer_ids = [p.id for p in peers]
+        completion = CompletionTracker(peer_pieces, conf.blocks_per_piece)
         
-        upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
-        history = History(self.peer_ids, upload_rates)
+        # The stats show the bandwidths at the start
+        upload_rates = self.bandwidths.rates()
+        self.upload_limits = upload_rates
+        (piece_set, frozen) = self.piece_set_types()
 
         # dict : pid -> set(finished / available pieces)
-        available = dict((pid, set(available_pieces(pid, peer_pieces)))
+        available = dict((pid, piece_set(available_pieces(pid, peer_pieces)))
                          for pid in self.peer_ids)
+        # How many peers have each piece, which agents see through their
+        # history
+        replicas = ReplicaCounts(conf.num_pieces, available.values())
+
+        spill_dir = conf.history_dir
+        keep_spills = (self.checkpoints is not None and
+                       conf.history_tail is not None)
+        if keep_spills:
+            # Checkpoints refer to the spill files rather than copy them
+            spill_dir = self.checkpoints.spill_dir()
+        history = History(self.peer_ids, upload_rates,
+                          spill_dir=spill_dir,
+                          tail_rounds=conf.history_tail,
+                          piece_counts=replicas.view(),
+                          keep_spills=keep_spills)
+        seed_base = None
+        if conf.seed is not None:
+            seed_base = self.rng.getrandbits(32)
+        self.position = dict((pid, i) for (i, pid) in enumerate(self.peer_ids))
+        self.topology = self.make_topology()
+
+        pool = None
+        if peers is None:
+            # Imported here so the serial sim doesn't need multiprocessing's
+            # shared memory
+            from agentpool import AgentPool
+            pool = AgentPool(conf, specs, upload_rates,
+                             lambda pieces: frozen(piece_set(pieces)),
+                             self.peer_rng, seed_base, conf.agent_workers,
+                             timer)
+            peers = pool.peers
+        self.peers_by_id = dict((p.id, p) for p in peers)
+
+        # The PeerInfos agents see, shared by all of them.  Only peers whose
+        # available pieces changed get a new one at the start of a round.
+        peer_info_by_id = dict()
+        stale_info = set(self.peer_ids)
+
+        def run_state():
+            """Everything the rest of the run depends on, for a checkpoint"""
+            return dict(round=round, peers=peers, peer_pieces=peer_pieces,
+                        available=available, completion=completion,
+                        replicas=replicas, history=history,
+                        peer_info_by_id=peer_info_by_id,
+                        stale_info=stale_info, seed_base=seed_base,
+                        upload_rates=upload_rates, rng=self.rng,
+                        run_seed=self.run_seed,
+                        bandwidths=self.bandwidths,
+                        upload_limits=self.upload_limits,
+                        topology=self.topology)
+
+        checkpoints = self.checkpoints
+        if checkpoints is not None:
+            # Carry on from a checkpoint, if there is one to resume
+            state = checkpoints.take_run()
+            if state is not None:
+                round = state["round"]
+                peers = state["peers"]
+                peer_pieces = state["peer_pieces"]
+                available = state["available"]
+                completion = state["completion"]
+                replicas = state["replicas"]
+                history = state["history"]
+                peer_info_by_id = state["peer_info_by_id"]
+                stale_info = state["stale_info"]
+                seed_base = state["seed_base"]
+                upload_rates = state["upload_rates"]
+                self.rng = state["rng"]
+                self.run_seed = state["run_seed"]
+                self.bandwidths = state["bandwidths"]
+                self.upload_limits = state["upload_limits"]
+                self.topology = state["topology"]
+                self.peers_by_id = dict((p.id, p) for p in peers)
+                logging.info("Resuming at round %d", round)
+            checkpoints.start_run(round)
+
+        try:
+            # Begin the event loop
+            while True:
+                if checkpoints is not None and checkpoints.due(round):
+                    with timer.phase("checkpoint"):
+                        checkpoints.save_run(round, run_state())
+                logging.info("======= Round %d ========", round)
+
+                for pid in stale_info:
+                    if pool is not None:
+                        pool.publish(pid, available[pid])
+                    else:
+                        peer_info_by_id[pid] = PeerInfo(pid,
+                                                        frozen(available[pid]))
+                stale_info.clear()
+                validating = self.validate_round(round)
+                if self.topology is not None and self.topology.refresh(round):
+                    if pool is not None:
+                        pool.set_neighbors(self.topology.neighbors)
+                up_bws = self.set_bandwidths(round,
+                                             peers if pool is None else None)
+
+                requests = dict()  # peer_id -> list of Requests
+                uploads = dict()   # peer_id -> list of Uploads
+                if pool is not None:
+                    with timer.phase("requests"):
+                        all_requests = pool.requests(round, up_bws)
+                        for (p, rs) in zip(peers, all_requests):
+                            if validating:
+                                with timer.phase("request_validation"):
+                                    self.check_requests(p, rs, peer_pieces,
+                                                        available)
+                            requests[p.id] = rs
+
+                    with timer.phase("uploads"):
+                        requests_to = index_requests(self.peer_ids, requests)
+                        for (p, us) in zip(peers, pool.uploads(requests_to)):
+                            if validating:
+                                with timer.phase("upload_validation"):
+                                    self.check_uploads(p, us)
+                            uploads[p.id] = us
+                else:
+                    peer_info = tuple(peer_info_by_id[p.id] for p in peers)
+                    h = dict()
+                    with timer.phase("requests"):
+                        for (i, p) in enumerate(peers):
+                            h[p.id] = history.peer_history(
+                                p.id, self.neighborhood_counts(peer_info, i))
+                        for (batch_method, ks) in group_calls(peers,
+                                                              "requests"):
+                            agents = [peers[i] for i in ks]
+                            if batch_method is None:
+                                rss = [get_peer_requests(
+                                    agents[0],
+                                    self.peers_view(peer_info, ks[0]),
+                                    h[agents[0].id], peer_pieces, available)]
+                            else:
+                                rss = get_batch_requests(
+                                    batch_method, agents, ks, peer_info,
+                                    [h[p.id] for p in agents], peer_pieces,
+                                    available)
+                            for (p, rs) in zip(agents, rss):
+                                requests[p.id] = rs
+
+                    with timer.phase("uploads"):
+                        requests_to = index_requests(self.peer_ids, requests)
+                        for (batch_method, ks) in group_calls(peers,
+                                                              "uploads"):
+                            agents = [peers[i] for i in ks]
+                            if batch_method is None:
+                                uss = [get_peer_uploads(
+                                    requests_to[agents[0].id], agents[0],
+                                    self.peers_view(peer_info, ks[0]),
+                                    h[agents[0].id])]
+                            else:
+                                uss = get_batch_uploads(
+                                    batch_method, agents, ks, peer_info,
+                                    [h[p.id] for p in agents],
+                                    [requests_to[p.id] for p in agents])
+                            for (p, us) in zip(agents, uss):
+                                uploads[p.id] = us
+
+                with timer.phase("update_peer_pieces"):
+                    requests = RequestBatch.from_lists(self.peer_ids, requests,
+                                                       self.position)
+                    uploads = UploadBatch.from_lists(self.peer_ids, uploads,
+                                                     self.position)
+                    (peer_pieces, downloads) = update_peer_pieces(
+                        peer_pieces, requests, uploads, available)
+                with timer.phase("history"):
+                    if pool is not None:
+                        pool.update(downloads, uploads)
+                    history.update(downloads, uploads)
+
+                with timer.phase("logging"):
+                    if log_debug:
+                        logging.debug(history.pretty_for_round(round))
+
+                    log_peer_info(peer_pieces, available)
+                timer.end_round(round)
+
+                if all_done():
+                    logging.info("All done!")                    
+                    break
+                round += 1
+                if round > conf.max_round:
+                    logging.info("Out of time.  Stopping.")
+                    break
+        finally:
+            if pool is not None:
+                pool.close()
+        self.log_results(history)
+        return history
 
-        # Begin the event loop
-        while True:
-            logging.info("======= Round %d ========" % round)
-
-            peer_info = [PeerInfo(p.id, available[p.id])
-                         for p in peers]
-            requests = dict()  # peer_id -> list of Requests
-            uploads = dict()   # peer_id -> list of Uploads
-            h = dict()
-            for p in peers:
-                h[p.id] = history.peer_history(p.id)
-                requests[p.id] = get_peer_requests(p, peer_info, h[p.id], peer_pieces,
-                                                   available)
-
-            for p in peers:
-                uploads[p.id] = get_peer_uploads(requests, p, peer_info, h[p.id])
-                
-
-            (peer_pieces, downloads) = update_peer_pieces(
-                peer_pieces, requests, uploads, available)
-            history.update(downloads, uploads)
-
-            logging.debug(history.pretty_for_round(round))
-
-            log_peer_info(peer_pieces, available)
-           
-            if all_done(peer_pieces):
-                logging.info("All done!")                    
-                break
-            round += 1
-            if round > conf.max_round:
-                logging.info("Out of time.  Stopping.")
-                break
-
-        logging.info("Game history:\n%s" % history.pretty())
+    def log_results(self, history):
+        """Log the game history and stats at the end of a run"""
+        if not logging.root.isEnabledFor(logging.INFO):
+            return
+        # A line at a time, so a long history is never held in one string.
+        # Every line ends in a newline, which the handler adds back.
+        logging.info("Game history:")
+        for line in history.iter_pretty():
+            logging.info(line[:-1])
+        logging.info("")
 
         logging.info("======== STATS ========")
-        logging.info("Uploaded blocks:\n%s" %
+        logging.info("Uploaded blocks:\n%s",
                      Stats.uploaded_blocks_str(self.peer_ids, history))
-        logging.info("Completion rounds:\n%s" %
+        logging.info("Completion rounds:\n%s",
                      Stats.completion_rounds_str(self.peer_ids, history))
-        logging.info("All done round: %s" %
+        logging.info("All done round: %s",
                      Stats.all_done_round(self.peer_ids, history))
 
-        return history
+    def run_iteration(self, seed=None):
+        """
+        Run one simulation, seeding the random module and the run's
+        random streams first if seed is given.  Returns (uploaded blocks,
+        completion rounds), each a dict keyed by peer id.
+
+        With --cache-dir, a seeded iteration that has run before with the
+        same settings and code is looked up instead of run.
+        """
+        key = None
+        if self.cache is not None and seed is not None:
+            key = self.cache.key(self.config, seed)
+            entry = self.cache.get(key)
+            if entry is not None:
+                logging.info("Iteration with seed %d: cached", seed)
+                self.peer_ids = peer_ids_for(self.config.agent_class_names)
+                return entry["stats"]
+        self.seed = seed
+        if seed is not None:
+            random.seed(seed)
+        history = self.run_sim_once()
+        stats = (Stats.uploaded_blocks(self.peer_ids, history),
+                 Stats.completion_rounds(self.peer_ids, history))
+        if key is not None:
+            lines = None
+            if self.config.cache_history:
+                lines = history.iter_pretty()
+            self.cache.put(key, stats, lines)
+        return stats
 
     def run_sim(self):
-        histories = map(lambda i: self.run_sim_once(), 
-                        range(self.config.iters))
+        c = self.config
+        seed = c.seed
+        if c.workers > 1 and c.agent_workers > 0:
+            # Pool workers can't start processes of their own
+            raise ValueError("Use either --workers or --agent-workers")
+        if c.resume and c.checkpoint is None:
+            raise ValueError("--resume needs --checkpoint")
+        if c.checkpoint is not None and (c.engine != "round" or
+                                         c.workers > 1 or c.agent_workers > 0):
+            raise ValueError("--checkpoint only works with --engine round, "
+                             "and without --workers or --agent-workers")
+        if seed is None and c.cache_dir is not None:
+            logging.warning("--cache-dir only caches runs with --seed")
+        if seed is None and c.workers > 1:
+            # Iterations still need distinct seeds, or the workers would all
+            # run the same game.
+            seed = random.getrandbits(32)
+        if seed is None:
+            seeds = [None] * c.iters
+        else:
+            seeds = [iteration_seed(seed, i) for i in range(c.iters)]
+
+        if c.workers > 1:
+            pool = multiprocessing.Pool(c.workers)
+            try:
+                results = pool.map(run_iteration, [(c, s) for s in seeds])
+            finally:
+                pool.close()
+                pool.join()
+            self.peer_ids = peer_ids_for(c.agent_class_names)
+        elif self.checkpoints is not None:
+            results = []
+            if c.resume:
+                results = self.checkpoints.resume()
+            else:
+                # Left by a run that didn't finish
+                self.checkpoints.clear_spills()
+            for s in seeds[len(results):]:
+                results.append(self.run_iteration(s))
+                self.checkpoints.iteration_done(results)
+            self.peer_ids = peer_ids_for(c.agent_class_names)
+            self.checkpoints.finish()
+        else:
+            results = map(self.run_iteration, seeds)
         logging.warning("======== SUMMARY STATS ========")
-        
-        uploaded_blocks = map(
-            lambda h: Stats.uploaded_blocks(self.peer_ids, h),
-            histories)
-        completion_rounds = map(
-            lambda h: Stats.completion_rounds(self.peer_ids, h),
-            histories)
+
+        uploaded_blocks = [ups for (ups, rounds) in results]
+        completion_rounds = [rounds for (ups, rounds) in results]
 
         def extract_by_peer_id(lst, peer_id):
             """Given a list of dicts, pull out the entry
@@ -429,19 +917,34 @@ def parse_agents(args):
             
         
 
-def main(args):
+def make_parser():
     usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
     parser = OptionParser(usage=usage_msg)
 
-    def usage(msg):
-        print "Error: %s\n" % msg
-        parser.print_help()
-        sys.exit()
-    
     parser.add_option("--loglevel",
                       dest="loglevel", default="info",
                       help="Set the logging level: 'debug' or 'info'")
 
+    parser.add_option("--quiet",
+                      dest="quiet", default=False, action="store_true",
+                      help="Benchmark mode: only print the summary stats, "
+                      "and skip building any per-round log output "
+                      "(same as --loglevel warning)")
+
+    parser.add_option("--profile",
+                      dest="profile", default=None,
+                      choices=["phases", "cprofile", "sample"],
+                      help="Profile the run: 'phases' (wall and CPU time per "
+                      "phase of each round, and per agent class), 'cprofile' "
+                      "(deterministic, whole program) or 'sample' "
+                      "(statistical, low overhead).  Off by default")
+
+    parser.add_option("--profile-out",
+                      dest="profile_out", default=None,
+                      help="Where to write the profile: the per-round CSV "
+                      "table for 'phases', pstats data for 'cprofile', "
+                      "collapsed stacks for 'sample'")
+
     parser.add_option("--num-pieces",
                       dest="num_pieces", default=3, type="int",
                       help="Set number of pieces in the file")
@@ -462,10 +965,210 @@ def main(args):
                       dest="max_up_bw", default=10, type="int",
                       help="Max upload bandwidth")
 
+    parser.add_option("--bw-dist",
+                      dest="bw_dist", default="uniform",
+                      choices=sorted(DISTRIBUTIONS),
+                      help="How non-seed upload bandwidths are drawn: %s" %
+                      ", ".join(sorted(DISTRIBUTIONS)))
+
+    parser.add_option("--bw-trace",
+                      dest="bw_trace", default=None,
+                      help="Take each round's upload bandwidths from this "
+                      "trace file (see bandwidth.py)")
+
     parser.add_option("--iters",
                       dest="iters", default=1, type="int",
                       help="Number of times to run simulation to get stats")
 
+    parser.add_option("--engine",
+                      dest="engine", default="round",
+                      choices=["round", "event"],
+                      help="'round': everyone moves once per round.  'event': "
+                      "discrete-event engine with blocks arriving in "
+                      "continuous time (see eventsim.py)")
+
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to spread iterations over")
+
+    parser.add_option("--agent-workers",
+                      dest="agent_workers", default=0, type="int",
+                      help="Number of processes to run the agents' requests() "
+                      "and uploads() in, within each round (round engine "
+                      "only; 0: in the sim's own process)")
+
+    parser.add_option("--seed",
+                      dest="seed", default=None, type="int",
+                      help="Master random seed.  Each iteration gets its own "
+                      "seed derived from it, and each peer its own random "
+                      "stream (peer.rng) derived from that, so results "
+                      "don't depend on --workers or --agent-workers")
+
+    parser.add_option("--trust-agents",
+                      dest="trust_agents", default=False, action="store_true",
+                      help="Only check agents' requests and uploads in the "
+                      "first --validate-first rounds and every "
+                      "--validate-every rounds after that")
+
+    parser.add_option("--validate-first",
+                      dest="validate_first", default=1, type="int",
+                      help="With --trust-agents, number of rounds to check "
+                      "at the start")
+
+    parser.add_option("--validate-every",
+                      dest="validate_every", default=0, type="int",
+                      help="With --trust-agents, check every Kth round "
+                      "(0: never after the first rounds)")
+
+    parser.add_option("--history-tail",
+                      dest="history_tail", default=None, type="int",
+                      help="Keep only this many recent rounds of history in "
+                      "memory, and spill older rounds to disk")
+
+    parser.add_option("--history-dir",
+                      dest="history_dir", default=None,
+                      help="With --history-tail, directory for the spill "
+                      "files (default: the system temp dir; with "
+                      "--checkpoint, PATH.spill)")
+
+    parser.add_option("--cache-dir",
+                      dest="cache_dir", default=None,
+                      help="Keep the results of seeded iterations in this "
+                      "directory, and reuse them instead of rerunning")
+
+    parser.add_option("--cache-max-mb",
+                      dest="cache_max_mb", default=512, type="int",
+                      help="With --cache-dir, size limit of the cache; the "
+                      "least recently used results go first")
+
+    parser.add_option("--cache-history",
+                      dest="cache_history", default=False,
+                      action="store_true",
+                      help="With --cache-dir, also keep each iteration's "
+                      "compressed history")
+
+    parser.add_option("--checkpoint",
+                      dest="checkpoint", default=None,
+                      help="Save the state of the run to this file now and "
+                      "then, so it can be picked up with --resume")
+
+    parser.add_option("--checkpoint-every",
+                      dest="checkpoint_every", default=100, type="int",
+                      help="With --checkpoint, save every K rounds "
+                      "(0: only on --checkpoint-secs)")
+
+    parser.add_option("--checkpoint-secs",
+                      dest="checkpoint_secs", default=0, type="float",
+                      help="With --checkpoint, also save when this many "
+                      "seconds have passed since the last save (0: never)")
+
+    parser.add_option("--resume",
+                      dest="resume", default=False, action="store_true",
+                      help="Carry on from the --checkpoint file instead of "
+                      "starting over")
+
+    parser.add_option("--neighbors",
+                      dest="neighbors", default=0, type="int",
+                      help="Limit each peer to at most this many neighbors, "
+                      "which are all it sees and trades with (0: everyone)")
+
+    parser.add_option("--topology",
+                      dest="topology", default="random",
+                      choices=sorted(POLICIES),
+                      help="With --neighbors, how neighbors are picked: "
+                      "%s" % ", ".join(sorted(POLICIES)))
+
+    parser.add_option("--refresh-every",
+                      dest="refresh_every", default=0, type="int",
+                      help="With --neighbors, pick new neighbors every K "
+                      "rounds (0: keep the first ones)")
+
+    parser.add_option("--piece-sets",
+                      dest="piece_sets", default="set",
+                      choices=["set", "bitset"],
+                      help="Type of PeerInfo.available_pieces: 'set' "
+                      "(frozenset) or 'bitset' (bitset.FrozenPieceSet)")
+
+    parser.add_option("--piece-state",
+                      dest="piece_state", default="dict",
+                      choices=["dict", "matrix"],
+                      help="How the sim stores blocks per piece: 'dict' "
+                      "(a list per peer, copied every round) or 'matrix' "
+                      "(one peers x pieces array, updated in place)")
+
+    return parser
+
+
+def make_config(options, agents_to_run):
+    """Build the sim's Params from parsed options and a list of agent class
+    names.  Loads the agent modules."""
+    config = Params()
+
+    config.add("agent_class_names", agents_to_run)
+    config.add("agent_classes", load_modules(config.agent_class_names))
+
+    
+    config.add("num_pieces", options.num_pieces)
+    config.add("blocks_per_piece",options.blocks_per_piece)
+    config.add("max_round", options.max_round)
+    config.add("min_up_bw", options.min_up_bw)
+    config.add("max_up_bw", options.max_up_bw)
+    if options.bw_dist == "pareto" and options.min_up_bw <= 0:
+        # Every draw is a multiple of --min-bw
+        raise ValueError("--bw-dist pareto needs --min-bw above 0")
+    config.add("bw_dist", options.bw_dist)
+    config.add("bw_trace", options.bw_trace)
+    config.add("iters", options.iters)
+    config.add("engine", options.engine)
+    config.add("workers", options.workers)
+    config.add("agent_workers", options.agent_workers)
+    config.add("seed", options.seed)
+    config.add("piece_state", options.piece_state)
+    config.add("piece_sets", options.piece_sets)
+    if options.neighbors == 1:
+        # Neighbor sets are symmetric: a peer can't have just one without
+        # isolating someone
+        raise ValueError("--neighbors needs to be at least 2")
+    config.add("neighbors", options.neighbors)
+    config.add("topology", options.topology)
+    config.add("refresh_every", options.refresh_every)
+    config.add("history_tail", options.history_tail)
+    config.add("history_dir", options.history_dir)
+    config.add("cache_dir", options.cache_dir)
+    config.add("cache_max_mb", options.cache_max_mb)
+    config.add("cache_history", options.cache_history)
+    config.add("checkpoint", options.checkpoint)
+    config.add("checkpoint_every", options.checkpoint_every)
+    config.add("checkpoint_secs", options.checkpoint_secs)
+    config.add("resume", options.resume)
+    config.add("trust_agents", options.trust_agents)
+    config.add("validate_first", options.validate_first)
+    config.add("validate_every", options.validate_every)
+    return config
+
+
+def config_for(agents_to_run, **settings):
+    """
+    Params for running agents_to_run, for use from Python rather than the
+    command line.  settings are option names as in make_config
+    (num_pieces=..., max_round=...); anything not given gets its
+    command-line default.
+    """
+    (options, args) = make_parser().parse_args([])
+    for (name, value) in settings.items():
+        if not hasattr(options, name):
+            raise ValueError("Unknown setting: %s" % name)
+        setattr(options, name, value)
+    return make_config(options, agents_to_run)
+
+
+def main(args):
+    parser = make_parser()
+
+    def usage(msg):
+        print "Error: %s\n" % msg
+        parser.print_help()
+        sys.exit()
 
     (options, args) = parser.parse_args()
 
@@ -481,26 +1184,44 @@ def main(args):
         except ValueError, e:
             usage(e)
     
+    if options.quiet:
+        options.loglevel = "warning"
     configure_logging(options.loglevel)
-    config = Params()
-
-    config.add("agent_class_names", agents_to_run)
-    config.add("agent_classes", load_modules(config.agent_class_names))
-
-    
-    config.add("num_pieces", options.num_pieces)
-    config.add("blocks_per_piece",options.blocks_per_piece)
-    config.add("max_round", options.max_round)
-    config.add("min_up_bw", options.min_up_bw)
-    config.add("max_up_bw", options.max_up_bw)
-    config.add("iters", options.iters)
-    
-    sim = Sim(config)
-    sim.run_sim()
+    config = make_config(options, agents_to_run)
+
+    sim = make_sim(config)
+    run_profiled(sim, options.profile, options.profile_out)
+
+
+def run_profiled(sim, mode, out_path):
+    """Run sim.run_sim(), under the profiler named by mode (None for no
+    profiling), writing the profile to out_path if given."""
+    if mode is None:
+        sim.run_sim()
+    elif mode == "phases":
+        if sim.config.workers > 1:
+            logging.warning("--profile phases only sees this process, "
+                            "not the --workers pool")
+        sim.timer = PhaseTimer()
+        sim.run_sim()
+        logging.warning("======== PROFILE ========\n%s", sim.timer.summary())
+        if out_path:
+            with open(out_path, "w") as f:
+                sim.timer.write_rounds(f)
+    elif mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(sim.run_sim)
+        profiler.dump_stats(out_path or "sim.prof")
+    elif mode == "sample":
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            sim.run_sim()
+        finally:
+            profiler.stop()
+        with open(out_path or "sim.stacks", "w") as f:
+            profiler.write(f)
 
 if __name__ == "__main__":
-
-    # The next two lines are for profiling...
-    import cProfile
-    cProfile.run('main(sys.argv)', 'out.prof')
-#    main(sys.argv)
+    main(sys.argv)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""
+A long-lived sim server, for scripts that run lots of small simulations.
+It keeps the agent modules loaded and a pool of worker processes warm, so
+a job doesn't pay for starting Python and importing everything again.
+
+  ./simserver.py --socket /tmp/sim.sock --workers 4 --preload Dummy,Seed
+  ./simserver.py --port 7136
+
+Jobs are JSON objects, one per line, sent over a Unix socket or a TCP
+connection to localhost:
+
+  {"agents": ["SKT_T1Std,8", "Seed,2"],
+   "settings": {"num_pieces": 32, "max_round": 200},
+   "iters": 3, "seed": 0}
+
+Settings are sim.py options, named as in sim.make_config, and anything
+not given gets its default.  "iters" defaults to 1, and without "seed"
+the iterations aren't seeded.  Each job gets one JSON line back:
+
+  {"peers": [...], "uploaded": [...], "completion": [...], "wall": 0.12}
+
+with "uploaded" and "completion" holding one dict : peer id -> value per
+iteration, as from Sim.run_iteration(), or {"error": "..."} if the job
+failed.  A connection can send as many jobs as it likes, one after the
+other.  From Python, submit() sends one; from the shell,
+
+  ./simserver.py --socket /tmp/sim.sock --submit jobs.jsonl
+
+sends each line of a file ("-" for stdin) and prints the replies.
+
+When an agent's file changes, the workers reload its module before the
+next job that uses it.  Only agent modules get reloaded; restart the
+server after changing the sim itself.
+"""
+
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import time
+from optparse import OptionParser
+
+from sim import (config_for, configure_logging, iteration_seed, make_sim,
+                 parse_agents, peer_ids_for)
+
+# module name -> mtime of its source when this process loaded it
+loaded_at = dict()
+
+
+def source_mtime(module):
+    return os.stat(inspect.getsourcefile(module)).st_mtime
+
+
+def fresh_agents(class_names):
+    """Make sure the modules of class_names are loaded, reloading any
+    whose source changed since this process loaded it."""
+    for module_name in set(name.lower() for name in class_names):
+        module = sys.modules.get(module_name)
+        if module is None:
+            module = __import__(module_name)
+            loaded_at[module_name] = source_mtime(module)
+            continue
+        mtime = source_mtime(module)
+        if loaded_at.get(module_name) != mtime:
+            logging.info("Reloading %s", module_name)
+            reload(module)
+            loaded_at[module_name] = mtime
+
+
+def run_job(job):
+    """Pool worker: run one job, and return its reply"""
+    reply = dict()
+    start = time.time()
+    try:
+        class_names = parse_agents(job["agents"])
+        fresh_agents(class_names)
+        config = config_for(class_names, seed=job.get("seed"),
+                            **job.get("settings", {}))
+        uploaded = []
+        completion = []
+        for i in range(job.get("iters", 1)):
+            seed = None
+            if config.seed is not None:
+                seed = iteration_seed(config.seed, i)
+            sim = make_sim(config)
+            (ups, rounds) = sim.run_iteration(seed)
+            uploaded.append(ups)
+            completion.append(rounds)
+        reply["peers"] = peer_ids_for(class_names)
+        reply["uploaded"] = uploaded
+        reply["completion"] = completion
+    except Exception, e:
+        reply["error"] = "%s: %s" % (e.__class__.__name__, e)
+    reply["wall"] = time.time() - start
+    return reply
+
+
+def init_worker():
+    # Ctrl-C goes to the whole process group; leave it to the server to
+    # shut the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Agents like to print in post_init()
+    sys.stdout = open(os.devnull, "w")
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+class JobHandler(SocketServer.StreamRequestHandler):
+    """Runs each job line a client sends, and writes back its reply"""
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict) or "agents" not in job:
+                    raise ValueError("a job needs a list of agents")
+            except ValueError, e:
+                reply = dict(error="Bad job: %s" % e)
+            else:
+                reply = self.server.pool.apply(run_job, (job,))
+                logging.info("%s: %.2fs%s", " ".join(job["agents"]),
+                             reply["wall"],
+                             " (failed)" if "error" in reply else "")
+            self.wfile.write(json.dumps(reply, sort_keys=True) + "\n")
+            self.wfile.flush()
+
+
+class UnixJobServer(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPJobServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def connect(socket_path, port):
+    """A connection to the server on socket_path, or on localhost:port"""
+    if socket_path is not None:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+        return conn
+    return socket.create_connection(("127.0.0.1", port))
+
+
+def submit(job, socket_path=None, port=None):
+    """Send job (a dict) to the server listening on socket_path, or on
+    localhost:port, and return its reply"""
+    conn = connect(socket_path, port)
+    try:
+        f = conn.makefile("r+")
+        f.write(json.dumps(job) + "\n")
+        f.flush()
+        return json.loads(f.readline())
+    finally:
+        conn.close()
+
+
+def submit_all(path, socket_path, port):
+    """Send every job line in the file at path, printing the replies"""
+    conn = connect(socket_path, port)
+    failed = 0
+    jobs = sys.stdin if path == "-" else open(path)
+    try:
+        f = conn.makefile("r+")
+        for line in jobs:
+            if not line.strip():
+                continue
+            f.write(line.rstrip("\n") + "\n")
+            f.flush()
+            reply = f.readline()
+            if "error" in json.loads(reply):
+                failed += 1
+            sys.stdout.write(reply)
+            sys.stdout.flush()
+    finally:
+        conn.close()
+    return 1 if failed else 0
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog (--socket PATH | --port N) "
+                          "[options]")
+    parser.add_option("--socket", dest="socket", default=None,
+                      help="Listen on (or with --submit, connect to) this "
+                      "Unix socket")
+    parser.add_option("--port", dest="port", default=None, type="int",
+                      help="Listen on (or connect to) this TCP port on "
+                      "localhost")
+    parser.add_option("--workers", dest="workers",
+                      default=multiprocessing.cpu_count(), type="int",
+                      help="Number of processes to run jobs in")
+    parser.add_option("--preload", dest="preload", default="",
+                      help="Agent classes to load before starting, "
+                      "separated by commas")
+    parser.add_option("--submit", dest="submit", default=None,
+                      help="Send the jobs in this file (one per line, '-' "
+                      "for stdin) to a running server, and print the "
+                      "replies")
+    parser.add_option("--loglevel", dest="loglevel", default="info",
+                      help="Set the logging level (debug, info, warning)")
+    (options, args) = parser.parse_args(args[1:])
+    if (options.socket is None) == (options.port is None):
+        parser.error("Need exactly one of --socket and --port")
+
+    if options.submit is not None:
+        return submit_all(options.submit, options.socket, options.port)
+
+    configure_logging(options.loglevel)
+    # Loaded before the workers start, so they all begin with them
+    fresh_agents([name for name in options.preload.split(",") if name])
+    pool = multiprocessing.Pool(options.workers, init_worker)
+    if options.socket is not None:
+        if os.path.exists(options.socket):
+            os.remove(options.socket)  # left over from an earlier server
+        server = UnixJobServer(options.socket, JobHandler)
+        where = options.socket
+    else:
+        server = TCPJobServer(("127.0.0.1", options.port), JobHandler)
+        where = "localhost:%d" % server.server_address[1]
+    server.pool = pool
+    logging.info("Serving on %s with %d workers", where, options.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if options.socket is not None and os.path.exists(options.socket):
+            os.remove(options.socket)
+        pool.terminate()
+        pool.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -38,19 +38,19 @@ class SKT_T1PropShare(Peer):
                 need_list.append(i)
         need_set = set(need_list)
 
-        logging.debug("%s here: still need pieces %s" % (self.id, need_list))
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.debug("id: %s, available pieces: %s" % (p.id, p.available_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, need_list)
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            for p in peers:
+                logging.debug("id: %s, available pieces: %s", p.id, p.available_pieces)
         logging.debug("And look, I have my entire history available too:")
-        logging.debug(str(history))
+        logging.debug("%s", history)
 
         requests = []
 
         # Store number of peers with our needed pieces in dictionary
         for needed in need_list:
-            peers_with_piece = filter(lambda peer: needed in peer.available_pieces, peers)
-            self.piece_availabilities[needed] = len(peers_with_piece)
+            self.piece_availabilities[needed] = history.piece_counts[needed]
 
         # Request pieces from all peers, up to self.max_requests from each
         # Use rarest-first strategy for requesting pieces from peers
@@ -73,7 +73,7 @@ class SKT_T1PropShare(Peer):
                 r = Request(self.id, peer.id, piece_id, start_block)
                 requests.append(r)
 
-        logging.debug("Requests from {}: {}".format(self.id, requests))
+        logging.debug("Requests from %s: %s", self.id, requests)
         return requests
 
     def uploads(self, requests, peers, history):
@@ -89,8 +89,7 @@ to any given peer.
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
 
         # Don't upload if you don't receive requests
         if not requests:
@@ -101,7 +100,7 @@ to any given peer.
         # If first round, give unchoke spot to random agent. If later round, give proportionally to agents who gave us highest bandwidth
         if round == 0:
             # Randomly pick 4 users requesting pieces from us, and give each of them equal bandwidth
-            chosen_peer_ids = random.sample(requesters_ids, 4)
+            chosen_peer_ids = self.rng.sample(requesters_ids, 4)
             peers_to_unchoke = chosen_peer_ids
             bws = even_split(self.up_bw, len(peers_to_unchoke))
         else:
@@ -118,16 +117,16 @@ to any given peer.
                 if len(requesters_ids) < 3:
                     peers_to_unchoke = list(requesters_ids)
                 else:
-                    peers_to_unchoke = random.sample(requesters_ids, 3)
+                    peers_to_unchoke = self.rng.sample(requesters_ids, 3)
                 bws = even_split(int(self.up_bw * (1 - self.optimistic_proportion)), 3)
             else:
                 bws = [int(down_bw[peer] / bw_sum_unchoke * (1 - self.optimistic_proportion)) for peer in peers_to_unchoke]
 
         # Optimistic unchoking every 3 rounds: randomly choose an agent who isn't already in peers_to_unchoke
         if round % 3 == 0 and len(requesters_ids) > len(peers_to_unchoke):
-            self.optimistic_unchoked_peer = random.choice(list(requesters_ids))
+            self.optimistic_unchoked_peer = self.rng.choice(list(requesters_ids))
             while self.optimistic_unchoked_peer in peers_to_unchoke:
-                self.optimistic_unchoked_peer = random.choice(list(requesters_ids))
+                self.optimistic_unchoked_peer = self.rng.choice(list(requesters_ids))
 
         # If we have spots left, add the peer from optimistic unchoking
         if len(peers_to_unchoke) < 4:
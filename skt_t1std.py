@@ -36,24 +36,57 @@ class SKT_T1Std(Peer):
                 need_list.append(i)
         need_set = set(need_list)
 
-        logging.debug("%s here: still need pieces %s" % (self.id, need_list))
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.debug("id: %s, available pieces: %s" % (p.id, p.available_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, need_list)
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            for p in peers:
+                logging.debug("id: %s, available pieces: %s", p.id, p.available_pieces)
         logging.debug("And look, I have my entire history available too:")
-        logging.debug(str(history))
-
-        requests = []
+        logging.debug("%s", history)
 
         # Store number of peers with our needed pieces in dictionary
         for needed in need_list:
-            peers_with_piece = filter(lambda peer: needed in peer.available_pieces, peers)
-            self.piece_availabilities[needed] = len(peers_with_piece)
+            self.piece_availabilities[needed] = history.piece_counts[needed]
+
+        return self.rarest_first_requests(peers, need_set)
+
+    @classmethod
+    def requests_batch(cls, batch):
+        """
+        Same as calling requests() for each peer in the batch, in one call
+        for the whole class.  The work requests() repeats for every agent
+        is done once: each peer's pieces get turned into a set once for the
+        whole batch, and peers with nothing an agent needs are skipped with
+        one test of their mask against the agent's (batch.need_masks()).
+        """
+        have = batch.available_sets()
+        have_masks = dict((info.id, mask) for (info, mask) in
+                          zip(batch.snapshot, batch.available_masks()))
+        ans = []
+        for (k, agent) in enumerate(batch.agents):
+            need_mask = batch.need_masks()[k]
+            need_set = set(i for i in range(len(agent.pieces))
+                           if need_mask >> i & 1)
+            counts = batch.piece_counts(k)
+            for i in need_set:
+                agent.piece_availabilities[i] = counts[i]
+            peers = [p for p in batch.peers(k) if have_masks[p.id] & need_mask]
+            ans.append(agent.rarest_first_requests(peers, need_set, have))
+        return ans
+
+    def rarest_first_requests(self, peers, need_set, have=None):
+        """Requests for the rarest of need_set, going by
+        self.piece_availabilities.  have: dict : peer id -> set of its
+        pieces, if already built."""
+        requests = []
 
         # Request pieces from all peers, up to self.max_requests from each
         # Use rarest-first strategy for requesting pieces from peers
         for peer in peers:
-            av_set = set(peer.available_pieces)
+            if have is None:
+                av_set = set(peer.available_pieces)
+            else:
+                av_set = have[peer.id]
             isect = av_set.intersection(need_set)
             n = min(self.max_requests, len(isect))
             sorted_by_rarest = sorted(isect, key=lambda piece: self.piece_availabilities[piece])
@@ -71,7 +104,7 @@ class SKT_T1Std(Peer):
                 r = Request(self.id, peer.id, piece_id, start_block)
                 requests.append(r)
 
-        logging.debug("Requests from {}: {}".format(self.id, requests))
+        logging.debug("Requests from %s: %s", self.id, requests)
         return requests
 
     def uploads(self, requests, peers, history):
@@ -87,8 +120,7 @@ to any given peer.
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
 
         # Don't upload if you don't receive requests
         if not requests:
@@ -96,6 +128,36 @@ to any given peer.
 
         # For example, history.downloads[round-1] (if round != 0, of course) has a list of Download objects for each Download to this peer in the previous round.
 
+        # Blocks each peer gave us in the past 2 periods
+        down_bw = defaultdict(int)
+        for downloads in reversed(history.downloads[-2:]):
+            for download in downloads:
+                down_bw[download.from_id] += download.blocks
+        return self.unchoke(requests, round, down_bw)
+
+    @classmethod
+    def uploads_batch(cls, batch):
+        """
+        Same as calling uploads() for each peer in the batch.  Each agent's
+        blocks from the past 2 periods come from batch.recent_downloads();
+        who gets unchoked depends on each agent's own requests, so the rest
+        is done agent by agent, as in uploads().
+        """
+        if not batch.agents:
+            return []
+        round = batch.histories[0].current_round()
+        recent = batch.recent_downloads(2)
+        ans = []
+        for (k, agent) in enumerate(batch.agents):
+            if batch.requests[k]:
+                ans.append(agent.unchoke(batch.requests[k], round, recent[k]))
+            else:
+                ans.append([])
+        return ans
+
+    def unchoke(self, requests, round, down_bw):
+        """Uploads for this round's requests, given dict : peer id ->
+        blocks it gave us in the past 2 periods"""
         requesters_ids = set(map(lambda request: request.requester_id, requests))
 
         # If first round, give unchoke spot to random agent. If later round, give to agent who gave us highest bandwidth
@@ -104,29 +166,18 @@ to any given peer.
             if len(requesters_ids) < 4:
                 peers_to_unchoke = list(requesters_ids)
             else:
-                peers_to_unchoke = random.sample(requesters_ids, 4)
+                peers_to_unchoke = self.rng.sample(requesters_ids, 4)
         else:
             # Pick the top 3 requesters who gave us the highest upload bandwidth in the past 2 periods
-            downloads = history.downloads[-1]
-            down_bw = defaultdict(int)
-            for download in downloads:
-                if download.from_id in requesters_ids:
-                    down_bw[download.from_id] += download.blocks
-            if round == 1:
-                top_downloads = sorted(requesters_ids, key=lambda x: down_bw[x])
-            else:
-                downloads2 = history.downloads[-2]
-                for download2 in downloads2:
-                    if download2.from_id in requesters_ids:
-                        down_bw[download2.from_id] += download2.blocks
-                top_downloads = sorted(requesters_ids, key=lambda x: down_bw[x])
+            top_downloads = sorted(requesters_ids,
+                                   key=lambda x: down_bw.get(x, 0))
             peers_to_unchoke = top_downloads[-3:]
 
         # Optimistic unchoking every 3 rounds: randomly choose an agent who isn't already in peers_to_unchoke
         if round % 3 == 0 and len(requesters_ids) > len(peers_to_unchoke):
-            self.optimistic_unchoked_peer = random.choice(list(requesters_ids))
+            self.optimistic_unchoked_peer = self.rng.choice(list(requesters_ids))
             while self.optimistic_unchoked_peer in peers_to_unchoke:
-                self.optimistic_unchoked_peer = random.choice(list(requesters_ids))
+                self.optimistic_unchoked_peer = self.rng.choice(list(requesters_ids))
 
         # If we have spots left, add the peer from optimistic unchoking
         if len(peers_to_unchoke) < 4:
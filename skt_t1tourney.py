@@ -40,19 +40,19 @@ class SKT_T1Tourney(Peer):
                 need_list.append(i)
         self.need_set = set(need_list)
 
-        logging.debug("%s here: still need pieces %s" % (self.id, need_list))
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.debug("id: %s, available pieces: %s" % (p.id, p.available_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, need_list)
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            for p in peers:
+                logging.debug("id: %s, available pieces: %s", p.id, p.available_pieces)
         logging.debug("And look, I have my entire history available too:")
-        logging.debug(str(history))
+        logging.debug("%s", history)
 
         requests = []
 
         # Store number of peers with our needed pieces in dictionary
         for needed in need_list:
-            peers_with_piece = filter(lambda peer: needed in peer.available_pieces, peers)
-            self.piece_availabilities[needed] = len(peers_with_piece)
+            self.piece_availabilities[needed] = history.piece_counts[needed]
 
         # Request pieces from all peers, up to self.max_requests from each
         # Use rarest-first strategy for requesting pieces from peers
@@ -79,7 +79,7 @@ class SKT_T1Tourney(Peer):
                 r = Request(self.id, peer.id, piece_id, start_block)
                 requests.append(r)
 
-        logging.debug("Requests from {}: {}".format(self.id, requests))
+        logging.debug("Requests from %s: %s", self.id, requests)
         self.peer_by_rarest_pieces = peer_by_rarest_pieces_temp
         self.peer_by_rarest_pieces = sorted(self.peer_by_rarest_pieces, key=lambda peer: self.peer_by_rarest_pieces[peer])
         return requests
@@ -97,8 +97,7 @@ to any given peer.
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
 
         # Don't upload if you don't receive requests
         if not requests:
@@ -124,7 +123,7 @@ to any given peer.
             if len(requesters_ids) < 4:
                 peers_to_unchoke = list(requesters_ids)
             else:
-                peers_to_unchoke = random.sample(requesters_ids, 4)
+                peers_to_unchoke = self.rng.sample(requesters_ids, 4)
         else:
             downloads = history.downloads[-1]
             down_bw = defaultdict(int)
@@ -38,6 +38,15 @@ class SKT_T1Tyrant(Peer):
         self.peer_pieces_by_round = dict()
 
 
+    def meet(self, peers):
+        """Start keeping track of any peers we haven't seen yet: everyone in
+        round 0, and new neighbors if the sim limits who we see."""
+        for peer in peers:
+            if peer.id not in self.min_upload_needed:
+                self.min_upload_needed[peer.id] = self.default_min_upload_needed
+                self.possible_download_rates[peer.id] = self.default_possible_download_rates
+                self.peer_pieces_by_round[peer.id] = []
+
     def requests(self, peers, history):
         """
         peers: available info about the peers (who has what pieces)
@@ -47,11 +56,7 @@ class SKT_T1Tyrant(Peer):
 
         This will be called after update_pieces() with the most recent state.
         """
-        if history.current_round() == 0:
-            for peer in peers:
-                self.min_upload_needed[peer.id] = self.default_min_upload_needed
-                self.possible_download_rates[peer.id] = self.default_possible_download_rates
-                self.peer_pieces_by_round[peer.id] = []
+        self.meet(peers)
 
         need_list = []
         for i in range(len(self.pieces)):
@@ -59,19 +64,19 @@ class SKT_T1Tyrant(Peer):
                 need_list.append(i)
         need_set = set(need_list)
 
-        logging.debug("%s here: still need pieces %s" % (self.id, need_list))
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.debug("id: %s, available pieces: %s" % (p.id, p.available_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, need_list)
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            for p in peers:
+                logging.debug("id: %s, available pieces: %s", p.id, p.available_pieces)
         logging.debug("And look, I have my entire history available too:")
-        logging.debug(str(history))
+        logging.debug("%s", history)
 
         requests = []
 
         # Store number of peers with our needed pieces in dictionary
         for needed in need_list:
-            peers_with_piece = filter(lambda peer: needed in peer.available_pieces, peers)
-            self.piece_availabilities[needed] = len(peers_with_piece)
+            self.piece_availabilities[needed] = history.piece_counts[needed]
 
         # Request pieces from all peers, up to self.max_requests from each
         # Use rarest-first strategy for requesting pieces from peers
@@ -95,7 +100,7 @@ class SKT_T1Tyrant(Peer):
                 r = Request(self.id, peer.id, piece_id, start_block)
                 requests.append(r)
 
-        logging.debug("Requests from {}: {}".format(self.id, requests))
+        logging.debug("Requests from %s: %s", self.id, requests)
         return requests
 
     def uploads(self, requests, peers, history):
@@ -111,13 +116,14 @@ to any given peer.
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
 
         # Don't upload if you don't receive requests
         if not requests:
             return []
 
         requesters_ids = set(map(lambda request: request.requester_id, requests))
+        self.meet(peers)
 
         # If first round, give unchoke spot to random agent. If later round, give to agent who gave us highest bandwidth
         if round == 0:
@@ -125,7 +131,7 @@ to any given peer.
             if len(requesters_ids) < 4:
                 peers_to_unchoke = list(requesters_ids)
             else:
-                peers_to_unchoke = random.sample(requesters_ids, 4)
+                peers_to_unchoke = self.rng.sample(requesters_ids, 4)
 
             bws = even_split(self.up_bw, len(peers_to_unchoke))
         else:
@@ -153,9 +159,9 @@ to any given peer.
                     # Estimate download rate peer j would give us given they did not unchoke us last round
                     # Assume total rate of download that j provides to others = total rate of download achieved by j
                     #   = difference in j's pieces from last round to current round
-                    peer_available_pieces_last_round = self.peer_pieces_by_round[peer.id][-1]
-                    peer_available_pieces_prev_round = 0 if len(self.peer_pieces_by_round[peer.id]) == 1 \
-                                                         else self.peer_pieces_by_round[peer.id][-2]
+                    seen = self.peer_pieces_by_round[peer.id]
+                    peer_available_pieces_last_round = seen[-1] if seen else 0
+                    peer_available_pieces_prev_round = 0 if len(seen) <= 1 else seen[-2]
                     diff_pieces = peer_available_pieces_last_round - peer_available_pieces_prev_round
                     self.possible_download_rates[peer.id] = diff_pieces * self.conf.blocks_per_piece / 4
                 else:
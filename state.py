@@ -0,0 +1,223 @@
+#!/usr/bin/python
+
+"""
+Containers for the simulation's own per-peer state.  Agents never see these
+directly -- the sim hands them copies or read-only views.
+"""
+
+from array import array
+
+
+class PieceRow:
+    """
+    A view of one peer's row in a PieceMatrix.  Supports the bits of the list
+    interface the sim uses: indexing, assignment, len() and iteration.
+    """
+    __slots__ = ('matrix', 'offset')
+
+    def __init__(self, matrix, offset):
+        self.matrix = matrix
+        self.offset = offset
+
+    def __len__(self):
+        return self.matrix.num_pieces
+
+    def __getitem__(self, piece_id):
+        return self.matrix.blocks[self.offset + piece_id]
+
+    def __setitem__(self, piece_id, value):
+        self.matrix.set(self.offset + piece_id, value)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        return self.matrix.blocks[self.offset:self.offset + len(self)].tolist()
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+class PieceMatrix:
+    """
+    Blocks downloaded so far, for every peer and every piece, kept in one
+    contiguous peers x pieces array.  Rows are updated in place, so there's
+    no need to copy the whole thing every round.
+
+    Indexing by peer id gives a PieceRow, so
+        matrix[peer_id][piece_id]
+    reads (and writes) just like the dict-of-lists it replaces.
+    """
+    def __init__(self, peer_ids, num_pieces, init_pieces):
+        """
+        peer_ids: list of peer ids, in row order
+        init_pieces: function peer_id -> list of blocks per piece
+        """
+        self.peer_ids = peer_ids[:]
+        self.num_pieces = num_pieces
+        self.rows = dict((pid, i * num_pieces) for (i, pid) in
+                         enumerate(self.peer_ids))
+        # Blocks are whole numbers unless an agent hands out fractional
+        # bandwidth; start out as machine ints and only widen if needed.
+        self.blocks = array('l')
+        for pid in self.peer_ids:
+            self.set_row(pid, init_pieces(pid))
+
+    def set_row(self, peer_id, pieces):
+        offset = self.rows[peer_id]
+        end = offset + self.num_pieces
+        if len(self.blocks) < end:
+            self.blocks.extend([0] * (end - len(self.blocks)))
+        for i, b in enumerate(pieces):
+            self.set(offset + i, b)
+
+    def set(self, index, value):
+        try:
+            self.blocks[index] = value
+        except TypeError:
+            self.widen()
+            self.blocks[index] = value
+
+    def widen(self):
+        """Switch to storing doubles, for fractional blocks"""
+        if self.blocks.typecode != 'd':
+            self.blocks = array('d', self.blocks)
+
+    def __getitem__(self, peer_id):
+        return PieceRow(self, self.rows[peer_id])
+
+    def __iter__(self):
+        return iter(self.peer_ids)
+
+    def __len__(self):
+        return len(self.peer_ids)
+
+    def __contains__(self, peer_id):
+        return peer_id in self.rows
+
+    def __repr__(self):
+        return "PieceMatrix(%s)" % ", ".join(
+            "%s: %s" % (pid, self[pid]) for pid in self.peer_ids)
+
+
+class CompletionTracker:
+    """
+    Keeps count of the pieces each peer hasn't finished yet, and the set of
+    peers that are done.  The sim feeds it every change to a peer's blocks,
+    so checking for completion doesn't need a pass over everyone's pieces.
+    """
+    def __init__(self, peer_pieces, blocks_per_piece):
+        self.blocks_per_piece = blocks_per_piece
+        self.pieces_left = dict()  # peer_id -> number of unfinished pieces
+        self.done = set()
+        self.newly_done = []
+        for peer_id in peer_pieces:
+            self.pieces_left[peer_id] = len(
+                [b for b in peer_pieces[peer_id] if b < blocks_per_piece])
+            if self.pieces_left[peer_id] == 0:
+                self.mark_done(peer_id)
+
+    def update(self, peer_id, old_blocks, new_blocks):
+        """Record that one of peer_id's pieces went from old_blocks to
+        new_blocks."""
+        if old_blocks < self.blocks_per_piece <= new_blocks:
+            self.pieces_left[peer_id] -= 1
+            if self.pieces_left[peer_id] == 0:
+                self.mark_done(peer_id)
+
+    def mark_done(self, peer_id):
+        self.done.add(peer_id)
+        self.newly_done.append(peer_id)
+
+    def pop_newly_done(self):
+        """Return the peers that finished since the last call."""
+        ans = self.newly_done
+        self.newly_done = []
+        return ans
+
+    def is_done(self, peer_id):
+        return peer_id in self.done
+
+    def all_done(self):
+        return len(self.done) == len(self.pieces_left)
+
+
+class ReplicaCounts:
+    """
+    How many peers have each piece, kept up to date as pieces complete
+    instead of being recounted from everyone's available pieces.
+    """
+    def __init__(self, num_pieces, available):
+        """available: iterable of each peer's set of available pieces"""
+        self.counts = array('l', [0]) * num_pieces
+        for pieces in available:
+            for piece_id in pieces:
+                self.counts[piece_id] += 1
+
+    def add(self, piece_id):
+        """One more peer has piece_id"""
+        self.counts[piece_id] += 1
+
+    def remove(self, piece_id):
+        self.counts[piece_id] -= 1
+
+    def view(self):
+        return CountsView(self.counts)
+
+
+class CountsView(object):
+    """Read-only view of ReplicaCounts, for agents: view[piece_id] is the
+    number of peers, this one included, that have piece_id."""
+    __slots__ = ('_counts',)
+
+    def __init__(self, counts):
+        self._counts = counts
+
+    def __getitem__(self, piece_id):
+        return self._counts[piece_id]
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __iter__(self):
+        return iter(self._counts)
+
+    def __repr__(self):
+        return "CountsView(%s)" % list(self._counts)
+
+
+class NeighborhoodCounts(object):
+    """
+    Read-only counts like a CountsView, but over one peer's neighborhood
+    (see topology.py): view[piece_id] is the number of peers at positions
+    that have piece_id, going by the PeerInfos in snapshot.  Counted the
+    first time they're read.
+    """
+    __slots__ = ('_snapshot', '_positions', '_num_pieces', '_counts')
+
+    def __init__(self, snapshot, positions, num_pieces):
+        self._snapshot = snapshot
+        self._positions = positions
+        self._num_pieces = num_pieces
+        self._counts = None
+
+    def _count(self):
+        if self._counts is None:
+            counts = [0] * self._num_pieces
+            for i in self._positions:
+                for piece_id in self._snapshot[i].available_pieces:
+                    counts[piece_id] += 1
+            self._counts = counts
+        return self._counts
+
+    def __getitem__(self, piece_id):
+        return self._count()[piece_id]
+
+    def __len__(self):
+        return self._num_pieces
+
+    def __iter__(self):
+        return iter(self._count())
+
+    def __repr__(self):
+        return "NeighborhoodCounts(%s)" % self._count()
@@ -9,14 +9,10 @@ class Stats:
 
         Returns:
         dict: peer_id -> total upload blocks used
+
+        Reads the running totals History keeps, so doesn't scan the history.
         """
-        uploaded = dict((peer_id, 0) for peer_id in peer_ids)
-        for peer_id in peer_ids:
-            for ds in history.downloads[peer_id]:
-                for download in ds:
-                    uploaded[download.from_id] += download.blocks
-                
-        return uploaded
+        return dict((peer_id, history.uploaded[peer_id]) for peer_id in peer_ids)
 
     @staticmethod
     def uploaded_blocks_str(peer_ids, history):
@@ -38,6 +34,11 @@ class Stats:
         
         return d
 
+    @staticmethod
+    def downloaded_blocks(peer_ids, history):
+        """Returns dict: peer_id -> total blocks downloaded"""
+        return dict((peer_id, history.downloaded[peer_id]) for peer_id in peer_ids)
+
     @staticmethod
     def completion_rounds_str(peer_ids, history):
         """ Return a pretty stringified version of completion_rounds """
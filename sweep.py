@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""
+Parameter sweeps: runs the sim for every cell of a grid of settings and
+agent mixes, across a pool of processes, and appends one JSON line per
+finished cell to a results table.
+
+The grid is a JSON file like
+
+  {
+    "agents": {
+      "std":    ["SKT_T1Std,8", "Seed,2"],
+      "tyrant": ["SKT_T1Tyrant,8", "Seed,2"]
+    },
+    "settings": {
+      "num_pieces": [32, 128],
+      "blocks_per_piece": [16],
+      "max_round": [200]
+    },
+    "iters": 5,
+    "seed": 0
+  }
+
+Settings are sim.py options, named as in sim.make_config; each gets a
+list of values, and anything not mentioned keeps its default.  Every cell
+runs "iters" iterations with the same master seed, so cells differ only
+in their settings.
+
+  ./sweep.py grid.json --out results.jsonl --workers 8
+
+Each row of the results table has the cell's key ("cell"), the mix's name
+("mix") and agent list ("agents"), its "settings", "iters" and "seed", and
+the wall time it took.  Then either "uploaded" and "completion" -- per
+iteration, the average per agent class of blocks uploaded and of the
+round each peer finished in -- or "error", if the cell failed.
+
+Cells already in the results table are skipped, so an interrupted sweep
+picks up where it left off when run again.  Cells that failed are retried.
+A cell is keyed by its mix's name and agents, its settings, "iters" and
+"seed", so after editing any of those the cells it changes run again.
+"""
+
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from optparse import OptionParser
+
+from sim import (config_for, iteration_seed, make_parser, make_sim,
+                 parse_agents, peer_ids_for)
+from util import mean
+
+
+def cell_key(mix, agents, settings, iters, seed):
+    """The key that identifies a cell in the results table: everything its
+    results depend on, so editing the grid makes the cells it touches run
+    again"""
+    return json.dumps(dict(mix=mix, agents=agents, settings=settings,
+                           iters=iters, seed=seed), sort_keys=True)
+
+
+def grid_cells(spec):
+    """The cells of a grid spec, in a fixed order, as dicts"""
+    defaults = make_parser().parse_args([])[0]
+    names = sorted(spec.get("settings", {}))
+    for name in names:
+        if not hasattr(defaults, name):
+            raise ValueError("Unknown setting: %s" % name)
+    values = [spec["settings"][name] for name in names]
+    iters = spec.get("iters", 1)
+    seed = spec.get("seed", 0)
+    cells = []
+    for mix in sorted(spec["agents"]):
+        agents = spec["agents"][mix]
+        for combo in itertools.product(*values):
+            settings = dict(zip(names, combo))
+            cells.append(dict(key=cell_key(mix, agents, settings, iters,
+                                           seed),
+                              mix=mix,
+                              agents=agents,
+                              settings=settings,
+                              iters=iters,
+                              seed=seed))
+    return cells
+
+
+def finished_keys(path):
+    """Keys of the cells in the results table at path that finished.  A
+    torn last line, from an interrupted write, doesn't count."""
+    keys = set()
+    if not os.path.exists(path):
+        return keys
+    with open(path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if "error" not in row:
+                keys.add(row["cell"])
+    return keys
+
+
+def open_table(path):
+    """Open the results table for appending, starting a fresh line if the
+    last write got cut off."""
+    out = open(path, "a+")
+    out.seek(0, os.SEEK_END)
+    if out.tell() > 0:
+        out.seek(-1, os.SEEK_END)
+        if out.read(1) != "\n":
+            out.seek(0, os.SEEK_END)
+            out.write("\n")
+    return out
+
+
+def by_class(class_names, peer_ids, values):
+    """Average per agent class of a dict : peer id -> value.  None if any
+    value is None (a peer that never finished)."""
+    groups = dict()
+    for (name, pid) in zip(class_names, peer_ids):
+        groups.setdefault(name, []).append(values[pid])
+    return dict((name, None if None in vs else mean(vs))
+                for (name, vs) in groups.items())
+
+
+def run_cell(cell):
+    """Pool worker: run one cell's iterations, and return its results row"""
+    row = dict(cell=cell["key"], mix=cell["mix"], agents=cell["agents"],
+               settings=cell["settings"], iters=cell["iters"],
+               seed=cell["seed"])
+    start = time.time()
+    try:
+        class_names = parse_agents(cell["agents"])
+        peer_ids = peer_ids_for(class_names)
+        config = config_for(class_names, seed=cell["seed"],
+                            **cell["settings"])
+        uploaded = []
+        completion = []
+        for i in range(cell["iters"]):
+            sim = make_sim(config)
+            (ups, rounds) = sim.run_iteration(iteration_seed(cell["seed"], i))
+            uploaded.append(by_class(class_names, peer_ids, ups))
+            completion.append(by_class(class_names, peer_ids, rounds))
+        row["uploaded"] = uploaded
+        row["completion"] = completion
+    except Exception, e:
+        row["error"] = "%s: %s" % (e.__class__.__name__, e)
+    row["wall"] = time.time() - start
+    return row
+
+
+def init_worker():
+    # Agents like to print in post_init()
+    sys.stdout = open(os.devnull, "w")
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options] GRID.json")
+    parser.add_option("--out", dest="out", default="sweep.jsonl",
+                      help="Results table to append to (JSON lines)")
+    parser.add_option("--workers", dest="workers",
+                      default=multiprocessing.cpu_count(), type="int",
+                      help="Number of processes to run cells in")
+    parser.add_option("--list", dest="list", default=False,
+                      action="store_true",
+                      help="List the cells that still need running, and exit")
+    (options, args) = parser.parse_args(args[1:])
+    if len(args) != 1:
+        parser.error("Need exactly one grid spec")
+
+    with open(args[0]) as f:
+        spec = json.load(f)
+    cells = grid_cells(spec)
+    done = finished_keys(options.out)
+    todo = [c for c in cells if c["key"] not in done]
+    if options.list:
+        for c in todo:
+            print c["key"]
+        return 0
+    print "%d cells, %d done, %d to run" % (len(cells), len(cells) - len(todo),
+                                           len(todo))
+    sys.stdout.flush()
+
+    failed = 0
+    pool = multiprocessing.Pool(options.workers, init_worker)
+    try:
+        with open_table(options.out) as out:
+            for row in pool.imap_unordered(run_cell, todo):
+                out.write(json.dumps(row, sort_keys=True) + "\n")
+                out.flush()
+                if "error" in row:
+                    failed += 1
+                    print "FAILED %s: %s" % (row["cell"], row["error"])
+                else:
+                    print "%-60s %8.2fs" % (row["cell"], row["wall"])
+                sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,23 @@
+"""
+An agent for the tests that breaks the rules: on top of what a Dummy asks
+for, it asks every peer for every piece it needs, whether they have it or
+not, and asks a peer that doesn't exist.
+"""
+
+from dummy import Dummy
+from messages import Request
+
+
+class Cheater(Dummy):
+    def requests(self, peers, history):
+        requests = Dummy.requests(self, peers, history)
+        needed = [i for (i, blocks) in enumerate(self.pieces)
+                  if blocks < self.conf.blocks_per_piece]
+        for peer in peers:
+            for piece_id in needed:
+                requests.append(Request(self.id, peer.id, piece_id,
+                                        self.pieces[piece_id]))
+        if needed:
+            requests.append(Request(self.id, "Nobody0", needed[0],
+                                    self.pieces[needed[0]]))
+        return requests
@@ -0,0 +1,22 @@
+"""
+An agent for the tests that plays like a Dummy, and writes down the piece
+counts the sim gave it next to the counts from its own view of the swarm.
+"""
+
+from dummy import Dummy
+
+
+class Counter(Dummy):
+    # (piece counts from the history, counts from the peers), every call
+    seen = []
+
+    def requests(self, peers, history):
+        counts = [0] * self.conf.num_pieces
+        for p in list(peers):
+            for piece_id in p.available_pieces:
+                counts[piece_id] += 1
+        for (piece_id, blocks) in enumerate(self.pieces):
+            if blocks == self.conf.blocks_per_piece:
+                counts[piece_id] += 1
+        Counter.seen.append((list(history.piece_counts), counts))
+        return Dummy.requests(self, peers, history)
@@ -0,0 +1,46 @@
+"""
+Seeded runs for the tests that check a run plays out the same game however
+the sim stores its state or spreads its work: run() returns everything a
+run logs, so two runs can be compared line for line.
+"""
+
+import logging
+import os
+import StringIO
+import sys
+
+from sim import config_for, make_sim, parse_agents
+
+AGENTS = parse_agents(["Dummy,2", "SKT_T1Std,2", "SKT_T1Tyrant,2",
+                       "SKT_T1PropShare,2", "SKT_T1Tourney,2", "Seed,1"])
+
+SETTINGS = dict(num_pieces=12, blocks_per_piece=4, max_round=60, seed=7,
+                iters=2)
+
+
+def quiet(f, *args, **kw):
+    """f(*args, **kw), with what agents print in post_init() thrown away"""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return f(*args, **kw)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run(level=logging.INFO, agents=AGENTS, **settings):
+    """The log of a run with SETTINGS, overridden by settings, at level"""
+    kw = dict(SETTINGS)
+    kw.update(settings)
+    out = StringIO.StringIO()
+    root = logging.getLogger()
+    (handlers, old_level) = (root.handlers, root.level)
+    root.handlers = [logging.StreamHandler(out)]
+    root.setLevel(level)
+    try:
+        quiet(make_sim(config_for(agents, **kw)).run_sim)
+    finally:
+        root.handlers = handlers
+        root.setLevel(old_level)
+    return out.getvalue()
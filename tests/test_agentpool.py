@@ -0,0 +1,34 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from profiling import PhaseTimer
+from runs import quiet, run
+from sim import config_for, make_sim
+
+
+class AgentPoolTest(unittest.TestCase):
+    def test_same_game_as_serial(self):
+        base = run()
+        self.assertEqual(run(agent_workers=2), base)
+        self.assertEqual(run(agent_workers=3, piece_state="matrix"), base)
+
+    def test_agent_timings(self):
+        timings = []
+        for agent_workers in [0, 2]:
+            config = config_for(["Dummy", "Dummy", "SKT_T1Std", "Seed"],
+                                num_pieces=4, blocks_per_piece=2,
+                                max_round=5, agent_workers=agent_workers)
+            sim = make_sim(config)
+            sim.timer = PhaseTimer()
+            random.seed(1)
+            quiet(sim.run_sim_once)
+            timings.append(dict((key, calls) for (key, (calls, wall, cpu))
+                                in sim.timer.agent_totals.items()))
+        self.assertTrue(timings[0][("Dummy", "requests")] > 0)
+        self.assertEqual(timings[1], timings[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+import cPickle
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+
+from bandwidth import (DISTRIBUTIONS, HEADER, Bandwidths, Trace, TraceError,
+                       write_trace)
+from util import Params
+
+
+def config(bw_trace=None, bw_dist="uniform"):
+    c = Params()
+    c.add("bw_trace", bw_trace)
+    c.add("bw_dist", bw_dist)
+    c.add("min_up_bw", 4)
+    c.add("max_up_bw", 10)
+    return c
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "trace.bwt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        write_trace(self.path, [[1, 2, 3], [4, 5, 6]])
+        t = Trace(self.path)
+        self.assertEqual((t.num_peers, t.num_rounds), (3, 2))
+        self.assertEqual(t.row(0), [1, 2, 3])
+        self.assertEqual(t.row(1), [4, 5, 6])
+        self.assertEqual(t.value(1, 2), 6)
+        t.close()
+
+    def test_starts_over(self):
+        write_trace(self.path, [[1], [2], [3]])
+        t = Trace(self.path)
+        self.assertEqual([t.row(r)[0] for r in range(7)],
+                         [1, 2, 3, 1, 2, 3, 1])
+        self.assertEqual(t.value(4, 0), 2)
+
+    def test_write_rejects(self):
+        self.assertRaises(ValueError, write_trace, self.path, [])
+        self.assertRaises(ValueError, write_trace, self.path, [[1, 2], [3]])
+        self.assertRaises(ValueError, write_trace, self.path, [[1, -1]])
+
+    def write_raw(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def test_negative_read(self):
+        self.write_raw(HEADER.pack("BWTRACE1", 2, 2) +
+                       struct.pack("<4i", 1, 2, 3, -4))
+        t = Trace(self.path)
+        self.assertEqual(t.row(0), [1, 2])
+        self.assertEqual(t.value(1, 0), 3)
+        self.assertRaises(TraceError, t.row, 1)
+        self.assertRaises(TraceError, t.value, 1, 1)
+        self.assertRaises(TraceError, t.row, 3)
+
+    def test_bad_files(self):
+        self.assertRaises(TraceError, Trace, self.path)  # missing
+        self.write_raw("BWTR")
+        self.assertRaises(TraceError, Trace, self.path)
+        self.write_raw(HEADER.pack("NOTTRACE", 1, 1) + struct.pack("<i", 1))
+        self.assertRaises(TraceError, Trace, self.path)
+        self.write_raw(HEADER.pack("BWTRACE1", 2, 2) + struct.pack("<3i", 1,
+                                                                   2, 3))
+        self.assertRaises(TraceError, Trace, self.path)
+        self.write_raw(HEADER.pack("BWTRACE1", 2, 0))
+        self.assertRaises(TraceError, Trace, self.path)
+
+    def test_pickle(self):
+        write_trace(self.path, [[7, 8], [9, 10]])
+        t = cPickle.loads(cPickle.dumps(Trace(self.path)))
+        self.assertEqual(t.path, self.path)
+        self.assertEqual(t.row(1), [9, 10])
+
+
+class BandwidthsTest(unittest.TestCase):
+    def test_distributions(self):
+        peer_ids = ["Seed0"] + ["Peer%d" % i for i in range(30)]
+        for name in DISTRIBUTIONS:
+            b = Bandwidths(config(bw_dist=name), peer_ids, random.Random(4))
+            self.assertEqual(b.of("Seed0"), 10)
+            self.assertTrue(all(4 <= bw <= 10 for bw in b.capacity))
+            self.assertFalse(b.at_round(5))
+
+    def test_trace(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "trace.bwt")
+            write_trace(path, [[1, 2, 9], [1, 2, 9], [3, 4, 9]])
+            b = Bandwidths(config(path), ["Seed0", "Peer0"], None)
+            self.assertEqual(b.rates(), dict(Seed0=1, Peer0=2))
+            self.assertFalse(b.at_round(1))
+            self.assertTrue(b.at_round(2))
+            self.assertEqual(b.of("Peer0"), 4)
+            self.assertTrue(b.at_round(3))
+            self.assertEqual(b.capacity, [1, 2])
+            self.assertRaises(TraceError, Bandwidths, config(path),
+                              ["A", "B", "C", "D"], None)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+
+import unittest
+
+from runs import run
+from skt_t1std import SKT_T1Std
+from sim import parse_agents
+
+AGENTS = parse_agents(["SKT_T1Std,6", "Dummy,2", "Seed,1"])
+
+
+class BatchTest(unittest.TestCase):
+    """SKT_T1Std's batch methods against its per-peer ones"""
+    def per_peer(self, **settings):
+        """The log of a run where SKT_T1Std has no batch methods"""
+        names = ["requests_batch", "uploads_batch"]
+        saved = [SKT_T1Std.__dict__[name] for name in names]
+        # group_calls() treats a None batch method as none at all
+        for name in names:
+            setattr(SKT_T1Std, name, None)
+        try:
+            return run(agents=AGENTS, **settings)
+        finally:
+            for (name, method) in zip(names, saved):
+                setattr(SKT_T1Std, name, method)
+
+    def test_same_game(self):
+        self.assertEqual(run(agents=AGENTS), self.per_peer())
+
+    def test_same_game_bitsets(self):
+        self.assertEqual(run(agents=AGENTS, piece_sets="bitset"),
+                         self.per_peer(piece_sets="bitset"))
+
+    def test_same_game_neighbors(self):
+        self.assertEqual(run(agents=AGENTS, neighbors=3),
+                         self.per_peer(neighbors=3))
+
+    def test_same_game_agent_workers(self):
+        self.assertEqual(run(agents=AGENTS, agent_workers=2),
+                         self.per_peer())
+
+
+if __name__ == "__main__":
+    unittest.main()
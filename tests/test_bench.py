@@ -0,0 +1,35 @@
+#!/usr/bin/python
+
+import unittest
+
+from bench import compare
+
+
+def ok(wall, rss=1000):
+    return dict(wall_per_round=wall, peak_rss_kb=rss)
+
+
+class CompareTest(unittest.TestCase):
+    def test_slower(self):
+        baseline = dict(a=ok(1.0), b=ok(1.0))
+        results = dict(a=ok(1.1), b=ok(1.5, 2000))
+        self.assertEqual(compare(results, baseline, 0.2),
+                         [("b", "wall_per_round", 1.0, 1.5),
+                          ("b", "peak_rss_kb", 1000, 2000)])
+
+    def test_errors(self):
+        baseline = dict(a=ok(1.0), b=dict(error="MemoryError: "))
+        results = dict(a=dict(error="KeyError: 'x'"),
+                       b=dict(error="MemoryError: "),
+                       c=dict(error="KeyError: 'y'"))
+        self.assertEqual(compare(results, baseline, 0.2),
+                         [("a", "error", None, "KeyError: 'x'"),
+                          ("c", "error", None, "KeyError: 'y'")])
+
+    def test_fixed(self):
+        baseline = dict(a=dict(error="MemoryError: "))
+        self.assertEqual(compare(dict(a=ok(9.0)), baseline, 0.2), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from bitset import FrozenPieceSet, PieceSet, mask_of
+from runs import run
+
+
+class PieceSetTest(unittest.TestCase):
+    def test_mask(self):
+        self.assertEqual(mask_of([0, 3, 5]), 0b101001)
+        self.assertEqual(mask_of(FrozenPieceSet([2])), 4)
+        self.assertEqual(FrozenPieceSet().mask, 0)
+
+    def test_container(self):
+        s = FrozenPieceSet([7, 0, 130, 7])
+        self.assertEqual(list(s), [0, 7, 130])
+        self.assertEqual(len(s), 3)
+        self.assertTrue(130 in s)
+        self.assertFalse(1 in s)
+        self.assertFalse(-1 in s)
+        self.assertTrue(s)
+        self.assertFalse(FrozenPieceSet())
+
+    def test_matches_frozenset(self):
+        rng = random.Random(1)
+        for i in range(50):
+            a = frozenset(rng.sample(range(100), rng.randint(0, 20)))
+            b = frozenset(rng.sample(range(100), rng.randint(0, 20)))
+            (x, y) = (FrozenPieceSet(a), FrozenPieceSet(b))
+            self.assertEqual(x & y, a & b)
+            self.assertEqual(x | y, a | b)
+            self.assertEqual(x - y, a - b)
+            self.assertEqual(a - y, a - b)
+            self.assertEqual(set(b) - x, b - a)
+            self.assertEqual(a & x, a)
+            self.assertEqual(x.intersection(b, [1, 2]),
+                             a.intersection(b, [1, 2]))
+            self.assertEqual(x.union(b), a.union(b))
+            self.assertEqual(x.difference(b), a.difference(b))
+            self.assertEqual(x.issubset(b), a.issubset(b))
+            self.assertEqual(x.isdisjoint(y), a.isdisjoint(b))
+            self.assertEqual(sorted(x), sorted(a))
+
+    def test_equality(self):
+        self.assertEqual(FrozenPieceSet([1, 2]), set([1, 2]))
+        self.assertNotEqual(FrozenPieceSet([1, 2]), frozenset([1]))
+        self.assertEqual(FrozenPieceSet([1, 2]), PieceSet([2, 1]))
+        self.assertNotEqual(FrozenPieceSet([1]), [1])
+        self.assertEqual(hash(FrozenPieceSet([4])),
+                         hash(FrozenPieceSet([4])))
+
+    def test_hash_matches_frozenset(self):
+        for pieces in [[], [0], [4], [0, 5, 200], range(64)]:
+            self.assertEqual(hash(FrozenPieceSet(pieces)),
+                             hash(frozenset(pieces)))
+        seen = dict([(frozenset([1, 2]), "x")])
+        self.assertEqual(seen[FrozenPieceSet([2, 1])], "x")
+        self.assertTrue(frozenset([3]) in set([FrozenPieceSet([3])]))
+
+    def test_mutable(self):
+        s = PieceSet()
+        s.add(3)
+        s.add(3)
+        s.add(9)
+        s.discard(9)
+        s.discard(10)
+        self.assertEqual(list(s), [3])
+        self.assertRaises(TypeError, hash, s)
+
+    def test_frozen_copy(self):
+        s = PieceSet([1])
+        f = s.frozen()
+        s.add(2)
+        self.assertEqual(list(f), [1])
+        self.assertTrue(isinstance(f, FrozenPieceSet))
+        self.assertFalse(isinstance(f, PieceSet))
+
+    def test_random_sample(self):
+        s = FrozenPieceSet(range(10))
+        picked = random.Random(2).sample(s, 3)
+        self.assertEqual(len(set(picked)), 3)
+        self.assertTrue(all(i in s for i in picked))
+
+
+class BitsetRunTest(unittest.TestCase):
+    def test_same_game_as_sets(self):
+        self.assertEqual(run(piece_sets="bitset"), run())
+
+
+if __name__ == "__main__":
+    unittest.main()
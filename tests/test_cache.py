@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+import cache
+from cache import ResultCache
+from runs import quiet
+from sim import config_for, make_sim
+
+AGENT_SOURCE = """
+from dummy import Dummy
+
+
+class Cachedagent(Dummy):
+    version = %d
+"""
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, "cache")
+
+    def tearDown(self):
+        cache.known_sizes.pop(self.root, None)
+        shutil.rmtree(self.dir)
+
+    def config(self, agents=["Dummy", "Dummy", "Seed"], **settings):
+        kw = dict(num_pieces=4, blocks_per_piece=2, max_round=20,
+                  cache_dir=self.root)
+        kw.update(settings)
+        return config_for(agents, **kw)
+
+    def test_hit(self):
+        sim = make_sim(self.config(cache_history=True))
+        stats = quiet(sim.run_iteration, 5)
+        sim = make_sim(self.config())
+
+        def no_run():
+            raise AssertionError("ran instead of using the cache")
+        sim.run_sim_once = no_run
+        self.assertEqual(sim.run_iteration(5), stats)
+        entry = sim.cache.get(sim.cache.key(sim.config, 5))
+        self.assertTrue("Round 0" in zlib.decompress(entry["history"]))
+        # Another seed isn't cached
+        self.assertRaises(AssertionError, sim.run_iteration, 6)
+
+    def test_key(self):
+        c = ResultCache(self.root)
+        key = c.key(self.config(), 1)
+        self.assertEqual(c.key(self.config(workers=4, piece_state="matrix",
+                                           piece_sets="bitset"), 1), key)
+        self.assertNotEqual(c.key(self.config(), 2), key)
+        self.assertNotEqual(c.key(self.config(max_round=21), 1), key)
+        self.assertNotEqual(c.key(self.config(engine="event"), 1), key)
+
+    def test_agent_source_changes(self):
+        path = os.path.join(self.dir, "cachedagent.py")
+        with open(path, "w") as f:
+            f.write(AGENT_SOURCE % 1)
+        sys.path.insert(0, self.dir)
+        try:
+            c = ResultCache(self.root)
+            with_it = self.config(["Cachedagent", "Seed"])
+            without = self.config(["Dummy", "Seed"])
+            keys = (c.key(with_it, 1), c.key(without, 1))
+            with open(path, "w") as f:
+                f.write(AGENT_SOURCE % 2)
+            stat = os.stat(path)
+            os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+            self.assertNotEqual(c.key(with_it, 1), keys[0])
+            self.assertEqual(c.key(without, 1), keys[1])
+        finally:
+            sys.path.remove(self.dir)
+            sys.modules.pop("cachedagent", None)
+
+    def test_evicts_least_recently_used(self):
+        c = ResultCache(self.root)
+        for (i, key) in enumerate(["aa1", "bb2", "cc3"]):
+            c.put(key, "x" * 1000)
+            # Used in key order, a second apart
+            os.utime(c.path(key), (1000 + i, 1000 + i))
+        size = c.size()
+        self.assertTrue(c.get("aa1") is not None)  # now the latest
+        c = ResultCache(self.root, max_mb=(size + 500) / (1024.0 * 1024))
+        c.put("dd4", "x" * 1000)
+        self.assertTrue(c.get("bb2") is None)
+        for key in ["aa1", "cc3", "dd4"]:
+            self.assertTrue(c.get(key) is not None)
+        self.assertTrue(c.size() <= c.max_bytes * cache.LOW_WATER)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import checkpoint
+from runs import run
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "run.ckpt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def interrupt(self, stop_at, **settings):
+        """A checkpointed run that saves stop_at - 1 times and is stopped
+        at the next save, without making it"""
+        save_run = checkpoint.Checkpoints.save_run
+        saves = []
+
+        def save_then_stop(self, round, state):
+            saves.append(round)
+            if len(saves) == stop_at:
+                raise Interrupted()
+            save_run(self, round, state)
+
+        checkpoint.Checkpoints.save_run = save_then_stop
+        try:
+            self.assertRaises(Interrupted, run, logging.WARNING,
+                              checkpoint=self.path, **settings)
+        finally:
+            checkpoint.Checkpoints.save_run = save_run
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_resume(self):
+        base = run(logging.WARNING)
+        self.interrupt(4, checkpoint_every=2)
+        self.assertEqual(run(logging.WARNING, checkpoint=self.path,
+                             checkpoint_every=2, resume=True), base)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_resume_spilled_history(self):
+        """The spill files stay next to the checkpoint, and what got spilled
+        after it was saved is dropped on resume"""
+        base = run(logging.WARNING, history_tail=5)
+        self.interrupt(4, checkpoint_every=10, history_tail=5)
+        spills = self.path + ".spill"
+        self.assertTrue(os.listdir(spills))
+        self.assertEqual(run(logging.WARNING, checkpoint=self.path,
+                             checkpoint_every=10, history_tail=5,
+                             resume=True), base)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(spills))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+
+from columns import Columns, SpillingColumns
+
+
+class ColumnsTest(unittest.TestCase):
+    def test_append_and_read(self):
+        t = Columns(["a", "b"])
+        t.append((1, 2))
+        t.append((3, 4))
+        self.assertEqual(len(t), 2)
+        self.assertEqual(t.row(1), (3, 4))
+        self.assertEqual(t.rows(0, 2), [(1, 2), (3, 4)])
+        self.assertEqual(list(t.column("b")), [2, 4])
+        self.assertEqual(list(t.iter_columns("b", "a")), [(2, 1), (4, 3)])
+
+    def test_widens_to_doubles(self):
+        t = Columns(["a", "b"])
+        t.append((1, 2))
+        t.append((1.5, 3))
+        self.assertEqual(t.column("a").typecode, "d")
+        self.assertEqual(t.column("b").typecode, "l")
+        self.assertEqual(list(t.column("a")), [1.0, 1.5])
+
+    def test_extend(self):
+        t = Columns(["a", "b"])
+        t.extend([[1, 2], [3, 4]])
+        t.extend([[5], [0.5]])
+        self.assertEqual(t.rows(0, 3), [(1, 3), (2, 4), (5, 0.5)])
+        self.assertEqual(t.column("b").typecode, "d")
+
+
+class SpillingColumnsTest(unittest.TestCase):
+    def table(self, n):
+        t = SpillingColumns(["a", "b"])
+        for i in range(n):
+            t.append((i, 10 * i))
+        return t
+
+    def test_reads_across_spill(self):
+        t = self.table(10)
+        t.spill(4)
+        t.spill(3)
+        self.assertEqual(len(t), 10)
+        self.assertEqual(t.spilled, 7)
+        self.assertEqual(t.row(2), (2, 20))
+        self.assertEqual(t.row(8), (8, 80))
+        self.assertEqual(t.rows(5, 9), [(i, 10 * i) for i in range(5, 9)])
+        self.assertEqual(t.rows(8, 10), [(8, 80), (9, 90)])
+        self.assertEqual(list(t.column("b")), [10 * i for i in range(10)])
+
+    def test_spill_nothing(self):
+        t = self.table(3)
+        t.spill(0)
+        self.assertEqual(t.spilled, 0)
+        self.assertEqual(t.rows(0, 3), [(0, 0), (1, 10), (2, 20)])
+
+    def test_widened_after_spill(self):
+        t = self.table(4)
+        t.spill(2)
+        t.append((0.5, 1))
+        t.spill(3)
+        self.assertEqual(t.rows(0, 5),
+                         [(0, 0), (1, 10), (2, 20), (3, 30), (0.5, 1)])
+
+    def test_pickle(self):
+        t = self.table(6)
+        t.spill(4)
+        u = cPickle.loads(cPickle.dumps(t, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(u.rows(0, 6), t.rows(0, 6))
+        u.append((6, 60))
+        u.spill(3)
+        self.assertEqual(u.rows(0, 7), [(i, 10 * i) for i in range(7)])
+        self.assertEqual(len(t), 6)
+
+    def test_pickle_kept_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            t = SpillingColumns(["a", "b"], directory, keep=True)
+            for i in range(6):
+                t.append((i, 10 * i))
+            t.spill(4)
+            saved = cPickle.dumps(t, cPickle.HIGHEST_PROTOCOL)
+            # The pickle names the files rather than holding their rows
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertFalse(len(saved) > 1000)
+            t.append((0.5, 1))
+            t.spill(3)
+            u = cPickle.loads(saved)
+            self.assertEqual(u.rows(0, 6), [(i, 10 * i) for i in range(6)])
+            u.append((6, 60))
+            u.spill(3)
+            self.assertEqual(u.rows(0, 7), [(i, 10 * i) for i in range(7)])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,16 @@
+#!/usr/bin/python
+
+import unittest
+
+from runs import run
+
+
+class EventSimTest(unittest.TestCase):
+    def test_same_game_for_any_state(self):
+        self.assertEqual(run(engine="event", piece_state="matrix",
+                             piece_sets="bitset"),
+                         run(engine="event"))
+
+
+if __name__ == "__main__":
+    unittest.main()
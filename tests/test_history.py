@@ -0,0 +1,39 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from runs import AGENTS, quiet
+from sim import config_for, make_sim
+
+
+class TotalsTest(unittest.TestCase):
+    def test_match_walking_the_lists(self):
+        config = config_for(AGENTS, num_pieces=8, blocks_per_piece=4,
+                            max_round=40)
+        random.seed(2)
+        history = quiet(make_sim(config).run_sim_once)
+        ids = history.peer_ids
+        for pid in ids:
+            h = history.peer_history(pid)
+            downloads = [d for r in h.downloads for d in r]
+            uploads = [d for p in ids
+                       for r in history.downloads[p] for d in r
+                       if d.from_id == pid]
+            self.assertEqual(h.total_downloaded(),
+                             sum(d.blocks for d in downloads))
+            self.assertEqual(h.total_uploaded(),
+                             sum(d.blocks for d in uploads))
+            for other in ids:
+                self.assertEqual(h.blocks_from(other),
+                                 sum(d.blocks for d in downloads
+                                     if d.from_id == other))
+                self.assertEqual(h.blocks_to(other),
+                                 sum(d.blocks for d in uploads
+                                     if d.to_id == other))
+        self.assertTrue(any(history.peer_history(pid).total_uploaded()
+                            for pid in ids))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+import cPickle
+import unittest
+
+from messages import (Download, DownloadBatch, Request, RequestBatch, Upload,
+                      UploadBatch)
+
+
+def fields(msgs):
+    """dict : peer_id -> [messages], with each message as a tuple"""
+    return dict((pid, [tuple(getattr(m, a) for a in m.__slots__) for m in ms])
+                for (pid, ms) in msgs.items())
+
+
+class MessageBatchTest(unittest.TestCase):
+    def round_trip(self, cls, peer_ids, msgs):
+        batch = cls.from_lists(peer_ids, msgs)
+        self.assertEqual(fields(batch.by_peer()), fields(msgs))
+        copy = cPickle.loads(cPickle.dumps(batch, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(fields(copy.by_peer()), fields(msgs))
+        return batch
+
+    def test_round_trip(self):
+        peer_ids = ["a", "b", "c"]
+        requests = self.round_trip(RequestBatch, peer_ids, dict(
+            a=[Request("a", "b", 3, 0), Request("a", "c", 1, 2)],
+            b=[],
+            c=[Request("c", "a", 0, 1)]))
+        self.assertEqual(requests.span(1), (2, 2))
+        self.assertEqual(requests.column("piece").typecode, "l")
+        downloads = self.round_trip(DownloadBatch, peer_ids, dict(
+            a=[], b=[Download("c", "b", 5, 4)], c=[]))
+        self.assertEqual(downloads.rows(0, 1), [(2, 1, 5, 4)])
+
+    def test_fallback(self):
+        """Fractional bandwidth and ids that aren't peers read back as they
+        went in"""
+        peer_ids = ["a", "b"]
+        uploads = self.round_trip(UploadBatch, peer_ids, dict(
+            a=[Upload("a", "b", 2.5), Upload("a", None, 0)],
+            b=[Upload("b", "x", 3)]))
+        self.assertEqual(uploads.column("bw"), [2.5, 0, 3])
+        self.assertEqual(uploads.ids, ["a", "b", None, "x"])
+        self.assertEqual(uploads.column("to").typecode, "l")
+
+    def test_append_fallback(self):
+        batch = UploadBatch(["a"])
+        batch.append((0, 0, 1))
+        batch.append((0, batch.id_index(None), 0.5))
+        batch.end_peer()
+        self.assertEqual(fields(batch.by_peer()),
+                         dict(a=[("a", "a", 1), ("a", None, 0.5)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,14 @@
+#!/usr/bin/python
+
+import unittest
+
+from runs import run
+
+
+class PieceStateTest(unittest.TestCase):
+    def test_matrix_matches_dict(self):
+        self.assertEqual(run(piece_state="matrix"), run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+
+import unittest
+
+from runs import AGENTS, quiet, run
+from sim import config_for, iteration_seed, make_sim, stream_seed
+
+
+class SeedTest(unittest.TestCase):
+    def test_same_seed_same_game(self):
+        self.assertEqual(run(), run())
+        self.assertEqual(run(engine="event"), run(engine="event"))
+
+    def test_other_seed_other_game(self):
+        self.assertNotEqual(run(seed=8), run())
+
+    def test_iteration_result(self):
+        config = config_for(AGENTS, num_pieces=8, blocks_per_piece=4,
+                            max_round=40)
+        results = [quiet(make_sim(config).run_iteration, 11)
+                   for i in range(2)]
+        self.assertEqual(results[0], results[1])
+
+    def test_streams(self):
+        self.assertEqual(iteration_seed(7, 1), iteration_seed(7, 1))
+        self.assertNotEqual(iteration_seed(7, 1), iteration_seed(7, 2))
+        self.assertNotEqual(stream_seed(3, "Seed0"), stream_seed(3, "Seed1"))
+        self.assertNotEqual(stream_seed(3, "Seed0"), stream_seed(4, "Seed0"))
+
+    def test_peer_streams_independent(self):
+        # A peer's stream only depends on the run and its own id
+        sim = make_sim(config_for(AGENTS))
+        sim.seed = 5
+        sim.start_streams()
+        draws = [sim.peer_rng("Dummy0").random() for i in range(2)]
+        sim.peer_rng("Seed0").random()
+        self.assertEqual(draws[0], draws[1])
+        self.assertEqual(sim.peer_rng("Dummy0").random(), draws[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from messages import Request, Upload, UploadBatch
+from runs import quiet
+from sim import config_for, index_requests, index_uploads, make_sim
+from util import IllegalRequest, IllegalUpload
+
+PEERS = ["Seed0", "Peer0", "Peer1"]
+
+
+class IndexTest(unittest.TestCase):
+    def test_requests_by_target(self):
+        a = Request("Peer0", "Seed0", 1, 0)
+        b = Request("Peer0", "Peer1", 2, 3)
+        c = Request("Peer1", "Seed0", 1, 2)
+        requests_to = index_requests(PEERS, dict(Peer0=[a, b], Peer1=[c],
+                                                 Seed0=[]))
+        self.assertEqual(sorted(requests_to), sorted(PEERS))
+        self.assertEqual(sorted(requests_to["Seed0"]), sorted([a, c]))
+        self.assertEqual(requests_to["Peer1"], [b])
+        self.assertEqual(requests_to["Peer0"], [])
+
+    def test_upload_rates(self):
+        uploads = UploadBatch.from_lists(PEERS, dict(
+            Seed0=[Upload("Seed0", "Peer0", 3), Upload("Seed0", "Peer1", 4),
+                   Upload("Seed0", "Peer0", 9)],
+            Peer0=[Upload("Peer0", "Peer1", 2)],
+            Peer1=[]))
+        self.assertEqual(index_uploads(uploads),
+                         dict(Peer0=dict(Seed0=3),
+                              Peer1=dict(Seed0=4, Peer0=2)))
+
+    def test_no_uploads(self):
+        empty = UploadBatch.from_lists(PEERS, dict((p, []) for p in PEERS))
+        self.assertEqual(index_uploads(empty), dict())
+
+
+class Stub(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class CheckTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = make_sim(config_for(["Seed", "Dummy", "Dummy"],
+                                       num_pieces=4, blocks_per_piece=2))
+        self.sim.peers_by_id = dict((pid, Stub(pid)) for pid in PEERS)
+        self.sim.upload_limits = dict(Seed0=5, Peer0=3, Peer1=3)
+        self.pieces = dict(Seed0=[2] * 4, Peer0=[0, 1, 2, 0],
+                           Peer1=[0] * 4)
+        self.available = dict(Seed0=set(range(4)), Peer0=set([2]),
+                              Peer1=set())
+
+    def check_requests(self, requests):
+        self.sim.check_requests(Stub("Peer0"), requests, self.pieces,
+                                self.available)
+
+    def test_good_requests(self):
+        self.check_requests([])
+        self.check_requests([Request("Peer0", "Seed0", 0, 0),
+                             Request("Peer0", "Seed0", 1, 1),
+                             Request("Peer0", "Seed0", 1, 0)])
+
+    def test_bad_requests(self):
+        for bad in ["not a request",
+                    Request("Peer0", "Seed0", 4, 0),
+                    Request("Peer0", "Seed0", -1, 0),
+                    Request("Peer0", "Nobody0", 0, 0),
+                    Request("Peer1", "Seed0", 0, 0),
+                    Request("Peer0", "Seed0", 0, 1),
+                    Request("Peer0", "Seed0", 1, 2),
+                    Request("Peer0", "Peer1", 0, 0)]:
+            self.assertRaises(IllegalRequest, self.check_requests,
+                              [Request("Peer0", "Seed0", 0, 0), bad])
+
+    def test_first_bad_request_reported(self):
+        try:
+            self.check_requests([Request("Peer0", "Nobody0", 0, 0),
+                                 Request("Peer0", "Seed0", 9, 0)])
+        except IllegalRequest, e:
+            self.assertTrue("non-existent peer" in str(e))
+        else:
+            self.fail("no IllegalRequest")
+
+    def check_uploads(self, uploads):
+        self.sim.check_uploads(Stub("Peer0"), uploads)
+
+    def test_good_uploads(self):
+        self.check_uploads([])
+        self.check_uploads([Upload("Peer0", "Peer1", 2),
+                            Upload("Peer0", "Seed0", 1)])
+
+    def test_bad_uploads(self):
+        for bad in [["not an upload"],
+                    [Upload("Peer0", "Peer0", 1)],
+                    [Upload("Peer1", "Peer0", 1)],
+                    [Upload("Peer0", "Peer1", -1)],
+                    [Upload("Peer0", "Peer1", 2), Upload("Peer0", "Seed0", 2)]]:
+            self.assertRaises(IllegalUpload, self.check_uploads, bad)
+
+
+class TrustTest(unittest.TestCase):
+    """Runs with an agent that asks for pieces its peers don't have, and
+    from a peer that doesn't exist"""
+    def history(self, **settings):
+        config = config_for(["Seed", "Cheater", "Cheater", "Dummy"],
+                            num_pieces=6, blocks_per_piece=3, max_round=40,
+                            **settings)
+        random.seed(3)
+        return quiet(make_sim(config).run_sim_once)
+
+    def test_validated(self):
+        self.assertRaises(IllegalRequest, self.history)
+        self.assertRaises(IllegalRequest, self.history, trust_agents=True)
+
+    def test_trusted(self):
+        h = self.history(trust_agents=True, validate_first=0)
+        # Nobody got a block of a piece its uploader didn't have
+        blocks = dict()  # (peer, piece) -> blocks before this round
+        for r in range(h.last_round() + 1):
+            downloads = [d for pid in h.peer_ids for d in h.downloads[pid][r]]
+            for d in downloads:
+                if not d.from_id.startswith("Seed"):
+                    self.assertEqual(blocks.get((d.from_id, d.piece)), 3)
+            for d in downloads:
+                key = (d.to_id, d.piece)
+                blocks[key] = blocks.get(key, 0) + d.blocks
+        self.assertTrue(all(blocks.get((pid, i)) == 3
+                            for pid in h.peer_ids if pid != "Seed0"
+                            for i in range(6)))
+
+    def test_trusted_event_engine(self):
+        h = self.history(trust_agents=True, validate_first=0, engine="event")
+        self.assertEqual(sorted(h.round_done), sorted(h.peer_ids))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import simserver
+from runs import quiet
+from sim import (config_for, iteration_seed, make_sim, parse_agents,
+                 peer_ids_for)
+
+JOB = dict(agents=["SKT_T1Std,3", "Seed,1"],
+           settings=dict(num_pieces=6, blocks_per_piece=2, max_round=30),
+           iters=2, seed=3)
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "sim.sock")
+        self.pool = multiprocessing.Pool(1, simserver.init_worker)
+        self.server = simserver.UnixJobServer(self.path,
+                                              simserver.JobHandler)
+        self.server.pool = self.pool
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.pool.terminate()
+        self.pool.join()
+        shutil.rmtree(self.directory)
+
+    def submit(self, job):
+        return simserver.submit(job, socket_path=self.path)
+
+    def test_job(self):
+        reply = self.submit(JOB)
+        self.assertFalse("error" in reply)
+        class_names = parse_agents(JOB["agents"])
+        config = config_for(class_names, seed=JOB["seed"], **JOB["settings"])
+        for i in range(JOB["iters"]):
+            (ups, rounds) = quiet(make_sim(config).run_iteration,
+                                  iteration_seed(config.seed, i))
+            self.assertEqual(reply["uploaded"][i], ups)
+            self.assertEqual(reply["completion"][i], rounds)
+        self.assertEqual(reply["peers"], peer_ids_for(class_names))
+
+    def test_errors(self):
+        reply = self.submit(dict(agents=["NoSuchAgent,2"]))
+        self.assertTrue(reply["error"].startswith("ImportError"))
+        self.assertTrue("wall" in reply)
+        reply = self.submit(dict(settings={}))
+        self.assertEqual(reply["error"],
+                         "Bad job: a job needs a list of agents")
+        # The server carries on after a failed job
+        self.assertFalse("error" in self.submit(JOB))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from counter import Counter
+from runs import quiet
+from sim import config_for, make_sim
+from state import CompletionTracker, ReplicaCounts
+
+
+class CompletionTrackerTest(unittest.TestCase):
+    def test_starts_from_pieces(self):
+        t = CompletionTracker(dict(a=[2, 2], b=[0, 2]), 2)
+        self.assertTrue(t.is_done("a"))
+        self.assertFalse(t.is_done("b"))
+        self.assertFalse(t.all_done())
+        self.assertEqual(t.pop_newly_done(), ["a"])
+        self.assertEqual(t.pop_newly_done(), [])
+
+    def test_updates(self):
+        t = CompletionTracker(dict(a=[0, 0], b=[2, 2]), 2)
+        t.pop_newly_done()
+        t.update("a", 0, 1)
+        t.update("a", 1, 2)
+        self.assertFalse(t.is_done("a"))
+        t.update("a", 0, 2)
+        self.assertTrue(t.is_done("a"))
+        self.assertTrue(t.all_done())
+        self.assertEqual(t.pop_newly_done(), ["a"])
+
+    def test_only_crossing_counts(self):
+        t = CompletionTracker(dict(a=[0, 0]), 3)
+        t.update("a", 3, 4)  # already finished: no change
+        t.update("a", 0, 2)
+        self.assertEqual(t.pieces_left["a"], 2)
+        t.update("a", 2, 5)
+        self.assertEqual(t.pieces_left["a"], 1)
+
+
+class ReplicaCountsTest(unittest.TestCase):
+    def test_counts(self):
+        r = ReplicaCounts(3, [set([0, 1]), set([1]), set()])
+        view = r.view()
+        self.assertEqual(list(view), [1, 2, 0])
+        r.add(2)
+        r.remove(1)
+        self.assertEqual((view[1], view[2], len(view)), (1, 1, 3))
+
+        def write():
+            view[0] = 5
+        self.assertRaises(TypeError, write)
+
+    def check_run(self, **settings):
+        """The counts agents see match their view of the swarm, every
+        round"""
+        del Counter.seen[:]
+        config = config_for(["Seed", "Counter", "Counter", "Counter",
+                             "Dummy"], num_pieces=6, blocks_per_piece=2,
+                            max_round=30, **settings)
+        random.seed(4)
+        quiet(make_sim(config).run_sim_once)
+        self.assertTrue(len(Counter.seen) > 10)
+        for (counts, expected) in Counter.seen:
+            self.assertEqual(counts, expected)
+
+    def test_round_engine(self):
+        self.check_run()
+        self.check_run(piece_state="matrix", piece_sets="bitset")
+
+    def test_event_engine(self):
+        self.check_run(engine="event")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import sweep
+from runs import quiet
+
+GRID = dict(agents=dict(dummy=["Dummy,2", "Seed,1"],
+                        broken=["NoSuchAgent,2", "Seed,1"]),
+            settings=dict(num_pieces=[4, 6], max_round=[20]),
+            iters=2, seed=3)
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.grid = os.path.join(self.dir, "grid.json")
+        self.out = os.path.join(self.dir, "out.jsonl")
+        with open(self.grid, "w") as f:
+            json.dump(GRID, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sweep(self):
+        """Run the sweep; return its exit status and the table's rows,
+        leaving out torn ones"""
+        status = quiet(sweep.main, ["sweep.py", self.grid, "--out", self.out,
+                                    "--workers", "2"])
+        rows = []
+        with open(self.out) as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    pass
+        return (status, rows)
+
+    def test_rows(self):
+        (status, rows) = self.sweep()
+        self.assertEqual(status, 1)
+        self.assertEqual(len(rows), 4)
+        done = [r for r in rows if "error" not in r]
+        self.assertEqual(sorted(r["settings"]["num_pieces"] for r in done),
+                         [4, 6])
+        for r in done:
+            self.assertEqual(r["mix"], "dummy")
+            self.assertEqual(r["agents"], ["Dummy,2", "Seed,1"])
+            self.assertEqual(len(r["uploaded"]), 2)
+            self.assertEqual(sorted(r["completion"][0]), ["Dummy", "Seed"])
+        for r in rows:
+            if "error" in r:
+                self.assertEqual(r["mix"], "broken")
+
+    def test_resume(self):
+        (status, first) = self.sweep()
+        # Only the failed cells run again
+        (status, rows) = self.sweep()
+        self.assertEqual(rows[:4], first)
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(all(r["mix"] == "broken" for r in rows[4:]))
+
+    def test_torn_line(self):
+        self.sweep()
+        with open(self.out) as f:
+            lines = f.readlines()
+        done = [line for line in lines if "error" not in json.loads(line)]
+        with open(self.out, "w") as f:
+            f.write(done[0])
+            f.write(done[1][:20])  # cut off mid-write
+        (status, rows) = self.sweep()
+        self.assertEqual(rows[0], json.loads(done[0]))
+        # The torn cell and the broken ones run again
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(sorted(r["mix"] for r in rows),
+                         ["broken", "broken", "dummy", "dummy"])
+
+    def test_cells_keyed_by_agents(self):
+        cells = sweep.grid_cells(GRID)
+        grid = dict(GRID, agents=dict(GRID["agents"],
+                                      dummy=["Dummy,3", "Seed,1"]))
+        changed = set(c["key"] for c in sweep.grid_cells(grid))
+        self.assertEqual(len(changed), 4)
+        self.assertEqual(len([c for c in cells if c["key"] in changed]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from counter import Counter
+from runs import quiet, run
+from sim import config_for, make_sim
+from topology import POLICIES, Topology, random_policy, ring_policy
+
+
+def connected(neighbors):
+    seen = set([0])
+    todo = [0]
+    while todo:
+        for j in neighbors[todo.pop()]:
+            if j not in seen:
+                seen.add(j)
+                todo.append(j)
+    return len(seen) == len(neighbors)
+
+
+class PolicyTest(unittest.TestCase):
+    def check(self, neighbors, num_peers, degree):
+        self.assertEqual(len(neighbors), num_peers)
+        for (i, ns) in enumerate(neighbors):
+            self.assertFalse(i in ns)
+            self.assertTrue(0 < len(ns) <= degree)
+            for j in ns:
+                self.assertTrue(i in neighbors[j])
+        self.assertTrue(connected(neighbors))
+
+    def test_policies(self):
+        for policy in POLICIES.values():
+            for (num_peers, degree) in [(2, 2), (3, 2), (10, 2), (10, 4),
+                                        (10, 5), (7, 20)]:
+                self.check(policy(num_peers, degree, random.Random(3)),
+                           num_peers, degree)
+
+    def test_ring(self):
+        neighbors = ring_policy(6, 2, None)
+        self.assertEqual(neighbors[0], set([1, 5]))
+        self.assertEqual(neighbors[3], set([2, 4]))
+
+    def test_random_is_seeded(self):
+        self.assertEqual(random_policy(20, 4, random.Random(5)),
+                         random_policy(20, 4, random.Random(5)))
+
+
+class TopologyTest(unittest.TestCase):
+    def test_refresh(self):
+        t = Topology(12, 4, random_policy, 3, random.Random(1))
+        self.assertTrue(t.refresh(0))
+        first = t.linked
+        self.assertEqual(t.neighbors[0], tuple(sorted(first[0])))
+        self.assertFalse(t.refresh(1))
+        self.assertFalse(t.refresh(2))
+        self.assertTrue(t.linked is first)
+        self.assertTrue(t.refresh(3))
+
+    def test_never_refresh(self):
+        t = Topology(12, 4, ring_policy, 0, random.Random(1))
+        self.assertTrue(t.refresh(0))
+        self.assertFalse(t.refresh(100))
+
+    def test_are_neighbors(self):
+        t = Topology(6, 2, ring_policy, 0, None)
+        t.refresh(0)
+        self.assertTrue(t.are_neighbors(0, 5))
+        self.assertFalse(t.are_neighbors(0, 3))
+        self.assertFalse(t.are_neighbors(0, None))
+
+
+class NeighborhoodTest(unittest.TestCase):
+    def check_counts(self, **settings):
+        """The piece counts agents see are over them and their neighbors:
+        the same as counting what they can see"""
+        del Counter.seen[:]
+        config = config_for(["Seed"] + ["Counter"] * 8, num_pieces=6,
+                            blocks_per_piece=2, max_round=30, neighbors=2,
+                            **settings)
+        random.seed(5)
+        quiet(make_sim(config).run_sim_once)
+        self.assertTrue(len(Counter.seen) > 10)
+        for (counts, expected) in Counter.seen:
+            self.assertEqual(counts, expected)
+        # A peer and its 2 neighbors, not the swarm of 9
+        self.assertEqual(max(max(counts) for (counts, expected)
+                             in Counter.seen), 3)
+
+    def test_counts(self):
+        self.check_counts()
+        self.check_counts(piece_state="matrix", piece_sets="bitset")
+
+    def test_counts_event_engine(self):
+        self.check_counts(engine="event")
+
+    def test_agent_workers(self):
+        base = run(neighbors=3)
+        self.assertEqual(run(neighbors=3, agent_workers=2), base)
+
+
+if __name__ == "__main__":
+    unittest.main()
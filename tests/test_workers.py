@@ -0,0 +1,17 @@
+#!/usr/bin/python
+
+import logging
+import unittest
+
+from runs import run
+
+
+class WorkersTest(unittest.TestCase):
+    def test_same_summary(self):
+        # Iterations log in the workers' processes; compare the summary
+        self.assertEqual(run(logging.WARNING, workers=2),
+                         run(logging.WARNING))
+
+
+if __name__ == "__main__":
+    unittest.main()
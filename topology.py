@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+"""
+Tracker-style neighborhoods (sim.py --neighbors N).
+
+By default every peer sees, and can trade with, every other peer.  With a
+Topology, each peer only gets PeerInfo for its neighbors, and can only
+request from them.  The sim only moves blocks between neighbors, so even
+on rounds whose requests aren't validated (--trust-agents), nothing
+crosses a neighborhood; an upload to anyone else (say, an optimistic
+unchoke picked before the neighbors changed) just goes unused.
+
+Agents' history.piece_counts only count their own neighborhood too: each
+piece's count is how many of the peer and its neighbors had it at the
+start of the round (state.NeighborhoodCounts), so rarest-first agents go
+by what they can actually get rather than the whole swarm.
+
+Neighbor sets are symmetric and hold at most N peers, where N is at
+least 2: with one neighbor each, some peer would be left out entirely.  A
+policy picks them at the start of the run, and again every --refresh-every
+rounds, the way a tracker hands out fresh peer lists.
+
+Peers are referred to by their position in the sim's list of peers.  A
+policy is a function (num_peers, degree, rng) -> list of sets, where the
+i'th set holds the positions of peer i's neighbors.  To add one, put it in
+POLICIES.
+"""
+
+
+def random_policy(num_peers, degree, rng):
+    """
+    Link each peer to the ones before and after it in degree / 2 random
+    orderings of the swarm.  Every ordering adds at most two neighbors per
+    peer, and the first one already connects everybody.
+    """
+    neighbors = [set() for i in range(num_peers)]
+    order = range(num_peers)
+    for k in range(degree // 2):
+        rng.shuffle(order)
+        for (i, j) in zip(order, order[1:] + order[:1]):
+            if i != j:
+                neighbors[i].add(j)
+                neighbors[j].add(i)
+    return neighbors
+
+
+def ring_policy(num_peers, degree, rng):
+    """The degree / 2 peers on each side, in peer order.  Ignores rng."""
+    neighbors = [set() for i in range(num_peers)]
+    for i in range(num_peers):
+        for d in range(1, degree // 2 + 1):
+            j = (i + d) % num_peers
+            if i != j:
+                neighbors[i].add(j)
+                neighbors[j].add(i)
+    return neighbors
+
+
+POLICIES = {
+    "random": random_policy,
+    "ring": ring_policy,
+}
+
+
+class Topology:
+    """Who each peer can see and trade with."""
+    def __init__(self, num_peers, degree, policy, refresh_every, rng):
+        """
+        policy: one of the functions in POLICIES
+        refresh_every: pick new neighbors every this many rounds (0: never)
+        rng: random.Random the policy draws from
+        """
+        self.num_peers = num_peers
+        self.degree = degree
+        self.policy = policy
+        self.refresh_every = refresh_every
+        self.rng = rng
+        self.linked = []     # position -> set of neighbor positions
+        self.neighbors = []  # position -> sorted tuple of the same
+
+    def refresh(self, round):
+        """Pick new neighbors if it's time to.  Returns True if it did."""
+        if round > 0 and (self.refresh_every <= 0 or
+                          round % self.refresh_every != 0):
+            return False
+        self.linked = self.policy(self.num_peers, self.degree, self.rng)
+        self.neighbors = [tuple(sorted(s)) for s in self.linked]
+        return True
+
+    def are_neighbors(self, i, j):
+        return j in self.linked[i]